@@ -1,12 +1,20 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-import io
+import hashlib
 import json
 import os
 import shutil
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-from openpyxl.utils import get_column_letter
+import uuid
+
+from cache_fichiers import (chemin_temporaire, dossiers_recents, enregistrer_fichier, lire_fichier, lire_index,
+                             marquer_acces, remplacer_fichier)
+from chargement import (CONFIG_JOURNAUX_DEFAUT, VERSION_CHARGEUR_GL, charger_balance, grand_livre_en_dirhams,
+                        journaux_depuis_texte, parser_grand_livre)
+from delais import DELAI_MAX_DEFAUT, LIBELLES_TRANCHES, calculer_delais, date_cloture_par_defaut, synthese_par_fournisseur
+from export import FORMATS_EXPORT, exporter
+from profilage import ecrire_enregistrement, etape, etapes_en_tableau, nouveau_profil, terminer_profil
+from rapprochement import ecarts_par_fournisseur, traiter_rapprochement, traiter_rapprochement_incremental, verifier_solde
 
 # Configuration de la page
 st.set_page_config(
@@ -18,32 +26,167 @@ st.set_page_config(
 
 # Dossier de cache pour les fichiers uploadés
 CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache_files")
-CACHE_GL_FILE = os.path.join(CACHE_DIR, "grand_livre.xlsx")
-CACHE_BALANCE_FILE = os.path.join(CACHE_DIR, "balance.xlsx")
+# Fichiers uploadés de plusieurs dossiers clients, rangés par empreinte (voir cache_fichiers)
+CACHE_UPLOADS_DIR = os.path.join(CACHE_DIR, "uploads")
+# Ancien cache (un seul dossier) : repris dans le cache par empreinte au démarrage
+ANCIEN_CACHE_GL_FILE = os.path.join(CACHE_DIR, "grand_livre.xlsx")
+ANCIEN_CACHE_BALANCE_FILE = os.path.join(CACHE_DIR, "balance.xlsx")
+NOM_DOSSIER_ANCIEN_CACHE = "Dossier précédent"
+# Grand Livre déjà normalisé (Parquet), indexé par empreinte du fichier source
+CACHE_GL_PARQUET_DIR = os.path.join(CACHE_DIR, "grand_livre_parquet")
+# État du dernier rapprochement (résultats + empreintes par compte) pour le mode incrémental,
+# un sous-répertoire par dossier client
+CACHE_RAPPROCHEMENT_DIR = os.path.join(CACHE_DIR, "rapprochement")
+# Journal des performances : une ligne JSON par rapprochement (durée, lignes et mémoire par étape)
+PROFILS_FILE = os.path.join(CACHE_DIR, "profils_performance.jsonl")
+
+# Processus du rapprochement parallèle : le serveur Streamlit a plusieurs fils, un
+# fork direct pourrait bloquer un processus sur un verrou hérité (voir contexte_processus)
+METHODE_DEMARRAGE_PROCESSUS = 'forkserver'
+
+# Formats proposés au téléchargement
+LIBELLES_FORMATS_EXPORT = {'excel': 'Excel', 'parquet': 'Parquet', 'csv': 'CSV'}
 
 # Créer le dossier de cache s'il n'existe pas
 if not os.path.exists(CACHE_DIR):
     os.makedirs(CACHE_DIR)
 
-def save_uploaded_file(uploaded_file, cache_path):
-    """Sauvegarder un fichier uploadé dans le cache"""
+def reprendre_ancien_cache():
+    """Ranger le Grand Livre et la Balance de l'ancien cache (un seul dossier) dans le cache par empreinte"""
+    for chemin, type_fichier in ((ANCIEN_CACHE_GL_FILE, 'grand_livre'), (ANCIEN_CACHE_BALANCE_FILE, 'balance')):
+        try:
+            if os.path.exists(chemin):
+                with open(chemin, 'rb') as f:
+                    enregistrer_fichier(CACHE_UPLOADS_DIR, f.read(), os.path.basename(chemin), type_fichier,
+                                        NOM_DOSSIER_ANCIEN_CACHE)
+                os.remove(chemin)
+        except Exception:
+            pass
+
+def enregistrer_upload(uploaded_file, type_fichier, nom_dossier, empreinte=None, retirer_dossier=None):
+    """
+    Ranger un fichier uploadé dans le cache par empreinte ; les Grands Livres évincés
+    par le plafond de taille perdent aussi leur version normalisée (Parquet).
+    Retourne l'empreinte du fichier et si le dossier l'utilisait déjà.
+    """
+    empreinte, evinces, deja_associe = enregistrer_fichier(
+        CACHE_UPLOADS_DIR, uploaded_file.getvalue(), uploaded_file.name, type_fichier, nom_dossier,
+        empreinte=empreinte, retirer_dossier=retirer_dossier)
+    for empreinte_evincee in evinces:
+        supprimer_cache_grand_livre(empreinte_evincee)
+    return empreinte, deja_associe
+
+def empreinte_upload(uploaded_file, type_fichier, nom_dossier):
+    """
+    Empreinte d'un fichier uploadé, calculée une seule fois par upload. Session_state garde
+    pour chaque type de fichier l'identifiant de l'upload, sa taille, le dossier client et
+    l'empreinte : aux relances du script, le fichier n'est ni relu, ni haché, ni réécrit
+    (un changement de nom de dossier met seulement l'index du cache à jour : le fichier
+    quitte l'ancien nom si c'est cet upload qui l'y avait associé).
+    """
+    precedent = st.session_state.empreintes_fichiers.get(type_fichier)
+    meme_upload = (precedent is not None and precedent['file_id'] == uploaded_file.file_id
+                   and precedent['taille'] == uploaded_file.size)
+    if meme_upload and precedent['dossier'] == nom_dossier:
+        return precedent['empreinte']
+    renomme = meme_upload and not precedent['deja_associe']
+    empreinte, deja_associe = enregistrer_upload(
+        uploaded_file, type_fichier, nom_dossier,
+        empreinte=precedent['empreinte'] if meme_upload else None,
+        retirer_dossier=precedent['dossier'] if renomme else None)
+    st.session_state.empreintes_fichiers[type_fichier] = {
+        'file_id': uploaded_file.file_id,
+        'taille': uploaded_file.size,
+        'dossier': nom_dossier,
+        'deja_associe': deja_associe,
+        'empreinte': empreinte
+    }
+    return empreinte
+
+def empreinte_reprise(empreinte, type_fichier, nom_dossier):
+    """Fichier repris d'un dossier récent : dernier accès mis à jour une fois par reprise, sans lecture"""
+    precedent = st.session_state.empreintes_fichiers.get(type_fichier)
+    if precedent is None or precedent['file_id'] is not None or precedent['empreinte'] != empreinte:
+        marquer_acces(CACHE_UPLOADS_DIR, [empreinte])
+        st.session_state.empreintes_fichiers[type_fichier] = {
+            'file_id': None, 'taille': None, 'dossier': nom_dossier, 'empreinte': empreinte
+        }
+    return empreinte
+
+def supprimer_cache_grand_livre(empreinte):
+    """Supprimer les Grands Livres normalisés (toutes versions du chargeur) d'un fichier source"""
+    try:
+        for nom in os.listdir(CACHE_GL_PARQUET_DIR):
+            if nom.startswith(empreinte + "_v"):
+                os.remove(os.path.join(CACHE_GL_PARQUET_DIR, nom))
+    except Exception:
+        pass
+
+def contenu_fichier(uploaded_file, empreinte):
+    """Contenu d'un fichier : celui de l'uploader, sinon celui du cache (fichier repris d'un dossier récent)"""
+    if uploaded_file is not None:
+        return uploaded_file.getvalue()
+    contenu = lire_fichier(CACHE_UPLOADS_DIR, empreinte)
+    if contenu is None:
+        raise FileNotFoundError("Fichier absent du cache : rechargez-le")
+    return contenu
+
+def libelle_dossier(dossier):
+    """Libellé d'un dossier récent : nom, dernier accès et taille"""
+    date = datetime.fromisoformat(dossier['dernier_acces']).strftime('%d/%m/%Y %H:%M')
+    taille = f"{dossier['taille'] / (1024 * 1024):.1f}".replace('.', ',')
+    return f"{dossier['dossier']} - {date} - {taille} Mo"
+
+def dossier_etat_rapprochement(nom_dossier):
+    """Répertoire de l'état incrémental d'un dossier client (nom haché : utilisable dans un chemin)"""
+    return os.path.join(CACHE_RAPPROCHEMENT_DIR, hashlib.sha256(nom_dossier.encode('utf-8')).hexdigest()[:16])
+
+def lire_json_etat(chemin_etat):
+    """etat.json d'un dossier (None si absent ou illisible)"""
     try:
-        with open(cache_path, 'wb') as f:
-            f.write(uploaded_file.getbuffer())
-        return True
+        with open(chemin_etat, 'r', encoding='utf-8') as f:
+            return json.load(f)
     except Exception:
-        return False
+        return None
 
-def load_cached_file(cache_path):
-    """Charger un fichier depuis le cache"""
+def lire_etat_rapprochement(nom_dossier):
+    """Relire l'état du dernier rapprochement du dossier client (None si absent)"""
+    dossier = dossier_etat_rapprochement(nom_dossier)
+    etat = lire_json_etat(os.path.join(dossier, "etat.json"))
     try:
-        if os.path.exists(cache_path):
-            with open(cache_path, 'rb') as f:
-                return f.read()
+        if etat is not None:
+            etat['resultats'] = pd.read_parquet(os.path.join(dossier, etat.pop('fichier_resultats')))
+            return etat
     except Exception:
         pass
     return None
 
+def ecrire_etat_rapprochement(nom_dossier, etat):
+    """
+    Sauvegarder l'état du rapprochement du dossier client pour le prochain calcul
+    incrémental. Les résultats sont écrits sous un nom unique que référence etat.json,
+    remplacé en dernier : une session concurrente lit toujours un état complet.
+    """
+    dossier = dossier_etat_rapprochement(nom_dossier)
+    chemin_etat = os.path.join(dossier, "etat.json")
+    try:
+        etat_precedent = lire_json_etat(chemin_etat)
+        fichier_resultats = f"resultats_{uuid.uuid4().hex}.parquet"
+        temporaire = chemin_temporaire(dossier)
+        etat['resultats'].to_parquet(temporaire, index=False)
+        os.replace(temporaire, os.path.join(dossier, fichier_resultats))
+        remplacer_fichier(chemin_etat, json.dumps(
+            {**{k: v for k, v in etat.items() if k != 'resultats'}, 'fichier_resultats': fichier_resultats}
+        ).encode('utf-8'))
+    except Exception:
+        return
+    # Résultats de l'état remplacé
+    try:
+        if etat_precedent is not None:
+            os.remove(os.path.join(dossier, etat_precedent['fichier_resultats']))
+    except Exception:
+        pass
+
 # CSS moderne et épuré - Thème Synergie Experts
 st.markdown("""
 <style>
@@ -238,10 +381,7 @@ CONFIG_FILE = os.path.join(os.path.dirname(__file__), "config_journaux.json")
 
 def load_config():
     """Charger la configuration des journaux depuis le fichier"""
-    default_config = {
-        "journaux_achat": "ACHAT\nACH",
-        "journaux_banque": "BANQUE\nBNQ\nCHEQUE"
-    }
+    default_config = dict(CONFIG_JOURNAUX_DEFAUT)
     try:
         if os.path.exists(CONFIG_FILE):
             with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
@@ -250,12 +390,14 @@ def load_config():
         pass
     return default_config
 
-def save_config(journaux_achat, journaux_banque):
+def save_config(journaux_achat, journaux_banque, nb_processus=1, delai_max=DELAI_MAX_DEFAUT):
     """Sauvegarder la configuration des journaux"""
     try:
         config = {
             "journaux_achat": journaux_achat,
-            "journaux_banque": journaux_banque
+            "journaux_banque": journaux_banque,
+            "nb_processus": nb_processus,
+            "delai_max": delai_max
         }
         with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
             json.dump(config, f, ensure_ascii=False, indent=2)
@@ -270,6 +412,11 @@ if 'gl_loaded_from_cache' not in st.session_state:
     st.session_state.gl_loaded_from_cache = False
 if 'balance_loaded_from_cache' not in st.session_state:
     st.session_state.balance_loaded_from_cache = False
+# Empreinte des fichiers en cours, par type (voir empreinte_upload)
+if 'empreintes_fichiers' not in st.session_state:
+    st.session_state.empreintes_fichiers = {}
+
+reprendre_ancien_cache()
 
 # ========== ZONE DE CONFIGURATION (dans la page principale) ==========
 col_files, col_journals = st.columns([1, 1])
@@ -277,6 +424,13 @@ col_files, col_journals = st.columns([1, 1])
 with col_files:
     st.markdown('<div class="config-box"><h4>📁 Fichiers à charger</h4>', unsafe_allow_html=True)
     
+    nom_dossier_saisi = st.text_input(
+        "Dossier client",
+        key="nom_dossier",
+        placeholder="Par défaut : nom du fichier Grand Livre",
+        help="Nom sous lequel les fichiers chargés sont conservés, pour reprendre le dossier plus tard"
+    )
+    
     grand_livre_file = st.file_uploader(
         "Grand Livre (Excel)",
         type=['xlsx', 'xls'],
@@ -284,16 +438,6 @@ with col_files:
         key="gl_uploader"
     )
     
-    # Sauvegarder le fichier uploadé dans le cache
-    if grand_livre_file is not None:
-        save_uploaded_file(grand_livre_file, CACHE_GL_FILE)
-        grand_livre_file.seek(0)
-    elif os.path.exists(CACHE_GL_FILE):
-        cached_gl = load_cached_file(CACHE_GL_FILE)
-        if cached_gl:
-            grand_livre_file = io.BytesIO(cached_gl)
-            grand_livre_file.name = "grand_livre.xlsx"
-    
     balance_file = st.file_uploader(
         "Balance Fournisseurs (Excel)",
         type=['xlsx', 'xls'],
@@ -301,22 +445,46 @@ with col_files:
         key="balance_uploader"
     )
     
+    # Fichier non uploadé : repris d'un dossier récent (le plus récemment utilisé par défaut)
+    dossiers = {dossier['dossier']: dossier for dossier in dossiers_recents(lire_index(CACHE_UPLOADS_DIR))}
+    dossier_repris = None
+    if dossiers and (grand_livre_file is None or balance_file is None):
+        nom_dossier_repris = st.selectbox(
+            "Reprendre un dossier récent",
+            list(dossiers),
+            format_func=lambda nom: libelle_dossier(dossiers[nom]),
+            key="dossier_recent",
+            help="Les fichiers non chargés ci-dessus sont repris de ce dossier"
+        )
+        dossier_repris = dossiers[nom_dossier_repris]
+
+    # Sauvegarder les fichiers uploadés dans le cache, sous le nom du dossier client
+    nom_dossier = nom_dossier_saisi.strip() or (
+        os.path.splitext(grand_livre_file.name)[0] if grand_livre_file is not None
+        else dossier_repris['dossier'] if dossier_repris is not None else "Sans nom")
+    gl_empreinte = balance_empreinte = None
+    if grand_livre_file is not None:
+        gl_empreinte = empreinte_upload(grand_livre_file, 'grand_livre', nom_dossier)
     if balance_file is not None:
-        save_uploaded_file(balance_file, CACHE_BALANCE_FILE)
-        balance_file.seek(0)
-    elif os.path.exists(CACHE_BALANCE_FILE):
-        cached_balance = load_cached_file(CACHE_BALANCE_FILE)
-        if cached_balance:
-            balance_file = io.BytesIO(cached_balance)
-            balance_file.name = "balance.xlsx"
+        balance_empreinte = empreinte_upload(balance_file, 'balance', nom_dossier)
+
+    if dossier_repris is not None:
+        if grand_livre_file is None and dossier_repris['grand_livre']:
+            gl_empreinte = empreinte_reprise(dossier_repris['grand_livre'], 'grand_livre', nom_dossier)
+        if balance_file is None and dossier_repris['balance']:
+            balance_empreinte = empreinte_reprise(dossier_repris['balance'], 'balance', nom_dossier)
     
     # Bouton pour effacer le cache
-    if os.path.exists(CACHE_GL_FILE) or os.path.exists(CACHE_BALANCE_FILE):
+    if os.path.exists(CACHE_UPLOADS_DIR):
         if st.button("🗑️ Effacer le cache", key="clear_cache"):
-            if os.path.exists(CACHE_GL_FILE):
-                os.remove(CACHE_GL_FILE)
-            if os.path.exists(CACHE_BALANCE_FILE):
-                os.remove(CACHE_BALANCE_FILE)
+            if os.path.exists(CACHE_UPLOADS_DIR):
+                shutil.rmtree(CACHE_UPLOADS_DIR)
+            if os.path.exists(CACHE_GL_PARQUET_DIR):
+                shutil.rmtree(CACHE_GL_PARQUET_DIR)
+            if os.path.exists(CACHE_RAPPROCHEMENT_DIR):
+                shutil.rmtree(CACHE_RAPPROCHEMENT_DIR)
+            st.session_state.pop('rapprochement', None)
+            st.session_state.empreintes_fichiers = {}
             st.rerun()
     
     st.markdown('</div>', unsafe_allow_html=True)
@@ -334,7 +502,7 @@ with col_journals:
             key="journaux_achat_input",
             help="Un code journal par ligne"
         )
-        journaux_achat = [j.strip() for j in journaux_achat_input.split('\n') if j.strip()]
+        journaux_achat = journaux_depuis_texte(journaux_achat_input)
     
     with col_j2:
         journaux_banque_input = st.text_area(
@@ -344,1686 +512,189 @@ with col_journals:
             key="journaux_banque_input",
             help="Un code journal par ligne"
         )
-        journaux_banque = [j.strip() for j in journaux_banque_input.split('\n') if j.strip()]
+        journaux_banque = journaux_depuis_texte(journaux_banque_input)
+    
+    col_p1, col_p2 = st.columns(2)
+    with col_p1:
+        # Rapprochement parallèle : les fournisseurs sont répartis sur plusieurs processus
+        nb_processus = st.number_input(
+            "Processus de calcul",
+            min_value=1,
+            max_value=os.cpu_count() or 1,
+            value=min(int(config.get("nb_processus", 1)), os.cpu_count() or 1),
+            step=1,
+            key="nb_processus_input",
+            help="1 = traitement séquentiel. Au-delà, les fournisseurs sont rapprochés en parallèle (utile pour les gros Grands Livres)"
+        )
+    with col_p2:
+        delai_max = st.number_input(
+            "Délai maximal (jours)",
+            min_value=1,
+            max_value=365,
+            value=int(config.get("delai_max", DELAI_MAX_DEFAUT)),
+            step=1,
+            key="delai_max_input",
+            help="Délai de paiement convenu (60 jours par défaut, 120 jours au plus par accord) : "
+                 "au-delà, la facture est en retard"
+        )
+    
+    mode_incremental = st.checkbox(
+        "Rapprochement incrémental",
+        value=True,
+        key="mode_incremental",
+        help="Ne recalculer que les fournisseurs dont les écritures ont changé depuis le dernier rapprochement"
+    )
     
     st.markdown('</div>', unsafe_allow_html=True)
 
 # Sauvegarder la configuration si elle a changé
-if journaux_achat_input != config.get("journaux_achat") or journaux_banque_input != config.get("journaux_banque"):
-    save_config(journaux_achat_input, journaux_banque_input)
+if (journaux_achat_input != config.get("journaux_achat")
+        or journaux_banque_input != config.get("journaux_banque")
+        or nb_processus != config.get("nb_processus", 1)
+        or delai_max != config.get("delai_max", DELAI_MAX_DEFAUT)):
+    save_config(journaux_achat_input, journaux_banque_input, nb_processus, delai_max)
+
+def cle_cache_grand_livre(empreinte):
+    """Clé du cache disque : empreinte (SHA-256) du fichier uploadé + version du chargeur"""
+    return f"{empreinte}_v{VERSION_CHARGEUR_GL}"
+
+def lire_cache_grand_livre(cle):
+    """Relire un Grand Livre normalisé depuis le cache Parquet (None si absent)"""
+    chemin = os.path.join(CACHE_GL_PARQUET_DIR, cle)
+    try:
+        if os.path.exists(chemin + ".parquet") and os.path.exists(chemin + ".json"):
+            with open(chemin + ".json", 'r', encoding='utf-8') as f:
+                stats_chargement = json.load(f)
+            return pd.read_parquet(chemin + ".parquet"), stats_chargement
+    except Exception:
+        pass
+    return None
+
+def ecrire_cache_grand_livre(cle, df, stats_chargement):
+    """Sauvegarder un Grand Livre normalisé dans le cache Parquet"""
+    chemin = os.path.join(CACHE_GL_PARQUET_DIR, cle)
+    temporaire = None
+    try:
+        # Temporaire propre à la session puis renommage : jamais de Parquet tronqué, même
+        # si deux sessions chargent le même Grand Livre ; le JSON, écrit en dernier,
+        # signale un cache complet
+        temporaire = chemin_temporaire(CACHE_GL_PARQUET_DIR)
+        df.to_parquet(temporaire, index=False)
+        os.replace(temporaire, chemin + ".parquet")
+        remplacer_fichier(chemin + ".json", json.dumps(stats_chargement).encode('utf-8'))
+    except Exception:
+        try:
+            if temporaire is not None and os.path.exists(temporaire):
+                os.remove(temporaire)
+        except OSError:
+            pass
 
 # Fonction pour charger le grand livre (sans en-tête)
+# (clé du cache Streamlit : l'empreinte seule ; _fichier et _profil n'en font pas partie,
+# le contenu n'est lu que si le Grand Livre n'est dans aucun cache)
 @st.cache_data
-def load_grand_livre(file_bytes):
-    df = pd.read_excel(io.BytesIO(file_bytes), header=None)
-
-    colonnes = {
-        0: 'Date',           # A
-        1: 'Journal',        # B
-        2: 'Compte',         # C
-        3: 'NumPiece',       # D
-        4: 'Libelle',        # E
-        5: 'MontantMvt',     # F
-        6: 'MontantFacture', # G
-        8: 'Lettrage'        # I
-    }
-
-    cols_to_keep = {k: v for k, v in colonnes.items() if k < len(df.columns)}
-    df = df[list(cols_to_keep.keys())].copy()
-    df.columns = list(cols_to_keep.values())
-
-    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-
-    # Créer les colonnes manquantes avec des zéros si elles n'existent pas
-    if 'MontantMvt' not in df.columns:
-        df['MontantMvt'] = 0
-    else:
-        df['MontantMvt'] = pd.to_numeric(df['MontantMvt'], errors='coerce').fillna(0)
-
-    if 'MontantFacture' not in df.columns:
-        df['MontantFacture'] = 0
-    else:
-        df['MontantFacture'] = pd.to_numeric(df['MontantFacture'], errors='coerce').fillna(0)
-
-    # Vérifier si la colonne Lettrage existe
-    if 'Lettrage' not in df.columns:
-        df['Lettrage'] = ''
-    else:
-        df['Lettrage'] = df['Lettrage'].astype(str).str.strip()
-        df.loc[df['Lettrage'] == 'nan', 'Lettrage'] = ''
-
-    df['Compte'] = df['Compte'].astype(str).str.strip()
-    df['Compte'] = df['Compte'].apply(lambda x: x[:-2] if x.endswith('.0') else x)
-
-    df['NumPiece'] = df['NumPiece'].astype(str).str.strip()
-    df['NumPiece'] = df['NumPiece'].apply(lambda x: x[:-2] if x.endswith('.0') else x)
-    df.loc[df['NumPiece'] == 'nan', 'NumPiece'] = ''
-
-    # Nettoyer la colonne Journal (enlever espaces)
-    if 'Journal' in df.columns:
-        df['Journal'] = df['Journal'].astype(str).str.strip()
-        df.loc[df['Journal'] == 'nan', 'Journal'] = ''
-
-    return df
+def load_grand_livre(empreinte, _fichier=None, _profil=None):
+    cle = cle_cache_grand_livre(empreinte)
+    with etape(_profil, 'lecture_cache_parquet'):
+        resultat_cache = lire_cache_grand_livre(cle)
+    if resultat_cache is not None:
+        return resultat_cache
+
+    df, stats_chargement = parser_grand_livre(contenu_fichier(_fichier, empreinte), _profil)
+    with etape(_profil, 'ecriture_cache_parquet', len(df)):
+        ecrire_cache_grand_livre(cle, df, stats_chargement)
+    return df, stats_chargement
 
 @st.cache_data
-def load_balance(file_bytes):
-    df_with_header = pd.read_excel(io.BytesIO(file_bytes), header=0)
-    first_col = df_with_header.columns[0]
-    if isinstance(first_col, (int, float)) or (isinstance(first_col, str) and first_col.replace('.', '').isdigit()):
-        df = pd.read_excel(io.BytesIO(file_bytes), header=None)
-        return df, False
-    return df_with_header, True
-
-def creer_dict_fournisseurs(balance_df, has_header):
-    dict_fournisseurs = {}
-    col_compte = None
-    col_nom = None
-
-    if has_header:
-        cols = balance_df.columns.tolist()
-        for col in cols:
-            col_str = str(col).lower()
-            if any(x in col_str for x in ['compte', 'n°', 'numero', 'code', 'num']):
-                col_compte = col
-                break
-        for col in cols:
-            col_str = str(col).lower()
-            if any(x in col_str for x in ['nom', 'intitule', 'intitulé', 'libelle', 'libellé', 'raison', 'designation', 'désignation']):
-                col_nom = col
-                break
-
-    if col_compte is None or col_nom is None:
-        if len(balance_df.columns) >= 2:
-            col_compte = balance_df.columns[0]
-            col_nom = balance_df.columns[1]
-
-    if col_compte is not None and col_nom is not None:
-        for _, row in balance_df.iterrows():
-            compte_raw = row[col_compte]
-            if pd.isna(compte_raw):
-                continue
-            compte = str(compte_raw).strip()
-            if compte.endswith('.0'):
-                compte = compte[:-2]
-            nom = str(row[col_nom]).strip() if pd.notna(row[col_nom]) else ''
-            if compte and compte != 'nan' and nom and nom != 'nan':
-                dict_fournisseurs[compte] = nom
-
-    return dict_fournisseurs, col_compte, col_nom
-
-def generer_nouvelle_lettre(lettres_utilisees):
-    """Génère une nouvelle lettre de lettrage non utilisée"""
-    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
-    # Essayer lettres simples
-    for lettre in alphabet:
-        if lettre not in lettres_utilisees:
-            return lettre
-    # Essayer combinaisons AA, AB, etc.
-    for l1 in alphabet:
-        for l2 in alphabet:
-            combo = l1 + l2
-            if combo not in lettres_utilisees:
-                return combo
-    # Essayer AAA, AAB, etc.
-    for l1 in alphabet:
-        for l2 in alphabet:
-            for l3 in alphabet:
-                combo = l1 + l2 + l3
-                if combo not in lettres_utilisees:
-                    return combo
-    return "ZZZ"
-
-def corriger_erreurs_lettrage(grand_livre_df, journaux_achat, journaux_banque):
+def load_balance(empreinte, _fichier=None):
+    """Balance et dictionnaire des fournisseurs, mis en cache ensemble (clé : empreinte du fichier)"""
+    return charger_balance(contenu_fichier(_fichier, empreinte))
+
+def cle_session_rapprochement(gl_empreinte, balance_empreinte, journaux_achat, journaux_banque):
+    """Identité d'un rapprochement : empreintes du Grand Livre et de la Balance + journaux"""
+    return (
+        gl_empreinte,
+        balance_empreinte,
+        tuple(journaux_achat),
+        tuple(journaux_banque)
+    )
+
+def generateur_export(exports, resultats_df, format_export, synthese_df=None, ecarts_df=None):
     """
-    Fonction désactivée - le lettrage du grand livre est utilisé tel quel.
-    La correction automatique créait des lettrages artificiels qui cassaient
-    l'affectation correcte des avoirs aux factures.
+    Fichier à télécharger, généré seulement au clic (st.download_button appelle la
+    fonction renvoyée, hors exécution du script) puis conservé dans `exports` : les
+    téléchargements suivants des mêmes résultats réutilisent les mêmes octets.
     """
-    return {}
-
-def traiter_rapprochement(grand_livre_df, dict_fournisseurs, journaux_achat, journaux_banque):
-
-    journaux_connus = set(journaux_achat + journaux_banque)
-
-    # Corriger les erreurs de lettrage
-    corrections_lettrage = corriger_erreurs_lettrage(grand_livre_df, journaux_achat, journaux_banque)
-
-    # Ajouter une colonne de lettrage corrigé au grand livre
-    def get_lettrage_corrige(row):
-        key = (row['Compte'], row['NumPiece'], row['Date'], row['MontantFacture'])
-        if key in corrections_lettrage:
-            return corrections_lettrage[key]
-        key2 = (row['Compte'], row['NumPiece'], row['Date'], row['MontantMvt'])
-        if key2 in corrections_lettrage:
-            return corrections_lettrage[key2]
-        return row['Lettrage']
-
-    grand_livre_df = grand_livre_df.copy()
-    grand_livre_df['LettrageCorrige'] = grand_livre_df.apply(get_lettrage_corrige, axis=1)
-
-    # === DÉTECTION DES EFFETS À PAYER (comptes 4415) ===
-    # Les effets à payer permettent de trouver la vraie date de paiement des factures
-    # Flux: Facture 4411 -> Effet créé (4411 soldé, 4415 crédité) -> Paiement réel (4415 débité)
-    
-    dict_paiements_effet = {}  # Clé: (compte_4411, lettrage_4411) -> {date_paiement, montant}
-    
-    # Identifier les comptes 4415 (effets à payer)
-    comptes_4415 = grand_livre_df[
-        grand_livre_df['Compte'].astype(str).str.startswith('4415')
-    ]['Compte'].unique()
-    
-    if len(comptes_4415) > 0:
-        # Pour chaque effet créé sur 4415 (MontantFacture > 0), trouver le paiement correspondant
-        effets_4415 = grand_livre_df[
-            (grand_livre_df['Compte'].astype(str).str.startswith('4415')) &
-            (grand_livre_df['MontantFacture'] > 0)
-        ]
-        
-        for _, effet in effets_4415.iterrows():
-            montant_effet = effet['MontantFacture']
-            date_creation = effet['Date']
-            lettrage_4415 = str(effet['LettrageCorrige']).strip()
-            compte_4415 = str(effet['Compte']).strip()
-            
-            if not lettrage_4415:
-                continue
-                
-            # Trouver le paiement réel sur 4415 (même compte, même lettrage, MontantMvt > 0)
-            paiement_4415 = grand_livre_df[
-                (grand_livre_df['Compte'] == compte_4415) &
-                (grand_livre_df['LettrageCorrige'].astype(str).str.strip() == lettrage_4415) &
-                (grand_livre_df['MontantMvt'] > 0)
-            ]
-            
-            if len(paiement_4415) > 0:
-                date_paiement_reel = paiement_4415.iloc[0]['Date']
-                
-                # Trouver le mouvement correspondant sur 4411 (même montant, même date que création effet)
-                # C'est le mouvement qui solde le 4411 en créditant le 4415
-                mvt_4411_effet = grand_livre_df[
-                    (grand_livre_df['Compte'].astype(str).str.startswith('4411')) &
-                    (grand_livre_df['MontantMvt'] == montant_effet) &
-                    (grand_livre_df['Date'] == date_creation)
-                ]
-                
-                if len(mvt_4411_effet) > 0:
-                    compte_4411 = str(mvt_4411_effet.iloc[0]['Compte']).strip()
-                    lettrage_4411 = str(mvt_4411_effet.iloc[0]['LettrageCorrige']).strip()
-                    
-                    if lettrage_4411:
-                        # Stocker: pour ce groupe (compte, lettrage) sur 4411, 
-                        # le paiement réel est à cette date
-                        key = (compte_4411, lettrage_4411)
-                        if key not in dict_paiements_effet:
-                            dict_paiements_effet[key] = {
-                                'date_paiement': date_paiement_reel,
-                                'montant': montant_effet,
-                                'date_effet': date_creation
-                            }
-                        else:
-                            # Si plusieurs effets pour le même groupe, on cumule
-                            dict_paiements_effet[key]['montant'] += montant_effet
-
-    # Identifier les factures
-    lignes_fournisseurs = grand_livre_df[
-        (grand_livre_df['Compte'].astype(str).str.startswith('4411')) &
-        (grand_livre_df['Journal'].isin(journaux_achat))
-    ].copy()
-
-    factures = lignes_fournisseurs[lignes_fournisseurs['MontantFacture'] != 0].copy()
-
-    # Identifier les avoirs (avec détails pour affectation chronologique)
-    avoirs = grand_livre_df[
-        (grand_livre_df['Compte'].astype(str).str.startswith('4411')) &
-        (grand_livre_df['Journal'].isin(journaux_achat)) &
-        (grand_livre_df['MontantMvt'] > 0)
-    ].copy()
-
-    # Séparer avoirs lettrés et non lettrés
-    avoirs_non_lettres = []
-    
-    # Dictionnaire des avoirs par (compte, lettrage) - liste avec dates pour tri chronologique
-    avoirs_par_groupe = {}
-    for _, avoir in avoirs.iterrows():
-        compte = str(avoir['Compte']).strip()
-        lettrage = str(avoir['LettrageCorrige']).strip()
-        if lettrage:
-            key = (compte, lettrage)
-            if key not in avoirs_par_groupe:
-                avoirs_par_groupe[key] = []
-            avoirs_par_groupe[key].append({
-                'date': avoir['Date'],
-                'montant': avoir['MontantMvt'],
-                'type': 'avoir',
-                'avoir_obj': avoir  # Stocker l'objet complet pour accès aux détails
-            })
-        else:
-            # Avoir sans lettrage - à traiter séparément
-            avoirs_non_lettres.append(avoir)
-
-    # Identifier les paiements
-    paiements = grand_livre_df[
-        (grand_livre_df['Journal'].isin(journaux_banque)) &
-        (grand_livre_df['Compte'].astype(str).str.startswith('4411')) &
-        (grand_livre_df['MontantMvt'] != 0)
-    ].copy()
-
-    # Identifier les remboursements fournisseurs (journal banque avec MontantFacture > 0)
-    # Ces remboursements représentent un retour d'argent au fournisseur (avoir encaissé)
-    remboursements_fournisseurs = grand_livre_df[
-        (grand_livre_df['Journal'].isin(journaux_banque)) &
-        (grand_livre_df['Compte'].astype(str).str.startswith('4411')) &
-        (grand_livre_df['MontantFacture'] > 0)
-    ].copy()
-
-    # Identifier les remboursements fournisseurs non lettrés
-    # Critères : Journal banque + Compte 4411 + MontantFacture > 0 + Lettrage vide
-    remboursements_non_lettres = grand_livre_df[
-        (grand_livre_df['Journal'].isin(journaux_banque)) &
-        (grand_livre_df['Compte'].astype(str).str.startswith('4411')) &
-        (grand_livre_df['MontantFacture'] > 0) &
-        ((grand_livre_df['LettrageCorrige'].str.strip() == '') | (grand_livre_df['LettrageCorrige'].isna()))
-    ].copy()
-
-    # Dictionnaire des paiements par (compte, lettrage) - liste avec dates pour tri chronologique
-    paiements_par_groupe = {}
-    for _, paiement in paiements.iterrows():
-        compte = str(paiement['Compte']).strip()
-        lettrage = str(paiement['LettrageCorrige']).strip()
-        if lettrage:
-            key = (compte, lettrage)
-            if key not in paiements_par_groupe:
-                paiements_par_groupe[key] = []
-            paiements_par_groupe[key].append({
-                'date': paiement['Date'],
-                'montant': abs(paiement['MontantMvt']),
-                'type': 'paiement',
-                'paiement_obj': paiement
-            })
-
-    # Ajouter les paiements par effet à paiements_par_groupe
-    # Ces paiements ont une date de paiement réelle différente de la date de l'effet
-    for key, effet_info in dict_paiements_effet.items():
-        compte, lettrage = key
-        if key not in paiements_par_groupe:
-            paiements_par_groupe[key] = []
-        paiements_par_groupe[key].append({
-            'date': effet_info['date_paiement'],  # Date du paiement réel sur 4415
-            'montant': effet_info['montant'],
-            'type': 'paiement_effet',
-            'paiement_obj': None  # Pas d'objet paiement, c'est un effet
-        })
-
-    # Ajouter les remboursements lettrés à paiements_par_groupe (avec montant négatif)
-    # Un remboursement est un "paiement négatif" - le fournisseur nous rend de l'argent
-    remboursements_par_groupe = {}
-    for _, remb in remboursements_fournisseurs.iterrows():
-        compte = str(remb['Compte']).strip()
-        lettrage = str(remb['LettrageCorrige']).strip()
-        if lettrage:
-            key = (compte, lettrage)
-            if key not in remboursements_par_groupe:
-                remboursements_par_groupe[key] = []
-            remboursements_par_groupe[key].append({
-                'date': remb['Date'],
-                'montant': remb['MontantFacture'],  # Montant du remboursement
-                'type': 'remboursement',
-                'remboursement_obj': remb
-            })
-
-    # Identifier les OD lettrées - Journal différent de achat/banque + Lettrage présent
-    # On distingue deux types selon le CONTEXTE du groupe :
-    # 1. Écarts de change : MontantMvt > 0 → toujours réparti sur les factures
-    # 2. OD avec MontantFacture > 0 et MontantMvt = 0 :
-    #    - Si le groupe a des PAIEMENTS → c'est une perte/gain de change → répartir
-    #    - Si le groupe N'A PAS de paiements → c'est un reclassement → ligne séparée
-    
-    od_lignes_all = grand_livre_df[
-        (grand_livre_df['Compte'].astype(str).str.startswith('4411')) &
-        (~grand_livre_df['Journal'].isin(journaux_connus)) &
-        ((grand_livre_df['MontantFacture'] > 0) | (grand_livre_df['MontantMvt'] > 0)) &
-        (grand_livre_df['LettrageCorrige'].str.strip() != '') &
-        (grand_livre_df['LettrageCorrige'].notna())
-    ].copy()
-
-    # Séparer les OD selon leur type
-    # Type 1 : MontantMvt > 0 (écarts de change classiques)
-    od_ecarts_change_mvt = od_lignes_all[od_lignes_all['MontantMvt'] > 0].copy()
-    
-    # Type 2 : MontantFacture > 0 et MontantMvt = 0 (à classifier selon contexte)
-    od_montant_facture = od_lignes_all[
-        (od_lignes_all['MontantFacture'] > 0) & 
-        (od_lignes_all['MontantMvt'] == 0)
-    ].copy()
-
-    # Stocker les écarts de change (MontantMvt > 0) pour répartition
-    # SAUF les mouvements vers 4415 (effets) qui sont traités comme des paiements
-    dict_od_brut = {}
-    for _, od in od_ecarts_change_mvt.iterrows():
-        compte = str(od['Compte']).strip()
-        lettrage = str(od['LettrageCorrige']).strip()
-        if lettrage:
-            key = (compte, lettrage)
-            montant_od = abs(od['MontantMvt'])
-            
-            # Vérifier si c'est un effet (paiement via 4415)
-            if key in dict_paiements_effet:
-                # C'est un effet, pas une OD - déjà traité comme paiement
-                continue
-            
-            if key not in dict_od_brut:
-                dict_od_brut[key] = 0
-            dict_od_brut[key] += montant_od
-    
-    # Grouper les factures par (compte, lettrage) - nécessaire AVANT la classification des OD
-    factures_par_groupe = {}
-    for _, facture in factures.iterrows():
-        compte = str(facture['Compte']).strip()
-        lettrage = str(facture['LettrageCorrige']).strip()
-        key = (compte, lettrage)
-        if key not in factures_par_groupe:
-            factures_par_groupe[key] = []
-        factures_par_groupe[key].append(facture)
-
-    # Trier les factures par date dans chaque groupe
-    for key in factures_par_groupe:
-        factures_par_groupe[key] = sorted(
-            factures_par_groupe[key],
-            key=lambda x: x['Date'] if pd.notna(x['Date']) else pd.Timestamp.max
+    def generer():
+        if format_export not in exports:
+            exports[format_export] = exporter(resultats_df, format_export, synthese_df, ecarts_df).getvalue()
+        return exports[format_export]
+    return generer
+
+def formater_resultats_affichage(resultats_df):
+    """Résultats mis en forme pour l'affichage (dates jj/mm/aaaa, montants '1 234,56', zéros '-')"""
+    display_df = resultats_df.copy()
+    for col in ['Date de facture', 'Date de paiement', 'Échéance']:
+        if col in display_df.columns:
+            display_df[col] = display_df[col].dt.strftime('%d/%m/%Y')
+
+    colonnes_montants = ['Montant de la facture', 'Avoir', 'Montant facture net',
+                        'Montant du paiement', 'OD', 'Montant du paiement groupé', 'Solde',
+                        'Montant en retard', 'Montant des factures', 'Dont non payé'] + LIBELLES_TRANCHES[1:] + [
+                        'Solde Grand Livre (G - F)', 'Solde calculé', 'Écart']
+    for col in colonnes_montants:
+        if col in display_df.columns:
+            display_df[col] = display_df[col].apply(
+                lambda x: "-" if x == 0 else f"{x:,.2f}".replace(',', ' ').replace('.', ',') if pd.notna(x) else ''
+            )
+
+    # Délais (entiers avec valeurs manquantes) : en texte, vide si absent
+    for col in display_df.columns:
+        if isinstance(display_df[col].dtype, pd.Int64Dtype):
+            display_df[col] = display_df[col].astype('string').fillna('').astype(object)
+    if 'Délai moyen (jours)' in display_df.columns:
+        display_df['Délai moyen (jours)'] = display_df['Délai moyen (jours)'].apply(
+            lambda x: f"{x:.1f}".replace('.', ',') if pd.notna(x) else ''
         )
-    
-    # Pour les OD avec MontantFacture > 0 : classifier selon le contexte du groupe
-    # - Si groupe a des FACTURES ET des paiements → répartir sur factures
-    # - Sinon (pas de factures ou pas de paiements) → reclassement
-    od_reclassements_par_groupe = {}
-    for _, od in od_montant_facture.iterrows():
-        compte = str(od['Compte']).strip()
-        lettrage = str(od['LettrageCorrige']).strip()
-        if lettrage:
-            key = (compte, lettrage)
-            # Vérifier si ce groupe a des paiements bancaires ET des factures
-            groupe_a_paiements = key in paiements_par_groupe and len(paiements_par_groupe[key]) > 0
-            groupe_a_factures = key in factures_par_groupe and len(factures_par_groupe[key]) > 0
-            
-            if groupe_a_paiements and groupe_a_factures:
-                # Le groupe a des factures ET des paiements → l'OD est une perte/gain de change à répartir
-                montant_od = abs(od['MontantFacture'])
-                if key not in dict_od_brut:
-                    dict_od_brut[key] = 0
-                dict_od_brut[key] += montant_od
-            else:
-                # Le groupe n'a PAS de factures ou PAS de paiements → c'est un reclassement
-                if key not in od_reclassements_par_groupe:
-                    od_reclassements_par_groupe[key] = []
-                od_reclassements_par_groupe[key].append(od)
-
-    # Créer le tableau de résultats
-    resultats = []
-
-    # Structure pour stocker les factures avec solde restant (pour affectation des paiements non lettrés)
-    factures_solde_restant = []  # Liste de dicts avec infos facture + solde restant
-
-    # Suivre les groupes déjà traités par affectation chronologique
-    groupes_traites = set()
-
-    # Traiter les groupes avec lettrage (affectation chronologique)
-    for key in factures_par_groupe:
-        compte_fournisseur, lettrage_corrige = key
-
-        if not lettrage_corrige:
-            continue  # Les non-lettrés seront traités séparément
-
-        factures_groupe = factures_par_groupe[key]
-        avoirs_groupe = avoirs_par_groupe.get(key, [])
-        paiements_groupe = paiements_par_groupe.get(key, [])
-        od_brut = dict_od_brut.get(key, 0)
-
-        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
-
-        # Calculer totaux pour déterminer gain/perte
-        total_factures = sum(abs(fac['MontantFacture']) for fac in factures_groupe)
-        total_avoirs = sum(avoir['montant'] for avoir in avoirs_groupe)
-        total_paiements_montant = sum(paiement['montant'] for paiement in paiements_groupe)
-        # Soustraire les remboursements du total des paiements
-        remboursements_groupe = remboursements_par_groupe.get(key, [])
-        total_remboursements = sum(remb['montant'] for remb in remboursements_groupe)
-        total_paiements_net = total_paiements_montant - total_remboursements
-
-        # CORRECTION: Si une seule facture avec plusieurs paiements et OD, forcer le traitement proratisé
-        if len(factures_groupe) == 1 and len(paiements_groupe) > 1 and od_brut > 0:
-            # Forcer le passage par la logique de plusieurs paiements
-            facture = factures_groupe[0]
-            lettrage_original = str(facture['Lettrage']).strip()
-            lettrage_corrige_affiche = lettrage_corrige if lettrage_corrige != lettrage_original else ''
-            montant_original = abs(facture['MontantFacture'])
-            
-            total_paiements_facture = sum(p['montant'] for p in paiements_groupe)
-            
-            # Déterminer si c'est une perte de change (paiements > factures)
-            is_perte_change_local = total_paiements_facture > (montant_original + 0.001)
-            
-            for paiement in paiements_groupe:
-                montant_paiement = paiement['montant']
-                ratio = montant_paiement / total_paiements_facture if total_paiements_facture > 0 else 0
-                
-                # Proratiser la facture et l'OD
-                montant_facture_prorata = montant_original * ratio
-                od_prorata = od_brut * ratio if is_perte_change_local else -od_brut * ratio
-                solde_paiement = montant_facture_prorata - montant_paiement + od_prorata
-                
-                resultats.append({
-                    'Date de facture': facture['Date'],
-                    'N° de facture': facture['NumPiece'],
-                    'N° compte fournisseur': compte_fournisseur,
-                    'Nom du fournisseur': nom_fournisseur,
-                    'Libellé de l\'opération': facture['Libelle'],
-                    'Montant de la facture': montant_facture_prorata,
-                    'Avoir': 0,
-                    'Montant facture net': montant_facture_prorata,
-                    'Date de paiement': paiement['date'],
-                    'Montant du paiement': montant_paiement,
-                    'OD': od_prorata,
-                    'Montant du paiement groupé': 0,
-                    'Lettrage': lettrage_original,
-                    'Lettrage corrigé': lettrage_corrige_affiche,
-                    'Solde': solde_paiement
-                })
-            
-            groupes_traites.add(key)
-            continue
-
-        # Déterminer si c'est une perte de change (paiements > factures) ou un gain
-        # Perte de change : on a payé PLUS que la facture → OD positif
-        # Gain / Passage en gain : on a payé MOINS que la facture → OD négatif
-        # Utiliser une petite tolérance pour éviter les erreurs d'arrondi
-        is_perte_change = total_paiements_net > (total_factures - total_avoirs + 0.001)
-
-        if od_brut > 0:
-            if is_perte_change:
-                montant_od_signe = od_brut  # Positif pour perte de change
-            else:
-                montant_od_signe = -od_brut  # Négatif pour gain
-        else:
-            montant_od_signe = 0
-
-        # Combiner avoirs, paiements et remboursements et trier chronologiquement
-        operations = []
-        for avoir in avoirs_groupe:
-            operations.append({
-                'date': avoir['date'],
-                'montant': avoir['montant'],
-                'type': 'avoir',
-                'montant_restant': avoir['montant']
-            })
-        for paiement in paiements_groupe:
-            operations.append({
-                'date': paiement['date'],
-                'montant': paiement['montant'],
-                'type': 'paiement',
-                'montant_restant': paiement['montant'],
-                'paiement_obj': paiement.get('paiement_obj')
-            })
-        # Ajouter les remboursements comme paiements négatifs
-        remboursements_groupe = remboursements_par_groupe.get(key, [])
-        for remb in remboursements_groupe:
-            operations.append({
-                'date': remb['date'],
-                'montant': -remb['montant'],  # Négatif car c'est un remboursement
-                'type': 'remboursement',
-                'montant_restant': -remb['montant'],
-                'remboursement_obj': remb.get('remboursement_obj')
-            })
-
-        # Trier par date (plus ancien d'abord)
-        operations = sorted(
-            operations,
-            key=lambda x: x['date'] if pd.notna(x['date']) else pd.Timestamp.max
-        )
-
-        # Calculer le total des paiements pour "Montant du paiement groupé"
-        # Inclure les remboursements (qui ont des montants négatifs)
-        total_paiements = sum(op['montant'] for op in operations if op['type'] in ('paiement', 'remboursement'))
-
-        # Préparer les factures avec leur solde restant
-        factures_avec_solde = []
-        for fac in factures_groupe:
-            factures_avec_solde.append({
-                'facture': fac,
-                'montant_original': abs(fac['MontantFacture']),
-                'solde_restant': abs(fac['MontantFacture']),
-                'avoir_affecte': 0,
-                'paiements_affectes': []
-            })
-
-        # Affectation chronologique des opérations aux factures
-        # Les remboursements sont traités séparément après
-        remboursements_a_traiter = []
-        for op in operations:
-            if op['type'] == 'remboursement':
-                # Les remboursements sont traités séparément
-                remboursements_a_traiter.append(op)
-                continue
-                
-            montant_op_restant = op['montant_restant']
-
-            for fac_info in factures_avec_solde:
-                if montant_op_restant <= 0:
-                    break
-                if fac_info['solde_restant'] <= 0:
-                    continue
-
-                montant_a_affecter = min(montant_op_restant, fac_info['solde_restant'])
-
-                if op['type'] == 'avoir':
-                    fac_info['avoir_affecte'] += montant_a_affecter
-                else:
-                    fac_info['paiements_affectes'].append({
-                        'montant': montant_a_affecter,
-                        'date': op['date'],
-                        'total_paiement': op['montant']
-                    })
-
-                fac_info['solde_restant'] -= montant_a_affecter
-                montant_op_restant -= montant_a_affecter
-        
-        # Traiter les remboursements : ils correspondent aux avoirs
-        # Chaque remboursement annule un avoir du même groupe
-        for remb in remboursements_a_traiter:
-            montant_remb = abs(remb['montant'])  # Montant positif pour comparaison
-            # Ajouter le remboursement comme paiement négatif sur la première facture avec avoir
-            for fac_info in factures_avec_solde:
-                if fac_info['avoir_affecte'] > 0:
-                    fac_info['paiements_affectes'].append({
-                        'montant': -montant_remb,  # Négatif car remboursement
-                        'date': remb['date'],
-                        'total_paiement': -montant_remb,
-                        'type': 'remboursement'
-                    })
-                    break
-
-        # Cas spécial : Plusieurs factures + 1 paiement unique + OD (pénalité/perte de change OU gain de change)
-        # Le paiement couvre toutes les factures avec un écart (OD)
-        # Factures 1 à N-1 : paiement = montant facture, OD = 0, Solde = 0
-        # Dernière facture : paiement = reste du paiement, OD = total OD (+ ou -), Solde = 0
-        if (len(factures_groupe) > 1 and len(paiements_groupe) == 1
-            and total_avoirs == 0 and od_brut > 0):
-
-            # Trier les factures par date
-            factures_triees = sorted(factures_avec_solde,
-                key=lambda x: x['facture']['Date'] if pd.notna(x['facture']['Date']) else pd.Timestamp.max)
-
-            paiement_info = paiements_groupe[0]
-            date_paiement = paiement_info['date']
-            paiement_total = paiement_info['montant']
-            paiement_restant = paiement_total
-
-            for idx, fac_info in enumerate(factures_triees):
-                facture = fac_info['facture']
-                lettrage_original = str(facture['Lettrage']).strip()
-                lettrage_corrige_affiche = lettrage_corrige if lettrage_corrige != lettrage_original else ''
-                montant_facture = fac_info['montant_original']
-
-                is_derniere_facture = (idx == len(factures_triees) - 1)
-
-                if is_derniere_facture:
-                    # Dernière facture : reçoit le reste du paiement et tout l'OD
-                    montant_paiement_affiche = paiement_restant
-                    # OD positif si perte de change, négatif si gain de change
-                    od_affiche = od_brut if is_perte_change else -od_brut
-                else:
-                    # Factures intermédiaires : paiement = montant facture, OD = 0, Solde = 0
-                    montant_paiement_affiche = montant_facture
-                    od_affiche = 0
-                    paiement_restant -= montant_facture
-
-                solde = montant_facture - montant_paiement_affiche + od_affiche
-
-                resultats.append({
-                    'Date de facture': facture['Date'],
-                    'N° de facture': facture['NumPiece'],
-                    'N° compte fournisseur': compte_fournisseur,
-                    'Nom du fournisseur': nom_fournisseur,
-                    'Libellé de l\'opération': facture['Libelle'],
-                    'Montant de la facture': montant_facture,
-                    'Avoir': 0,
-                    'Montant facture net': montant_facture,
-                    'Date de paiement': date_paiement,
-                    'Montant du paiement': montant_paiement_affiche,
-                    'OD': od_affiche,
-                    'Montant du paiement groupé': paiement_total,
-                    'Lettrage': lettrage_original,
-                    'Lettrage corrigé': lettrage_corrige_affiche,
-                    'Solde': solde
-                })
-
-            groupes_traites.add(key)
-            continue  # Passer au groupe suivant, ne pas exécuter la boucle normale
-
-        # Cas spécial : Plusieurs factures + plusieurs paiements + OD (écart de régularisation)
-        # Rapprochement 1-1 entre factures et paiements, l'OD sur la première facture avec écart
-        if (len(factures_groupe) > 1 and len(paiements_groupe) > 1
-            and total_avoirs == 0 and od_brut > 0):
-
-            # Trier les factures par date
-            factures_triees = sorted(factures_avec_solde,
-                key=lambda x: x['facture']['Date'] if pd.notna(x['facture']['Date']) else pd.Timestamp.max)
-
-            # Créer une copie des paiements disponibles pour le rapprochement
-            paiements_disponibles = [{'montant': p['montant'], 'date': p['date'], 'utilise': False}
-                                     for p in paiements_groupe]
-
-            od_deja_affecte = False
-
-            for idx, fac_info in enumerate(factures_triees):
-                facture = fac_info['facture']
-                lettrage_original = str(facture['Lettrage']).strip()
-                lettrage_corrige_affiche = lettrage_corrige if lettrage_corrige != lettrage_original else ''
-                montant_facture = fac_info['montant_original']
-
-                # Chercher le paiement correspondant (exact ou le plus proche)
-                meilleur_paiement = None
-                meilleur_ecart = float('inf')
-                meilleur_idx = -1
-
-                for p_idx, paiement in enumerate(paiements_disponibles):
-                    if paiement['utilise']:
-                        continue
-                    ecart = abs(paiement['montant'] - montant_facture)
-                    if ecart < meilleur_ecart:
-                        meilleur_ecart = ecart
-                        meilleur_paiement = paiement
-                        meilleur_idx = p_idx
-
-                if meilleur_paiement:
-                    paiements_disponibles[meilleur_idx]['utilise'] = True
-                    montant_paiement = meilleur_paiement['montant']
-                    date_paiement = meilleur_paiement['date']
-
-                    # L'OD est affecté à la première facture qui a un écart
-                    if not od_deja_affecte and abs(montant_facture - montant_paiement) > 0.001:
-                        # OD positif si perte de change, négatif si gain de change
-                        od_affiche = od_brut if is_perte_change else -od_brut
-                        od_deja_affecte = True
-                    else:
-                        od_affiche = 0
-
-                    solde = montant_facture - montant_paiement + od_affiche
-                else:
-                    # Pas de paiement trouvé
-                    montant_paiement = 0
-                    date_paiement = None
-                    od_affiche = 0
-                    solde = montant_facture
-
-                resultats.append({
-                    'Date de facture': facture['Date'],
-                    'N° de facture': facture['NumPiece'],
-                    'N° compte fournisseur': compte_fournisseur,
-                    'Nom du fournisseur': nom_fournisseur,
-                    'Libellé de l\'opération': facture['Libelle'],
-                    'Montant de la facture': montant_facture,
-                    'Avoir': 0,
-                    'Montant facture net': montant_facture,
-                    'Date de paiement': date_paiement,
-                    'Montant du paiement': montant_paiement,
-                    'OD': od_affiche,
-                    'Montant du paiement groupé': total_paiements,
-                    'Lettrage': lettrage_original,
-                    'Lettrage corrigé': lettrage_corrige_affiche,
-                    'Solde': solde
-                })
-
-            groupes_traites.add(key)
-            continue  # Passer au groupe suivant
-
-        # Cas spécial : Plusieurs factures + PAS de paiement + OD (annulation par OD/effet)
-        # L'OD annule les factures - répartir l'OD au prorata sur chaque facture
-        if (len(factures_groupe) > 1 and len(paiements_groupe) == 0
-            and total_avoirs == 0 and od_brut > 0):
-
-            # Trier les factures par date
-            factures_triees = sorted(factures_avec_solde,
-                key=lambda x: x['facture']['Date'] if pd.notna(x['facture']['Date']) else pd.Timestamp.max)
-
-            for fac_info in factures_triees:
-                facture = fac_info['facture']
-                lettrage_original = str(facture['Lettrage']).strip()
-                lettrage_corrige_affiche = lettrage_corrige if lettrage_corrige != lettrage_original else ''
-                montant_facture = fac_info['montant_original']
-
-                # Calculer l'OD au prorata : OD_i = OD_total × (Montant_facture_i / Total_factures)
-                ratio = montant_facture / total_factures if total_factures > 0 else 0
-                od_prorata = od_brut * ratio
-
-                # L'OD est négative (annule la facture) donc solde = montant - od_prorata = 0
-                solde = montant_facture - od_prorata
-
-                resultats.append({
-                    'Date de facture': facture['Date'],
-                    'N° de facture': facture['NumPiece'],
-                    'N° compte fournisseur': compte_fournisseur,
-                    'Nom du fournisseur': nom_fournisseur,
-                    'Libellé de l\'opération': facture['Libelle'],
-                    'Montant de la facture': montant_facture,
-                    'Avoir': 0,
-                    'Montant facture net': montant_facture,
-                    'Date de paiement': None,
-                    'Montant du paiement': 0,
-                    'OD': -od_prorata,  # Négatif car annulation
-                    'Montant du paiement groupé': 0,
-                    'Lettrage': lettrage_original,
-                    'Lettrage corrigé': lettrage_corrige_affiche,
-                    'Solde': solde
-                })
-
-            groupes_traites.add(key)
-            continue  # Passer au groupe suivant
-
-        # Générer les lignes de résultat pour chaque facture
-        for fac_info in factures_avec_solde:
-            facture = fac_info['facture']
-            lettrage_original = str(facture['Lettrage']).strip()
-            lettrage_corrige_affiche = lettrage_corrige if lettrage_corrige != lettrage_original else ''
-
-            avoir_total = fac_info['avoir_affecte']
-            paiements_affectes = fac_info['paiements_affectes']
-            montant_original = fac_info['montant_original']
-
-            # Si la facture a des avoirs et des paiements
-            if avoir_total > 0 and len(paiements_affectes) > 0:
-                # Ligne pour l'avoir
-                montant_facture_avoir = avoir_total
-                montant_facture_net_avoir = 0  # Avoir couvre cette portion
-                solde_avoir = montant_facture_net_avoir - 0 + montant_od_signe
-
-                resultats.append({
-                    'Date de facture': facture['Date'],
-                    'N° de facture': facture['NumPiece'],
-                    'N° compte fournisseur': compte_fournisseur,
-                    'Nom du fournisseur': nom_fournisseur,
-                    'Libellé de l\'opération': facture['Libelle'],
-                    'Montant de la facture': montant_facture_avoir,
-                    'Avoir': avoir_total,
-                    'Montant facture net': montant_facture_net_avoir,
-                    'Date de paiement': None,
-                    'Montant du paiement': 0,
-                    'OD': montant_od_signe,
-                    'Montant du paiement groupé': 0,
-                    'Lettrage': lettrage_original,
-                    'Lettrage corrigé': lettrage_corrige_affiche,
-                    'Solde': solde_avoir
-                })
 
-                # Lignes pour chaque paiement
-                for paiement_aff in paiements_affectes:
-                    montant_paiement = paiement_aff['montant']
-                    montant_facture_affiche = montant_paiement
-                    montant_facture_net_affiche = montant_facture_affiche
-                    solde_paiement = montant_facture_net_affiche - montant_paiement + montant_od_signe
-
-                    resultats.append({
-                        'Date de facture': facture['Date'],
-                        'N° de facture': facture['NumPiece'],
-                        'N° compte fournisseur': compte_fournisseur,
-                        'Nom du fournisseur': nom_fournisseur,
-                        'Libellé de l\'opération': facture['Libelle'],
-                        'Montant de la facture': montant_facture_affiche,
-                        'Avoir': 0,
-                        'Montant facture net': montant_facture_net_affiche,
-                        'Date de paiement': paiement_aff['date'],
-                        'Montant du paiement': montant_paiement,
-                        'OD': montant_od_signe,
-                        'Montant du paiement groupé': total_paiements if len(factures_groupe) > 1 else 0,
-                        'Lettrage': lettrage_original,
-                        'Lettrage corrigé': lettrage_corrige_affiche,
-                        'Solde': solde_paiement
-                    })
-
-            # Si la facture n'a que des avoirs
-            elif avoir_total > 0 and len(paiements_affectes) == 0:
-                montant_facture_net = montant_original - avoir_total
-                solde = montant_facture_net + montant_od_signe
-
-                resultats.append({
-                    'Date de facture': facture['Date'],
-                    'N° de facture': facture['NumPiece'],
-                    'N° compte fournisseur': compte_fournisseur,
-                    'Nom du fournisseur': nom_fournisseur,
-                    'Libellé de l\'opération': facture['Libelle'],
-                    'Montant de la facture': montant_original,
-                    'Avoir': avoir_total,
-                    'Montant facture net': montant_facture_net,
-                    'Date de paiement': None,
-                    'Montant du paiement': 0,
-                    'OD': montant_od_signe,
-                    'Montant du paiement groupé': 0,
-                    'Lettrage': lettrage_original,
-                    'Lettrage corrigé': lettrage_corrige_affiche,
-                    'Solde': solde
-                })
-
-            # Si la facture n'a que des paiements (pas d'avoir)
-            elif avoir_total == 0 and len(paiements_affectes) > 0:
-                # Cas spécial : Écart de change avec plusieurs paiements (perte de change)
-                # On applique le prorata : MF_i = Facture × (Paiement_i / Total Paiements)
-                # OD_i = OD × (Paiement_i / Total Paiements)
-                if is_perte_change and len(paiements_affectes) > 1 and od_brut > 0:
-                    # Prorata pour écart de change
-                    total_paiements_facture = sum(p['montant'] for p in paiements_affectes)
-                    for paiement_aff in paiements_affectes:
-                        montant_paiement = paiement_aff['montant']
-                        ratio = montant_paiement / total_paiements_facture if total_paiements_facture > 0 else 0
-                        # Montant facture prorata
-                        montant_facture_prorata = montant_original * ratio
-                        # OD prorata (positif car perte de change)
-                        od_prorata = od_brut * ratio
-                        # Solde = MF - Paiement + OD = 0
-                        solde_paiement = montant_facture_prorata - montant_paiement + od_prorata
-
-                        resultats.append({
-                            'Date de facture': facture['Date'],
-                            'N° de facture': facture['NumPiece'],
-                            'N° compte fournisseur': compte_fournisseur,
-                            'Nom du fournisseur': nom_fournisseur,
-                            'Libellé de l\'opération': facture['Libelle'],
-                            'Montant de la facture': montant_facture_prorata,
-                            'Avoir': 0,
-                            'Montant facture net': montant_facture_prorata,
-                            'Date de paiement': paiement_aff['date'],
-                            'Montant du paiement': montant_paiement,
-                            'OD': od_prorata,
-                            'Montant du paiement groupé': 0,  # Pas de paiement groupé (plusieurs paiements pour 1 facture)
-                            'Lettrage': lettrage_original,
-                            'Lettrage corrigé': lettrage_corrige_affiche,
-                            'Solde': solde_paiement
-                        })
-                # Plusieurs paiements sans écart de change spécial
-                elif len(paiements_affectes) > 1:
-                    # CORRECTION: Proratiser la facture quand plusieurs paiements
-                    total_paiements_facture = sum(p['montant'] for p in paiements_affectes)
-                    
-                    for paiement_aff in paiements_affectes:
-                        montant_paiement = paiement_aff['montant']
-                        
-                        # Proratiser la facture selon le ratio du paiement
-                        ratio = montant_paiement / total_paiements_facture if total_paiements_facture > 0 else 0
-                        montant_facture_affiche = montant_original * ratio
-                        montant_facture_net_affiche = montant_facture_affiche
-                        
-                        # Proratiser l'OD aussi
-                        od_affiche = montant_od_signe * ratio if montant_od_signe != 0 else 0
-                        solde_paiement = montant_facture_net_affiche - montant_paiement + od_affiche
-
-                        resultats.append({
-                            'Date de facture': facture['Date'],
-                            'N° de facture': facture['NumPiece'],
-                            'N° compte fournisseur': compte_fournisseur,
-                            'Nom du fournisseur': nom_fournisseur,
-                            'Libellé de l\'opération': facture['Libelle'],
-                            'Montant de la facture': montant_facture_affiche,
-                            'Avoir': 0,
-                            'Montant facture net': montant_facture_net_affiche,
-                            'Date de paiement': paiement_aff['date'],
-                            'Montant du paiement': montant_paiement,
-                            'OD': od_affiche,
-                            'Montant du paiement groupé': 0,  # CORRECTION: 0 car plusieurs paiements pour 1 facture
-                            'Lettrage': lettrage_original,
-                            'Lettrage corrigé': lettrage_corrige_affiche,
-                            'Solde': solde_paiement
-                        })
-                else:
-                    # Un seul paiement (potentiellement partiel)
-                    paiement_aff = paiements_affectes[0]
-                    montant_paiement = paiement_aff['montant']
-
-                    # S'il y a un OD (gain OU perte de change)
-                    if od_brut > 0:
-                        montant_paiement = paiement_aff.get('total_paiement', paiement_aff['montant'])
-                        montant_facture_affiche = montant_original
-                        solde = montant_original - montant_paiement + montant_od_signe
-                    else:
-                        # Paiement partiel ou exact sans OD
-                        montant_facture_affiche = montant_paiement
-                        solde = 0
-
-                    resultats.append({
-                        'Date de facture': facture['Date'],
-                        'N° de facture': facture['NumPiece'],
-                        'N° compte fournisseur': compte_fournisseur,
-                        'Nom du fournisseur': nom_fournisseur,
-                        'Libellé de l\'opération': facture['Libelle'],
-                        'Montant de la facture': montant_facture_affiche,
-                        'Avoir': 0,
-                        'Montant facture net': montant_facture_affiche,
-                        'Date de paiement': paiement_aff['date'],
-                        'Montant du paiement': montant_paiement,
-                        'OD': montant_od_signe if od_brut > 0 else 0,
-                        'Montant du paiement groupé': total_paiements if len(factures_groupe) > 1 else 0,
-                        'Lettrage': lettrage_original,
-                        'Lettrage corrigé': lettrage_corrige_affiche,
-                        'Solde': solde
-                    })
-
-            # Si la facture n'a ni avoir ni paiement
-            else:
-                solde = montant_original + montant_od_signe
-
-                resultats.append({
-                    'Date de facture': facture['Date'],
-                    'N° de facture': facture['NumPiece'],
-                    'N° compte fournisseur': compte_fournisseur,
-                    'Nom du fournisseur': nom_fournisseur,
-                    'Libellé de l\'opération': facture['Libelle'],
-                    'Montant de la facture': montant_original,
-                    'Avoir': 0,
-                    'Montant facture net': montant_original,
-                    'Date de paiement': None,
-                    'Montant du paiement': 0,
-                    'OD': montant_od_signe,
-                    'Montant du paiement groupé': 0,
-                    'Lettrage': lettrage_original,
-                    'Lettrage corrigé': lettrage_corrige_affiche,
-                    'Solde': solde
-                })
+    colonnes_texte = display_df.select_dtypes(include='object').columns
+    display_df[colonnes_texte] = display_df[colonnes_texte].where(display_df[colonnes_texte].notna(), '')
+    return display_df
 
-            # Stocker les factures avec solde restant pour affectation des paiements non lettrés
-            # IMPORTANT: Vérifier le solde RÉEL après OD pour ne pas affecter les paiements
-            # à des factures déjà soldées par leur groupe lettré
-            if fac_info['solde_restant'] > 0.01:
-                # Calculer le solde réel en tenant compte de l'OD
-                solde_reel = fac_info['solde_restant'] + montant_od_signe
-                
-                # N'ajouter QUE si le solde réel > 0 (la facture a vraiment besoin d'un paiement)
-                if solde_reel > 0.01:
-                    factures_solde_restant.append({
-                        'facture': facture,
-                        'compte': compte_fournisseur,
-                        'nom_fournisseur': nom_fournisseur,
-                        'solde_restant': solde_reel,  # Solde APRÈS OD
-                        'lettrage_original': lettrage_original,
-                        'lettrage_corrige_affiche': lettrage_corrige_affiche,
-                        'od_signe': 0  # OD déjà comptabilisé dans solde_restant
-                    })
-
-        # Traiter les avoirs non affectés (quand la facture était déjà payée)
-        # Ces avoirs doivent être sortis avec leur remboursement correspondant
-        total_avoirs_affectes = sum(fac_info['avoir_affecte'] for fac_info in factures_avec_solde)
-        if total_avoirs < total_avoirs_affectes + 0.01:
-            # Tous les avoirs ont été affectés, rien à faire
-            pass
-        else:
-            # Il reste des avoirs non affectés
-            avoirs_non_affectes = total_avoirs - total_avoirs_affectes
-            
-            # Récupérer les remboursements de ce groupe
-            remboursements_ce_groupe = remboursements_par_groupe.get(key, [])
-            total_remboursements_groupe = sum(r['montant'] for r in remboursements_ce_groupe)
-            
-            # Pour chaque avoir non affecté, créer une ligne
-            for avoir in avoirs_groupe:
-                # Vérifier si cet avoir a été partiellement ou non affecté
-                montant_avoir = avoir['montant']
-                avoir_obj = avoir.get('avoir_obj')
-                
-                # Calculer la portion non affectée (simplifié: on traite proportionnellement)
-                if total_avoirs > 0:
-                    ratio_non_affecte = avoirs_non_affectes / total_avoirs
-                    montant_avoir_non_affecte = montant_avoir * ratio_non_affecte
-                else:
-                    montant_avoir_non_affecte = 0
-                
-                if montant_avoir_non_affecte > 0.01:
-                    # Calculer le remboursement correspondant
-                    if total_avoirs > 0:
-                        ratio_remb = montant_avoir / total_avoirs
-                        montant_remboursement = total_remboursements_groupe * ratio_remb
-                    else:
-                        montant_remboursement = 0
-                    
-                    # Créer la ligne pour l'avoir non affecté
-                    if avoir_obj is not None:
-                        resultats.append({
-                            'Date de facture': avoir_obj['Date'],
-                            'N° de facture': avoir_obj['NumPiece'],
-                            'N° compte fournisseur': compte_fournisseur,
-                            'Nom du fournisseur': nom_fournisseur,
-                            'Libellé de l\'opération': avoir_obj['Libelle'],
-                            'Montant de la facture': 0,
-                            'Avoir': montant_avoir_non_affecte,
-                            'Montant facture net': -montant_avoir_non_affecte,
-                            'Date de paiement': remboursements_ce_groupe[0]['date'] if remboursements_ce_groupe else None,
-                            'Montant du paiement': -montant_remboursement if montant_remboursement > 0 else 0,
-                            'OD': 0,
-                            'Montant du paiement groupé': 0,
-                            'Lettrage': lettrage_corrige,
-                            'Lettrage corrigé': '',
-                            'Solde': -montant_avoir_non_affecte + montant_remboursement
-                        })
-
-        groupes_traites.add(key)
-
-    # Ajouter les reclassements OD lettrés
-    # Ces OD ont MontantFacture > 0 et MontantMvt = 0 (ex: reclassement solde débiteur)
-    # Deux cas :
-    # 1. Si le groupe a des factures → ligne séparée avec OD
-    # 2. Si le groupe N'A PAS de factures mais a des paiements → combiner OD + paiement
-    for key, od_list in od_reclassements_par_groupe.items():
-        compte_fournisseur, lettrage = key
-        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
-        
-        # Vérifier si ce groupe a des factures
-        groupe_a_factures = key in factures_par_groupe and len(factures_par_groupe[key]) > 0
-        
-        # Récupérer les paiements de ce groupe
-        paiements_groupe = paiements_par_groupe.get(key, [])
-        
-        for od_recl in od_list:
-            montant_od_recl = od_recl['MontantFacture']
-            
-            if groupe_a_factures:
-                # Cas 1 : groupe avec factures → ligne séparée
-                resultats.append({
-                    'Date de facture': od_recl['Date'],
-                    'N° de facture': od_recl['NumPiece'],
-                    'N° compte fournisseur': compte_fournisseur,
-                    'Nom du fournisseur': nom_fournisseur,
-                    'Libellé de l\'opération': od_recl['Libelle'],
-                    'Montant de la facture': 0,
-                    'Avoir': 0,
-                    'Montant facture net': 0,
-                    'Date de paiement': None,
-                    'Montant du paiement': 0,
-                    'OD': montant_od_recl,
-                    'Montant du paiement groupé': 0,
-                    'Lettrage': str(od_recl['Lettrage']).strip() if pd.notna(od_recl['Lettrage']) else '',
-                    'Lettrage corrigé': '',
-                    'Solde': montant_od_recl  # Reclassement augmente la dette
-                })
-            elif len(paiements_groupe) > 0:
-                # Cas 2 : groupe SANS factures mais avec paiements → combiner OD + paiement
-                # L'OD crée une dette qui est ensuite payée
-                for paiement in paiements_groupe:
-                    # Calculer la portion de l'OD correspondant à ce paiement (prorata si plusieurs)
-                    total_paiements = sum(p['montant'] for p in paiements_groupe)
-                    ratio = paiement['montant'] / total_paiements if total_paiements > 0 else 1
-                    od_portion = montant_od_recl * ratio
-                    
-                    resultats.append({
-                        'Date de facture': od_recl['Date'],
-                        'N° de facture': od_recl['NumPiece'],
-                        'N° compte fournisseur': compte_fournisseur,
-                        'Nom du fournisseur': nom_fournisseur,
-                        'Libellé de l\'opération': od_recl['Libelle'],
-                        'Montant de la facture': 0,
-                        'Avoir': 0,
-                        'Montant facture net': 0,
-                        'Date de paiement': paiement['date'],
-                        'Montant du paiement': paiement['montant'],
-                        'OD': od_portion,
-                        'Montant du paiement groupé': total_paiements if len(paiements_groupe) > 1 else 0,
-                        'Lettrage': str(od_recl['Lettrage']).strip() if pd.notna(od_recl['Lettrage']) else '',
-                        'Lettrage corrigé': '',
-                        'Solde': 0  # MF(0) - Paiement + OD = 0 car Paiement = OD
-                    })
-                # Marquer les paiements comme traités pour ne pas les réafficher
-                paiements_par_groupe[key] = []
-            else:
-                # Cas 3 : groupe SANS factures ET SANS paiements → ligne séparée
-                resultats.append({
-                    'Date de facture': od_recl['Date'],
-                    'N° de facture': od_recl['NumPiece'],
-                    'N° compte fournisseur': compte_fournisseur,
-                    'Nom du fournisseur': nom_fournisseur,
-                    'Libellé de l\'opération': od_recl['Libelle'],
-                    'Montant de la facture': 0,
-                    'Avoir': 0,
-                    'Montant facture net': 0,
-                    'Date de paiement': None,
-                    'Montant du paiement': 0,
-                    'OD': montant_od_recl,
-                    'Montant du paiement groupé': 0,
-                    'Lettrage': str(od_recl['Lettrage']).strip() if pd.notna(od_recl['Lettrage']) else '',
-                    'Lettrage corrigé': '',
-                    'Solde': montant_od_recl
-                })
-
-    # Ajouter les avoirs lettrés dans des groupes SANS factures
-    # Ces avoirs sont dans des groupes avec remboursements ou OD, mais sans factures
-    # Cas typiques :
-    # 1. Avoir + Remboursement (le fournisseur nous rembourse l'avoir)
-    # 2. Avoir + OD (compensation entre avoir et OD)
-    for key, avoirs_list in avoirs_par_groupe.items():
-        compte_fournisseur, lettrage = key
-        
-        # Vérifier si ce groupe a des factures (déjà traité)
-        if key in factures_par_groupe and len(factures_par_groupe[key]) > 0:
-            continue  # Déjà traité avec les factures
-        
-        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
-        
-        # Récupérer les remboursements de ce groupe
-        remboursements_groupe = remboursements_par_groupe.get(key, [])
-        
-        # Calculer le total des avoirs du groupe
-        total_avoirs_groupe = sum(avoir['montant'] for avoir in avoirs_list)
-        
-        # Calculer le total des remboursements du groupe
-        total_remboursements = sum(remb['montant'] for remb in remboursements_groupe)
-        
-        for avoir in avoirs_list:
-            avoir_obj = avoir['avoir_obj']
-            montant_avoir = avoir['montant']
-            
-            if len(remboursements_groupe) > 0:
-                # Cas 1 : Avoir + Remboursement
-                # Le remboursement "paie" l'avoir (solde = 0)
-                # Trouver le remboursement correspondant (prorata si plusieurs)
-                ratio = montant_avoir / total_avoirs_groupe if total_avoirs_groupe > 0 else 1
-                montant_remboursement = total_remboursements * ratio
-                
-                resultats.append({
-                    'Date de facture': avoir_obj['Date'],
-                    'N° de facture': avoir_obj['NumPiece'],
-                    'N° compte fournisseur': compte_fournisseur,
-                    'Nom du fournisseur': nom_fournisseur,
-                    'Libellé de l\'opération': avoir_obj['Libelle'],
-                    'Montant de la facture': 0,
-                    'Avoir': montant_avoir,
-                    'Montant facture net': -montant_avoir,
-                    'Date de paiement': remboursements_groupe[0]['date'] if remboursements_groupe else None,
-                    'Montant du paiement': -montant_remboursement,  # Négatif car remboursement
-                    'OD': 0,
-                    'Montant du paiement groupé': 0,
-                    'Lettrage': lettrage,
-                    'Lettrage corrigé': '',
-                    'Solde': 0 if abs(montant_avoir - montant_remboursement) < 0.01 else -montant_avoir + montant_remboursement
-                })
-            else:
-                # Cas 2 : Avoir sans remboursement dans le groupe
-                # Vérifier s'il y a une OD qui compense
-                od_groupe = dict_od_brut.get(key, 0)
-                od_recl_groupe = od_reclassements_par_groupe.get(key, [])
-                od_recl_total = sum(od['MontantFacture'] for od in od_recl_groupe)
-                
-                # NOTE: Les OD de od_reclassements_par_groupe sont déjà traitées séparément
-                # On ne les ajoute PAS ici pour éviter le double comptage
-                # On ajoute uniquement od_groupe (écarts de change MontantMvt > 0)
-                if od_groupe > 0 or od_recl_total > 0:
-                    # Avoir compensé par OD - l'OD reclassement est traitée séparément
-                    # Le Solde ici ne doit PAS inclure l'OD (déjà comptée ailleurs)
-                    resultats.append({
-                        'Date de facture': avoir_obj['Date'],
-                        'N° de facture': avoir_obj['NumPiece'],
-                        'N° compte fournisseur': compte_fournisseur,
-                        'Nom du fournisseur': nom_fournisseur,
-                        'Libellé de l\'opération': avoir_obj['Libelle'],
-                        'Montant de la facture': 0,
-                        'Avoir': montant_avoir,
-                        'Montant facture net': -montant_avoir,
-                        'Date de paiement': None,
-                        'Montant du paiement': 0,
-                        'OD': 0,  # OD reclassement déjà comptée, on met 0 ici
-                        'Montant du paiement groupé': 0,
-                        'Lettrage': lettrage,
-                        'Lettrage corrigé': '',
-                        'Solde': -montant_avoir  # Solde = 0 - Avoir - 0 + 0 = -Avoir
-                    })
-                else:
-                    # Avoir seul (non compensé) - ne devrait pas arriver normalement
-                    resultats.append({
-                        'Date de facture': avoir_obj['Date'],
-                        'N° de facture': avoir_obj['NumPiece'],
-                        'N° compte fournisseur': compte_fournisseur,
-                        'Nom du fournisseur': nom_fournisseur,
-                        'Libellé de l\'opération': avoir_obj['Libelle'],
-                        'Montant de la facture': 0,
-                        'Avoir': montant_avoir,
-                        'Montant facture net': -montant_avoir,
-                        'Date de paiement': None,
-                        'Montant du paiement': 0,
-                        'OD': 0,
-                        'Montant du paiement groupé': 0,
-                        'Lettrage': lettrage,
-                        'Lettrage corrigé': '',
-                        'Solde': -montant_avoir
-                    })
-
-    # Ajouter les factures non lettrées à la liste des factures avec solde
-    for _, facture in factures.iterrows():
-        compte = str(facture['Compte']).strip()
-        lettrage = str(facture['LettrageCorrige']).strip()
-        if not lettrage:
-            nom_fournisseur = dict_fournisseurs.get(compte, "Fournisseur inconnu")
-            factures_solde_restant.append({
-                'facture': facture,
-                'compte': compte,
-                'nom_fournisseur': nom_fournisseur,
-                'solde_restant': abs(facture['MontantFacture']),
-                'lettrage_original': str(facture['Lettrage']).strip(),
-                'lettrage_corrige_affiche': '',
-                'od_signe': 0
-            })
-
-    # Trier toutes les factures avec solde par compte puis par date (les plus anciennes d'abord)
-    factures_solde_restant = sorted(
-        factures_solde_restant,
-        key=lambda x: (x['compte'], x['facture']['Date'] if pd.notna(x['facture']['Date']) else pd.Timestamp.max)
-    )
-
-    # Identifier les paiements non lettrés (tous les mouvements != 0)
-    paiements_non_lettres = paiements[
-        (paiements['LettrageCorrige'] == '') &
-        (paiements['MontantMvt'] != 0)
-    ].copy()
-
-    # Trier les paiements non lettrés par date
-    paiements_non_lettres = paiements_non_lettres.sort_values('Date')
-
-    # Suivre les affectations ET les montants restants des paiements
-    affectations_paiements = {}  # clé = index dans factures_solde_restant
-    paiements_restants = {}  # clé = (compte, numpiece, date, montant) → montant restant
-
-    # Affecter les paiements non lettrés aux factures avec solde (même fournisseur, plus anciennes d'abord)
-    for _, paiement in paiements_non_lettres.iterrows():
-        compte_paiement = str(paiement['Compte']).strip()
-        montant_paiement_initial = abs(paiement['MontantMvt'])
-        montant_paiement_restant = montant_paiement_initial
-        paiement_key = (compte_paiement, paiement['NumPiece'], paiement['Date'], paiement['MontantMvt'])
-
-        for idx, fac_info in enumerate(factures_solde_restant):
-            if montant_paiement_restant <= 0:
-                break
-            if fac_info['compte'] != compte_paiement:
-                continue
-            if fac_info['solde_restant'] <= 0:
-                continue
-
-            montant_a_affecter = min(montant_paiement_restant, fac_info['solde_restant'])
-
-            if idx not in affectations_paiements:
-                affectations_paiements[idx] = []
-            affectations_paiements[idx].append({
-                'paiement': paiement,
-                'montant_affecte': montant_a_affecter
-            })
-
-            fac_info['solde_restant'] -= montant_a_affecter
-            montant_paiement_restant -= montant_a_affecter
-
-        # Stocker le montant restant UNIQUEMENT si le paiement a été PARTIELLEMENT affecté
-        # (pas complètement non affecté)
-        if montant_paiement_restant > 0.01 and montant_paiement_restant < montant_paiement_initial:
-            paiements_restants[paiement_key] = {
-                'paiement': paiement,
-                'montant_restant': montant_paiement_restant
+def vue_delais(rapprochement, delai_max, date_cloture, profil=None):
+    """
+    Résultats enrichis des délais de paiement pour un délai maximal et une date de
+    clôture, avec leur synthèse par fournisseur, mise en forme et fichiers exportés :
+    calculés une fois par jeu de paramètres et conservés avec le rapprochement.
+    """
+    cle = (int(delai_max), date_cloture)
+    if cle not in rapprochement['vues']:
+        with etape(profil, 'delais_paiement', len(rapprochement['resultats_df'])):
+            resultats_df = calculer_delais(rapprochement['resultats_df'], int(delai_max), date_cloture)
+            synthese_df = synthese_par_fournisseur(resultats_df)
+        with etape(profil, 'mise_en_forme_affichage', len(resultats_df)):
+            rapprochement['vues'][cle] = {
+                'resultats_df': resultats_df,
+                'synthese_df': synthese_df,
+                'display_df': formater_resultats_affichage(resultats_df),
+                'display_synthese_df': formater_resultats_affichage(synthese_df),
+                'exports': {}
             }
-
-    # Générer les lignes de résultat pour les factures avec solde
-    for idx, fac_info in enumerate(factures_solde_restant):
-        facture = fac_info['facture']
-        compte_fournisseur = fac_info['compte']
-        nom_fournisseur = fac_info['nom_fournisseur']
-        lettrage_original = fac_info['lettrage_original']
-        lettrage_corrige_affiche = fac_info['lettrage_corrige_affiche']
-        od_signe = fac_info['od_signe']
-
-        if idx in affectations_paiements:
-            # La facture a reçu des paiements non lettrés
-            for aff in affectations_paiements[idx]:
-                paiement = aff['paiement']
-                montant_paiement = aff['montant_affecte']
-
-                resultats.append({
-                    'Date de facture': facture['Date'],
-                    'N° de facture': facture['NumPiece'],
-                    'N° compte fournisseur': compte_fournisseur,
-                    'Nom du fournisseur': nom_fournisseur,
-                    'Libellé de l\'opération': facture['Libelle'],
-                    'Montant de la facture': montant_paiement,
-                    'Avoir': 0,
-                    'Montant facture net': montant_paiement,
-                    'Date de paiement': paiement['Date'],
-                    'Montant du paiement': montant_paiement,
-                    'OD': 0,
-                    'Montant du paiement groupé': 0,
-                    'Lettrage': lettrage_original,
-                    'Lettrage corrigé': lettrage_corrige_affiche,
-                    'Solde': 0
-                })
-
-        # Ajouter une ligne pour le solde restant si > 0
-        if fac_info['solde_restant'] > 0.01:
-            resultats.append({
-                'Date de facture': facture['Date'],
-                'N° de facture': facture['NumPiece'],
-                'N° compte fournisseur': compte_fournisseur,
-                'Nom du fournisseur': nom_fournisseur,
-                'Libellé de l\'opération': facture['Libelle'],
-                'Montant de la facture': fac_info['solde_restant'],
-                'Avoir': 0,
-                'Montant facture net': fac_info['solde_restant'],
-                'Date de paiement': None,
-                'Montant du paiement': 0,
-                'OD': od_signe,
-                'Montant du paiement groupé': 0,
-                'Lettrage': lettrage_original,
-                'Lettrage corrigé': lettrage_corrige_affiche,
-                'Solde': fac_info['solde_restant'] + od_signe
-            })
-
-    # Ajouter les paiements sans lettrage qui n'ont pas été affectés OU partiellement affectés
-    paiements_sans_lettrage = paiements[paiements['LettrageCorrige'] == '']
-
-    paiements_deja_affectes = set()
-    for idx, affectations in affectations_paiements.items():
-        for aff in affectations:
-            paiement = aff['paiement']
-            paiements_deja_affectes.add((str(paiement['Compte']).strip(), paiement['NumPiece'], paiement['Date'], paiement['MontantMvt']))
-
-    # 1. Ajouter les paiements qui n'ont PAS DU TOUT été affectés
-    for _, paiement in paiements_sans_lettrage.iterrows():
-        compte_fournisseur = str(paiement['Compte']).strip()
-        paiement_key = (compte_fournisseur, paiement['NumPiece'], paiement['Date'], paiement['MontantMvt'])
-
-        # Si le paiement a été affecté (totalement ou partiellement), on ne l'ajoute pas ici
-        if paiement_key in paiements_deja_affectes:
-            continue
-
-        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
-        montant_mvt = paiement['MontantMvt']
-        montant_paiement = abs(montant_mvt)
-
-        # Solde = -MontantMvt (car paiement diminue la dette)
-        # Si MontantMvt > 0 (avoir/remboursement), solde = -positif = négatif
-        # Si MontantMvt < 0 (paiement), solde = -négatif = positif (erreur car on a payé sans facture)
-        solde_paiement = -montant_mvt
-
-        resultats.append({
-            'Date de facture': None,
-            'N° de facture': '',
-            'N° compte fournisseur': compte_fournisseur,
-            'Nom du fournisseur': nom_fournisseur,
-            'Libellé de l\'opération': paiement['Libelle'],
-            'Montant de la facture': 0,
-            'Avoir': 0,
-            'Montant facture net': 0,
-            'Date de paiement': paiement['Date'],
-            'Montant du paiement': montant_paiement,
-            'OD': 0,
-            'Montant du paiement groupé': 0,
-            'Lettrage': '',
-            'Lettrage corrigé': '',
-            'Solde': solde_paiement
-        })
-
-    # 2. Ajouter les RELIQUATS des paiements partiellement affectés
-    for paiement_key, paiement_info in paiements_restants.items():
-        paiement = paiement_info['paiement']
-        montant_restant = paiement_info['montant_restant']
-        compte_fournisseur = str(paiement['Compte']).strip()
-        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
-
-        # Solde = -montant_restant (crédit car on a trop payé)
-        solde_reliquat = -montant_restant
-
-        resultats.append({
-            'Date de facture': None,
-            'N° de facture': '',
-            'N° compte fournisseur': compte_fournisseur,
-            'Nom du fournisseur': nom_fournisseur,
-            'Libellé de l\'opération': paiement['Libelle'] + ' (reliquat)',
-            'Montant de la facture': 0,
-            'Avoir': 0,
-            'Montant facture net': 0,
-            'Date de paiement': paiement['Date'],
-            'Montant du paiement': montant_restant,
-            'OD': 0,
-            'Montant du paiement groupé': 0,
-            'Lettrage': '',
-            'Lettrage corrigé': '',
-            'Solde': solde_reliquat
-        })
-
-    # Ajouter les OD non lettrés (journaux autres que achat/banque, sans lettrage)
-    od_non_lettres = grand_livre_df[
-        (grand_livre_df['Compte'].astype(str).str.startswith('4411')) &
-        (~grand_livre_df['Journal'].isin(journaux_connus)) &
-        ((grand_livre_df['LettrageCorrige'].str.strip() == '') | (grand_livre_df['LettrageCorrige'].isna())) &
-        ((grand_livre_df['MontantFacture'] != 0) | (grand_livre_df['MontantMvt'] != 0))
-    ].copy()
-
-    for _, od in od_non_lettres.iterrows():
-        compte_fournisseur = str(od['Compte']).strip()
-        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
-        
-        # OD = MontantFacture - MontantMvt (ColG - ColF)
-        montant_od = od['MontantFacture'] - od['MontantMvt']
-
-        resultats.append({
-            'Date de facture': od['Date'],
-            'N° de facture': od['NumPiece'],
-            'N° compte fournisseur': compte_fournisseur,
-            'Nom du fournisseur': nom_fournisseur,
-            'Libellé de l\'opération': od['Libelle'],
-            'Montant de la facture': 0,
-            'Avoir': 0,
-            'Montant facture net': 0,
-            'Date de paiement': None,
-            'Montant du paiement': 0,
-            'OD': montant_od,
-            'Montant du paiement groupé': 0,
-            'Lettrage': '',
-            'Lettrage corrigé': '',
-            'Solde': montant_od
-        })
-
-    # Ajouter les avoirs non lettrés (sans lettrage)
-    for avoir in avoirs_non_lettres:
-        compte_fournisseur = str(avoir['Compte']).strip()
-        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
-        montant_avoir = avoir['MontantMvt']
-        
-        resultats.append({
-            'Date de facture': None,
-            'N° de facture': avoir['NumPiece'],
-            'N° compte fournisseur': compte_fournisseur,
-            'Nom du fournisseur': nom_fournisseur,
-            'Libellé de l\'opération': avoir['Libelle'],
-            'Montant de la facture': 0,
-            'Avoir': montant_avoir,
-            'Montant facture net': -montant_avoir,
-            'Date de paiement': avoir['Date'],
-            'Montant du paiement': 0,
-            'OD': 0,
-            'Montant du paiement groupé': 0,
-            'Lettrage': '',
-            'Lettrage corrigé': '',
-            'Solde': -montant_avoir
-        })
-
-    # Ajouter les remboursements fournisseurs non lettrés
-    for remb in remboursements_non_lettres.iterrows():
-        remboursement = remb[1]
-        compte_fournisseur = str(remboursement['Compte']).strip()
-        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
-        montant_remboursement = remboursement['MontantFacture']
-        
-        resultats.append({
-            'Date de facture': None,
-            'N° de facture': remboursement['NumPiece'],
-            'N° compte fournisseur': compte_fournisseur,
-            'Nom du fournisseur': nom_fournisseur,
-            'Libellé de l\'opération': remboursement['Libelle'],
-            'Montant de la facture': 0,
-            'Avoir': 0,
-            'Montant facture net': 0,
-            'Date de paiement': remboursement['Date'],
-            'Montant du paiement': -montant_remboursement,  # Négatif car nous remboursons
-            'OD': 0,
-            'Montant du paiement groupé': 0,
-            'Lettrage': '',
-            'Lettrage corrigé': '',
-            'Solde': montant_remboursement  # Positif car dette envers le fournisseur
-        })
-
-    df_resultats = pd.DataFrame(resultats)
-
-    for col in ['Date de facture', 'Date de paiement']:
-        if col in df_resultats.columns:
-            df_resultats[col] = pd.to_datetime(df_resultats[col], errors='coerce')
-
-    if len(df_resultats) > 0:
-        df_resultats = df_resultats.sort_values(
-            by=['N° compte fournisseur', 'Date de facture'],
-            ascending=[True, True],
-            na_position='last'
-        ).reset_index(drop=True)
-
-        df_resultats['N° de facture'] = df_resultats['N° de facture'].astype(str)
-        df_resultats['N° compte fournisseur'] = df_resultats['N° compte fournisseur'].astype(str)
-        df_resultats['Nom du fournisseur'] = df_resultats['Nom du fournisseur'].astype(str)
-        df_resultats['Libellé de l\'opération'] = df_resultats['Libellé de l\'opération'].astype(str)
-        df_resultats['Lettrage'] = df_resultats['Lettrage'].astype(str)
-        df_resultats['Lettrage corrigé'] = df_resultats['Lettrage corrigé'].astype(str)
-
-    return df_resultats
-
-def export_to_excel(df):
-    output = io.BytesIO()
-
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        # Calculer la ligne de total
-        colonnes_montants = ['Montant de la facture', 'Avoir', 'Montant facture net',
-                           'Montant du paiement', 'OD', 'Montant du paiement groupé', 'Solde']
-
-        totaux = {'Date de facture': 'TOTAL'}
-        for col in df.columns:
-            if col in colonnes_montants:
-                totaux[col] = df[col].sum()
-            elif col == 'Date de facture':
-                totaux[col] = 'TOTAL'
-            else:
-                totaux[col] = ''
-
-        # Créer un DataFrame avec la ligne total en premier
-        df_total = pd.DataFrame([totaux])
-        df_export = pd.concat([df_total, df], ignore_index=True)
-
-        df_export.to_excel(writer, sheet_name='Rapprochement', index=False)
-
-        workbook = writer.book
-        worksheet = writer.sheets['Rapprochement']
-
-        # Styles
-        header_font = Font(bold=True, color='FFFFFF', size=10)
-        header_fill = PatternFill(start_color='1E3A5F', end_color='1E3A5F', fill_type='solid')
-        header_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-
-        total_font = Font(bold=True, size=10)
-        total_fill = PatternFill(start_color='E8F4FD', end_color='E8F4FD', fill_type='solid')
-
-        cell_alignment = Alignment(horizontal='center', vertical='center')
-        number_alignment = Alignment(horizontal='right', vertical='center')
-
-        thin_border = Border(
-            left=Side(style='thin', color='CCCCCC'),
-            right=Side(style='thin', color='CCCCCC'),
-            top=Side(style='thin', color='CCCCCC'),
-            bottom=Side(style='thin', color='CCCCCC')
-        )
-
-        # Appliquer le style aux en-têtes (ligne 1)
-        for col_idx in range(1, len(df_export.columns) + 1):
-            cell = worksheet.cell(row=1, column=col_idx)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-            cell.border = thin_border
-
-        # Appliquer le style à la ligne TOTAL (ligne 2)
-        for col_idx in range(1, len(df_export.columns) + 1):
-            cell = worksheet.cell(row=2, column=col_idx)
-            cell.font = total_font
-            cell.fill = total_fill
-            cell.border = thin_border
-
-        # Colonnes de montants (indices basés sur l'ordre des colonnes)
-        col_indices_montants = []
-        for i, col_name in enumerate(df_export.columns, 1):
-            if col_name in colonnes_montants:
-                col_indices_montants.append(i)
-
-        # Colonnes de dates
-        col_indices_dates = []
-        for i, col_name in enumerate(df_export.columns, 1):
-            if col_name in ['Date de facture', 'Date de paiement']:
-                col_indices_dates.append(i)
-
-        # Formater toutes les cellules
-        for row in range(2, len(df_export) + 2):
-            for col_idx in range(1, len(df_export.columns) + 1):
-                cell = worksheet.cell(row=row, column=col_idx)
-                cell.border = thin_border
-
-                if col_idx in col_indices_dates:
-                    cell.number_format = 'DD/MM/YYYY'
-                    cell.alignment = cell_alignment
-                elif col_idx in col_indices_montants:
-                    # Format avec séparateur de milliers et "-" pour les zéros
-                    # Ce format affiche "-" pour 0 tout en gardant la valeur numérique
-                    cell.number_format = '#,##0.00;-#,##0.00;"-"'
-                    cell.alignment = number_alignment
-                else:
-                    cell.alignment = cell_alignment
-
-        # Ajuster la largeur des colonnes
-        column_widths = {
-            'Date de facture': 12,
-            'N° de facture': 15,
-            'N° compte fournisseur': 12,
-            'Nom du fournisseur': 25,
-            'Libellé de l\'opération': 30,
-            'Montant de la facture': 15,
-            'Avoir': 12,
-            'Montant facture net': 15,
-            'Date de paiement': 12,
-            'Montant du paiement': 15,
-            'OD': 12,
-            'Montant du paiement groupé': 15,
-            'Lettrage': 10,
-            'Lettrage corrigé': 12,
-            'Solde': 12
-        }
-
-        for i, col_name in enumerate(df_export.columns, 1):
-            col_letter = get_column_letter(i)
-            width = column_widths.get(col_name, 15)
-            worksheet.column_dimensions[col_letter].width = width
-
-        # Hauteur de la ligne d'en-tête
-        worksheet.row_dimensions[1].height = 40
-
-        # Figer les volets en cellule E3 (lignes 1-2 et colonnes A-D figées)
-        worksheet.freeze_panes = 'E3'
-
-    output.seek(0)
-    return output
+    return rapprochement['vues'][cle]
 
 # Interface principale
-if grand_livre_file and balance_file:
+if gl_empreinte and balance_empreinte:
     try:
+        profil = nouveau_profil(dossier=nom_dossier, nb_processus=int(nb_processus),
+                                mode='incrémental' if mode_incremental else 'complet')
         with st.spinner("Chargement des fichiers..."):
-            # Lire les bytes des fichiers pour le cache
-            gl_bytes = grand_livre_file.read()
-            grand_livre_file.seek(0)
-            balance_bytes = balance_file.read()
-            balance_file.seek(0)
-
-            grand_livre_df = load_grand_livre(gl_bytes)
-            balance_df, has_header = load_balance(balance_bytes)
-
-        dict_fournisseurs, col_compte, col_nom = creer_dict_fournisseurs(balance_df, has_header)
+            # Sous-étapes absentes quand le Grand Livre est déjà dans le cache Streamlit
+            with etape(profil, 'chargement_grand_livre') as mesure:
+                grand_livre_df, stats_chargement_gl = load_grand_livre(gl_empreinte, _fichier=grand_livre_file, _profil=profil)
+                mesure['lignes'] = len(grand_livre_df)
+            with etape(profil, 'chargement_balance') as mesure:
+                balance_df, dict_fournisseurs, col_compte, col_nom = load_balance(balance_empreinte, _fichier=balance_file)
+                mesure['lignes'] = len(dict_fournisseurs)
 
         st.success("✓ Fichiers chargés avec succès")
 
@@ -2032,10 +703,14 @@ if grand_livre_file and balance_file:
         with col1:
             st.markdown(f'''
                 <div class="metric-card">
-                    <h3>Lignes Grand Livre</h3>
+                    <h3>Lignes Grand Livre (4411/4415)</h3>
                     <p class="value">{len(grand_livre_df):,}</p>
                 </div>
             '''.replace(',', ' '), unsafe_allow_html=True)
+            st.caption(f"{stats_chargement_gl['lignes_conservees']:,} lignes conservées sur {stats_chargement_gl['lignes_lues']:,} lues".replace(',', ' '))
+            if stats_chargement_gl.get('dates_non_reconnues'):
+                st.warning(f"⚠️ {stats_chargement_gl['dates_non_reconnues']} date(s) non reconnue(s) dans le Grand Livre "
+                           "(lignes conservées sans date)")
         with col2:
             st.markdown(f'''
                 <div class="metric-card">
@@ -2052,7 +727,8 @@ if grand_livre_file and balance_file:
             ''', unsafe_allow_html=True)
 
         with st.expander("📋 Aperçu du Grand Livre", expanded=False):
-            st.dataframe(grand_livre_df.head(20), use_container_width=True)
+            # Montants du Grand Livre en centimes dans le moteur : affichés en dirhams
+            st.dataframe(grand_livre_en_dirhams(grand_livre_df.head(20)), use_container_width=True)
 
         with st.expander("📋 Aperçu de la Balance", expanded=False):
             st.info(f"Colonnes detectees - Compte: **{col_compte}**, Nom: **{col_nom}**")
@@ -2075,28 +751,88 @@ if grand_livre_file and balance_file:
 
         st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
 
+        # Résultats conservés dans la session (un clic ou un téléchargement relance le script) :
+        # ils restent valables tant que Grand Livre, Balance et journaux sont inchangés
+        cle_resultats = cle_session_rapprochement(gl_empreinte, balance_empreinte, journaux_achat, journaux_banque)
+
         # Bouton centré
         col_btn_left, col_btn_center, col_btn_right = st.columns([1, 2, 1])
         with col_btn_center:
             if st.button("🚀 Lancer le rapprochement", type="primary", use_container_width=True):
                 with st.spinner("Traitement en cours..."):
-                    resultats_df = traiter_rapprochement(
-                        grand_livre_df,
-                        dict_fournisseurs,
-                        journaux_achat,
-                        journaux_banque
-                    )
+                    stats_incremental = None
+                    if mode_incremental:
+                        resultats_df, etat_rapprochement, stats_incremental = traiter_rapprochement_incremental(
+                            grand_livre_df,
+                            dict_fournisseurs,
+                            journaux_achat,
+                            journaux_banque,
+                            etat_precedent=lire_etat_rapprochement(nom_dossier),
+                            nb_processus=nb_processus,
+                            profil=profil,
+                            methode_demarrage=METHODE_DEMARRAGE_PROCESSUS
+                        )
+                        with etape(profil, 'sauvegarde_etat', len(resultats_df)):
+                            ecrire_etat_rapprochement(nom_dossier, etat_rapprochement)
+                    else:
+                        resultats_df = traiter_rapprochement(
+                            grand_livre_df,
+                            dict_fournisseurs,
+                            journaux_achat,
+                            journaux_banque,
+                            nb_processus=nb_processus,
+                            profil=profil,
+                            methode_demarrage=METHODE_DEMARRAGE_PROCESSUS
+                        )
 
-                st.success(f"✓ Rapprochement terminé ! **{len(resultats_df)} lignes** générées")
+                    with etape(profil, 'controle_solde'):
+                        controle_solde = verifier_solde(grand_livre_df, resultats_df)
+                        ecarts_df = ecarts_par_fournisseur(grand_livre_df, resultats_df, dict_fournisseurs)
+
+                    rapprochement = {
+                        'cle': cle_resultats,
+                        'resultats_df': resultats_df,
+                        'vues': {},
+                        'controle_solde': controle_solde,
+                        'ecarts_df': ecarts_df,
+                        'stats_incremental': stats_incremental
+                    }
+                    # Délais à la clôture par défaut ; une autre date est calculée à la demande
+                    vue_delais(rapprochement, delai_max, date_cloture_par_defaut(resultats_df), profil)
+
+                enregistrement_profil = terminer_profil(profil)
+                enregistrement_profil.update({
+                    'lignes_grand_livre': len(grand_livre_df),
+                    'fournisseurs': len(dict_fournisseurs),
+                    'lignes_resultat': len(resultats_df)
+                })
+                ecrire_enregistrement(enregistrement_profil, PROFILS_FILE)
+
+                rapprochement['profil'] = enregistrement_profil
+                st.session_state.rapprochement = rapprochement
 
-                # Calcul du solde attendu depuis le grand livre
-                gl_4411 = grand_livre_df[grand_livre_df['Compte'].astype(str).str.startswith('4411')]
-                total_g = gl_4411['MontantFacture'].sum()  # Total colonne G
-                total_f = gl_4411['MontantMvt'].sum()       # Total colonne F
-                solde_attendu = total_g - total_f
+            rapprochement = st.session_state.get('rapprochement')
+            if rapprochement is not None and rapprochement['cle'] != cle_resultats:
+                # Fichiers ou journaux modifiés : les résultats conservés sont périmés
+                del st.session_state.rapprochement
+                rapprochement = None
 
-                # Solde calculé depuis les résultats
-                solde_calcule = resultats_df['Solde'].sum()
+            if rapprochement is not None:
+                resultats_df = rapprochement['resultats_df']
+                controle_solde = rapprochement['controle_solde']
+                stats_incremental = rapprochement['stats_incremental']
+                enregistrement_profil = rapprochement['profil']
+
+                st.success(f"✓ Rapprochement terminé ! **{len(resultats_df)} lignes** générées")
+                if stats_incremental is not None:
+                    st.caption(f"Mode incrémental : {stats_incremental['comptes_recalcules']} compte(s) recalculé(s) "
+                               f"sur {stats_incremental['comptes_total']}")
+
+                # Solde attendu depuis le grand livre (G - F) et solde calculé depuis les résultats
+                total_g = controle_solde['total_g']  # Total colonne G
+                total_f = controle_solde['total_f']  # Total colonne F
+                solde_attendu = controle_solde['solde_attendu']
+                solde_calcule = controle_solde['solde_calcule']
 
                 # Statistiques
                 st.markdown('<p class="section-title">📊 Statistiques</p>', unsafe_allow_html=True)
@@ -2116,6 +852,12 @@ if grand_livre_file and balance_file:
                     total_montant = resultats_df['Montant de la facture'].sum()
                     st.metric("Total factures", f"{total_montant:,.2f} MAD".replace(',', ' ').replace('.', ','))
 
+                with st.expander("⏱️ Performance", expanded=False):
+                    st.caption(f"Durée totale mesurée : {enregistrement_profil['duree_totale']:.2f} s - "
+                               "mémoire max = pic du processus à la fin de l'étape")
+                    st.dataframe(pd.DataFrame(etapes_en_tableau(enregistrement_profil)),
+                                 use_container_width=True, hide_index=True)
+
                 # Vérification du solde
                 st.markdown('<p class="section-title">✅ Vérification du solde</p>', unsafe_allow_html=True)
                 col_v1, col_v2, col_v3 = st.columns(3)
@@ -2126,45 +868,74 @@ if grand_livre_file and balance_file:
                 with col_v3:
                     st.metric("Solde attendu (G - F)", f"{solde_attendu:,.2f}".replace(',', ' ').replace('.', ','))
 
-                ecart = abs(solde_calcule - solde_attendu)
-                if ecart < 0.01:
+                ecart = controle_solde['ecart']
+                if controle_solde['conforme']:
                     st.success(f"✅ Solde calculé: **{solde_calcule:,.2f}** MAD - Conforme au grand livre !".replace(',', ' ').replace('.', ','))
                 else:
                     st.warning(f"⚠️ Solde calculé: **{solde_calcule:,.2f}** MAD - Écart de **{ecart:,.2f}** MAD".replace(',', ' ').replace('.', ','))
 
-                st.markdown("### Resultats du rapprochement")
+                # Écarts par fournisseur, du plus important au plus faible (feuille du classeur Excel)
+                ecarts_df = rapprochement['ecarts_df']
+                ecarts_fournisseurs_df = ecarts_df[ecarts_df['Écart'].abs() >= 0.01]
+                with st.expander(f"🔍 Écarts par fournisseur ({len(ecarts_fournisseurs_df)})",
+                                 expanded=not controle_solde['conforme']):
+                    if len(ecarts_fournisseurs_df) == 0:
+                        st.info("Aucun écart : le solde de chaque fournisseur est conforme au grand livre")
+                    else:
+                        st.dataframe(formater_resultats_affichage(ecarts_fournisseurs_df),
+                                     use_container_width=True, hide_index=True)
+                        st.caption("Écart = solde calculé - solde du grand livre. "
+                                   "Tous les fournisseurs figurent dans la feuille « Écarts de solde » du fichier Excel")
+
+                # Délais de paiement
+                st.markdown('<p class="section-title">⏳ Délais de paiement</p>', unsafe_allow_html=True)
+                date_cloture = st.date_input(
+                    "Date de clôture",
+                    value=date_cloture_par_defaut(resultats_df),
+                    format="DD/MM/YYYY",
+                    help="Les factures non payées sont en retard si leur délai, arrêté à cette date, "
+                         f"dépasse {int(delai_max)} jours"
+                )
+                vue = vue_delais(rapprochement, delai_max,
+                                 pd.Timestamp(date_cloture) if date_cloture is not None else None)
+                synthese_df = vue['synthese_df']
 
-                # Affichage formaté
-                display_df = resultats_df.copy()
-                display_df['Date de facture'] = display_df['Date de facture'].dt.strftime('%d/%m/%Y')
-                display_df['Date de paiement'] = display_df['Date de paiement'].dt.strftime('%d/%m/%Y')
-
-                colonnes_montants = ['Montant de la facture', 'Avoir', 'Montant facture net',
-                                    'Montant du paiement', 'OD', 'Montant du paiement groupé', 'Solde']
-                for col in colonnes_montants:
-                    if col in display_df.columns:
-                        display_df[col] = display_df[col].apply(
-                            lambda x: "-" if x == 0 else f"{x:,.2f}".replace(',', ' ').replace('.', ',') if pd.notna(x) else ''
-                        )
+                col_d1, col_d2, col_d3 = st.columns(3)
+                with col_d1:
+                    st.metric("Fournisseurs en retard", int((synthese_df['Montant en retard'] != 0).sum()))
+                with col_d2:
+                    st.metric("Montant en retard", f"{synthese_df['Montant en retard'].sum():,.2f} MAD".replace(',', ' ').replace('.', ','))
+                with col_d3:
+                    st.metric("Dont non payé", f"{synthese_df['Dont non payé'].sum():,.2f} MAD".replace(',', ' ').replace('.', ','))
 
-                display_df = display_df.fillna('')
+                with st.expander("📋 Synthèse par fournisseur", expanded=False):
+                    st.dataframe(vue['display_synthese_df'], use_container_width=True, hide_index=True)
+
+                st.markdown("### Resultats du rapprochement")
 
                 st.dataframe(
-                    display_df,
+                    vue['display_df'],
                     use_container_width=True,
                     height=400
                 )
 
                 # Téléchargement
-                excel_file = export_to_excel(resultats_df)
-
                 col_dl_left, col_dl_center, col_dl_right = st.columns([1, 2, 1])
                 with col_dl_center:
+                    format_export = st.selectbox(
+                        "Format du fichier",
+                        list(LIBELLES_FORMATS_EXPORT),
+                        format_func=LIBELLES_FORMATS_EXPORT.get,
+                        key="format_export",
+                        help="Excel : classeur mis en forme. Parquet / CSV : données brutes pour d'autres outils"
+                    )
+                    _, extension, mime = FORMATS_EXPORT[format_export]
                     st.download_button(
-                        label="Telecharger le fichier Excel",
-                        data=excel_file,
-                        file_name=f"rapprochement_delais_paiement_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        label=f"Telecharger le fichier {LIBELLES_FORMATS_EXPORT[format_export]}",
+                        data=generateur_export(vue['exports'], vue['resultats_df'], format_export,
+                                               vue['synthese_df'], ecarts_df),
+                        file_name=f"rapprochement_delais_paiement_{datetime.now().strftime('%Y%m%d_%H%M%S')}{extension}",
+                        mime=mime,
                         type="primary",
                         use_container_width=True
                     )
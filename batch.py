@@ -0,0 +1,226 @@
+"""
+Traitement par lots, sans interface : rapprochement de plusieurs dossiers clients.
+
+Chaque sous-dossier du répertoire d'entrée est un dossier client contenant :
+- le Grand Livre (fichier Excel dont le nom contient "grand_livre", "grand livre" ou commence par "gl")
+- la Balance fournisseurs (fichier Excel dont le nom contient "balance")
+- la configuration des journaux (config_journaux.json, même format que l'application) ;
+  à défaut, celle passée par --config, sinon les journaux par défaut
+
+Les dossiers sont traités en parallèle sur un pool de processus. Un fichier de résultats
+(avec les délais de paiement) est écrit par dossier, accompagné de la synthèse par
+fournisseur et des écarts de solde par fournisseur (feuilles du classeur Excel, ou
+fichiers <dossier>_synthese et <dossier>_ecarts), ainsi qu'un manifeste (manifeste.json) avec les durées et l'écart
+de solde de chaque dossier. Le détail par étape (durée, lignes, mémoire) de chaque
+dossier est ajouté au journal profils_performance.jsonl du dossier de sortie.
+
+Usage : python batch.py DOSSIERS --sortie RESULTATS [--format excel|parquet|csv] [--processus N]
+                      [--delai 60] [--date-cloture AAAA-MM-JJ]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import pandas as pd
+
+from chargement import CONFIG_JOURNAUX_DEFAUT, charger_balance, journaux_depuis_texte, parser_grand_livre
+from delais import DELAI_MAX_DEFAUT, calculer_delais, date_cloture_par_defaut, synthese_par_fournisseur
+from export import FORMATS_EXPORT
+from profilage import ecrire_enregistrement, etape, nouveau_profil, terminer_profil
+from rapprochement import ecarts_par_fournisseur, traiter_rapprochement, verifier_solde
+
+NOM_CONFIG_DOSSIER = "config_journaux.json"
+NOM_MANIFESTE = "manifeste.json"
+NOM_PROFILS = "profils_performance.jsonl"
+EXTENSIONS_EXCEL = ('.xlsx', '.xls')
+
+def lire_config_journaux(chemin):
+    """Charger une configuration de journaux (textes un code par ligne, ou listes)"""
+    with open(chemin, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    journaux = {}
+    for cle in ('journaux_achat', 'journaux_banque'):
+        valeur = config.get(cle, CONFIG_JOURNAUX_DEFAUT[cle])
+        journaux[cle] = journaux_depuis_texte(valeur) if isinstance(valeur, str) else [str(j).strip() for j in valeur]
+    return journaux
+
+def trouver_fichiers_dossier(chemin_dossier):
+    """Repérer le Grand Livre, la Balance et la configuration d'un dossier client"""
+    fichier_gl = None
+    fichier_balance = None
+    for nom in sorted(os.listdir(chemin_dossier)):
+        nom_min = nom.lower()
+        if not nom_min.endswith(EXTENSIONS_EXCEL) or nom_min.startswith('~$'):
+            continue
+        if 'balance' in nom_min:
+            fichier_balance = fichier_balance or os.path.join(chemin_dossier, nom)
+        elif ('grand' in nom_min and 'livre' in nom_min) or nom_min.startswith('gl'):
+            fichier_gl = fichier_gl or os.path.join(chemin_dossier, nom)
+
+    fichier_config = os.path.join(chemin_dossier, NOM_CONFIG_DOSSIER)
+    if not os.path.exists(fichier_config):
+        fichier_config = None
+    return fichier_gl, fichier_balance, fichier_config
+
+def traiter_dossier(chemin_dossier, dossier_sortie, format_sortie, config_defaut, memoire_detaillee=False,
+                    delai_max=DELAI_MAX_DEFAUT, date_cloture=None):
+    """
+    Rapprochement complet d'un dossier client (exécuté dans un processus du pool), puis
+    délais de paiement (clôture par défaut : 31/12 de l'année de la dernière facture).
+    Retourne l'entrée du manifeste : statut, durées par étape, contrôle du solde
+    et profil détaillé ('profil', retiré du manifeste et écrit dans le journal des performances).
+    """
+    nom_dossier = os.path.basename(os.path.normpath(chemin_dossier))
+    entree = {'dossier': nom_dossier, 'statut': 'ok'}
+    profil = nouveau_profil(memoire_detaillee, dossier=nom_dossier, format=format_sortie)
+    debut = time.perf_counter()
+    try:
+        fichier_gl, fichier_balance, fichier_config = trouver_fichiers_dossier(chemin_dossier)
+        if fichier_gl is None:
+            raise FileNotFoundError("Grand Livre introuvable")
+        if fichier_balance is None:
+            raise FileNotFoundError("Balance introuvable")
+        journaux = lire_config_journaux(fichier_config) if fichier_config else config_defaut
+        entree['config'] = fichier_config or 'défaut'
+
+        with etape(profil, 'chargement_grand_livre') as mesure:
+            with open(fichier_gl, 'rb') as f:
+                grand_livre_df, stats_chargement = parser_grand_livre(f.read(), profil)
+            mesure['lignes'] = len(grand_livre_df)
+        with etape(profil, 'chargement_balance') as mesure:
+            with open(fichier_balance, 'rb') as f:
+                _, dict_fournisseurs, _, _ = charger_balance(f.read())
+            mesure['lignes'] = len(dict_fournisseurs)
+        fin_chargement = time.perf_counter()
+
+        resultats_df = traiter_rapprochement(
+            grand_livre_df, dict_fournisseurs, journaux['journaux_achat'], journaux['journaux_banque'],
+            profil=profil)
+        if date_cloture is None:
+            date_cloture = date_cloture_par_defaut(resultats_df)
+        with etape(profil, 'delais_paiement', len(resultats_df)):
+            resultats_delais_df = calculer_delais(resultats_df, delai_max, date_cloture)
+            synthese_df = synthese_par_fournisseur(resultats_delais_df)
+        with etape(profil, 'controle_solde'):
+            controle_solde = verifier_solde(grand_livre_df, resultats_df)
+            ecarts_df = ecarts_par_fournisseur(grand_livre_df, resultats_df, dict_fournisseurs)
+        fin_rapprochement = time.perf_counter()
+
+        # Écriture directe dans le fichier de sortie, sans passer par un classeur en mémoire
+        ecrire, extension, _ = FORMATS_EXPORT[format_sortie]
+        fichier_sortie = os.path.join(dossier_sortie, nom_dossier + extension)
+        with etape(profil, 'export_' + format_sortie, len(resultats_df)):
+            if format_sortie == 'excel':
+                ecrire(resultats_delais_df, fichier_sortie, synthese_df, ecarts_df)
+            else:
+                ecrire(resultats_delais_df, fichier_sortie)
+                entree['fichier_synthese'] = os.path.join(dossier_sortie, nom_dossier + '_synthese' + extension)
+                ecrire(synthese_df, entree['fichier_synthese'])
+                entree['fichier_ecarts'] = os.path.join(dossier_sortie, nom_dossier + '_ecarts' + extension)
+                ecrire(ecarts_df, entree['fichier_ecarts'])
+        fin_export = time.perf_counter()
+
+        entree.update({
+            'fichier': fichier_sortie,
+            'lignes_grand_livre': stats_chargement['lignes_conservees'],
+            'dates_non_reconnues': stats_chargement['dates_non_reconnues'],
+            'lignes_resultat': len(resultats_df),
+            'fournisseurs': len(dict_fournisseurs),
+            'delai_max': delai_max,
+            'date_cloture': date_cloture.strftime('%Y-%m-%d') if date_cloture is not None else None,
+            'montant_en_retard': round(float(synthese_df['Montant en retard'].sum()), 2),
+            'duree_chargement': round(fin_chargement - debut, 3),
+            'duree_rapprochement': round(fin_rapprochement - fin_chargement, 3),
+            'duree_export': round(fin_export - fin_rapprochement, 3),
+        })
+        entree.update({cle: round(valeur, 2) if isinstance(valeur, float) else valeur
+                       for cle, valeur in controle_solde.items()})
+        entree['fournisseurs_avec_ecart'] = int((ecarts_df['Écart'].abs() >= 0.01).sum())
+    except Exception as e:
+        entree['statut'] = 'erreur'
+        entree['erreur'] = f"{type(e).__name__}: {e}"
+    entree['duree_totale'] = round(time.perf_counter() - debut, 3)
+    entree['profil'] = dict(terminer_profil(profil), statut=entree['statut'])
+    return entree
+
+def lister_dossiers(repertoire):
+    """Sous-dossiers clients du répertoire d'entrée, par ordre alphabétique"""
+    return [
+        os.path.join(repertoire, nom) for nom in sorted(os.listdir(repertoire))
+        if os.path.isdir(os.path.join(repertoire, nom)) and not nom.startswith('.')
+    ]
+
+def traiter_lot(repertoire, dossier_sortie, format_sortie='excel', nb_processus=None, fichier_config=None,
+                memoire_detaillee=False, delai_max=DELAI_MAX_DEFAUT, date_cloture=None):
+    """Rapprocher tous les dossiers du répertoire et écrire le manifeste. Retourne le manifeste."""
+    os.makedirs(dossier_sortie, exist_ok=True)
+    config_defaut = lire_config_journaux(fichier_config) if fichier_config else {
+        cle: journaux_depuis_texte(valeur) for cle, valeur in CONFIG_JOURNAUX_DEFAUT.items()
+    }
+    dossiers = lister_dossiers(repertoire)
+
+    debut = time.perf_counter()
+    entrees = []
+    with ProcessPoolExecutor(max_workers=nb_processus) as executor:
+        futures = [
+            executor.submit(traiter_dossier, chemin, dossier_sortie, format_sortie, config_defaut, memoire_detaillee,
+                            delai_max, date_cloture)
+            for chemin in dossiers
+        ]
+        for future in as_completed(futures):
+            entree = future.result()
+            ecrire_enregistrement(entree.pop('profil'), os.path.join(dossier_sortie, NOM_PROFILS))
+            entrees.append(entree)
+            if entree['statut'] == 'ok':
+                ecart = f"{entree['ecart']:,.2f}".replace(',', ' ').replace('.', ',')
+                print(f"[{len(entrees)}/{len(dossiers)}] {entree['dossier']} : {entree['lignes_resultat']} lignes, "
+                      f"écart {ecart} MAD, {entree['duree_totale']:.1f} s")
+            else:
+                print(f"[{len(entrees)}/{len(dossiers)}] {entree['dossier']} : ERREUR {entree['erreur']}")
+
+    entrees.sort(key=lambda e: e['dossier'])
+    manifeste = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'repertoire': os.path.abspath(repertoire),
+        'format': format_sortie,
+        'delai_max': delai_max,
+        'dossiers_total': len(entrees),
+        'dossiers_en_erreur': sum(1 for e in entrees if e['statut'] != 'ok'),
+        'dossiers_avec_ecart': sum(1 for e in entrees if e['statut'] == 'ok' and not e['conforme']),
+        'duree_totale': round(time.perf_counter() - debut, 3),
+        'dossiers': entrees
+    }
+    with open(os.path.join(dossier_sortie, NOM_MANIFESTE), 'w', encoding='utf-8') as f:
+        json.dump(manifeste, f, ensure_ascii=False, indent=2)
+    return manifeste
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rapprochement par lots des dossiers clients (délais de paiement)")
+    parser.add_argument('repertoire', help="Répertoire contenant un sous-dossier par client")
+    parser.add_argument('--sortie', required=True, help="Dossier des résultats et du manifeste")
+    parser.add_argument('--format', choices=sorted(FORMATS_EXPORT), default='excel', help="Format des résultats")
+    parser.add_argument('--processus', type=int, default=None,
+                        help="Nombre de dossiers traités en parallèle (défaut : nombre de cœurs)")
+    parser.add_argument('--config', default=None,
+                        help="Configuration des journaux pour les dossiers sans config_journaux.json")
+    parser.add_argument('--delai', type=int, default=DELAI_MAX_DEFAUT,
+                        help="Délai de paiement maximal en jours (défaut : 60)")
+    parser.add_argument('--date-cloture', type=pd.Timestamp, default=None,
+                        help="Date d'arrêté des factures non payées, AAAA-MM-JJ "
+                             "(défaut : 31/12 de l'année de la dernière facture de chaque dossier)")
+    parser.add_argument('--profil-memoire', action='store_true',
+                        help="Pic d'allocation par étape (tracemalloc) dans le journal des performances ; plus lent")
+    args = parser.parse_args(argv)
+
+    manifeste = traiter_lot(args.repertoire, args.sortie, args.format, args.processus, args.config,
+                            args.profil_memoire, args.delai, args.date_cloture)
+    print(f"{manifeste['dossiers_total']} dossier(s) en {manifeste['duree_totale']:.1f} s - "
+          f"{manifeste['dossiers_en_erreur']} en erreur, {manifeste['dossiers_avec_ecart']} avec écart de solde")
+    return 1 if manifeste['dossiers_en_erreur'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
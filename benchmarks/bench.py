@@ -0,0 +1,151 @@
+"""
+Mesures de performance à plusieurs tailles de Grand Livre (10k, 100k, 1M lignes).
+
+Pour chaque taille, un Grand Livre synthétique est généré (ou repris du dossier de
+données s'il existe déjà pour la même graine), puis chargé, rapproché et exporté dans
+un processus neuf, afin que la mémoire maximale mesurée soit propre à la taille.
+Chaque exécution ajoute un enregistrement JSON au fichier de résultats, pour comparer
+les exécutions entre elles (avant / après une optimisation).
+
+Usage : python -m benchmarks.bench [--tailles 10000 100000] [--processus 4] [--sans-export]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RACINE not in sys.path:
+    sys.path.insert(0, RACINE)
+
+from benchmarks.generateur import ecrire_grand_livre_xlsx, generer_grand_livre  # noqa: E402
+
+TAILLES_DEFAUT = [10_000, 100_000, 1_000_000]
+DOSSIER_DONNEES = os.path.join(RACINE, 'benchmarks', 'donnees')
+FICHIER_RESULTATS = os.path.join(RACINE, 'benchmarks', 'resultats.jsonl')
+
+def memoire_max_mo():
+    """Mémoire résidente maximale du processus courant (Mo), None si non disponible"""
+    if resource is None:
+        return None
+    pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss est en octets sous macOS, en kilo-octets ailleurs
+    return round(pic / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def preparer_donnees(nb_lignes, graine, dossier):
+    """Générer (une seule fois par taille et graine) le Grand Livre et la Balance"""
+    os.makedirs(dossier, exist_ok=True)
+    fichier_gl = os.path.join(dossier, f"gl_{nb_lignes}_{graine}.xlsx")
+    fichier_balance = os.path.join(dossier, f"balance_{nb_lignes}_{graine}.xlsx")
+    if not (os.path.exists(fichier_gl) and os.path.exists(fichier_balance)):
+        lignes, balance_df = generer_grand_livre(nb_lignes, graine)
+        ecrire_grand_livre_xlsx(lignes, fichier_gl)
+        balance_df.to_excel(fichier_balance, index=False)
+    return fichier_gl, fichier_balance
+
+def mesurer_taille(fichier_gl, fichier_balance, nb_processus, avec_export):
+    """
+    Chargement, rapprochement et export d'un Grand Livre (exécuté dans un processus neuf).
+    Retourne les durées et la mémoire maximale atteinte après chaque étape.
+    """
+    from chargement import CONFIG_JOURNAUX_DEFAUT, charger_balance, journaux_depuis_texte, parser_grand_livre
+    from export import export_to_excel
+    from rapprochement import traiter_rapprochement
+
+    journaux_achat = journaux_depuis_texte(CONFIG_JOURNAUX_DEFAUT['journaux_achat'])
+    journaux_banque = journaux_depuis_texte(CONFIG_JOURNAUX_DEFAUT['journaux_banque'])
+    etapes = []
+
+    def etape(nom, debut, lignes):
+        etapes.append({'etape': nom, 'duree': round(time.perf_counter() - debut, 3),
+                       'lignes': lignes, 'memoire_max_mo': memoire_max_mo()})
+
+    debut = time.perf_counter()
+    with open(fichier_gl, 'rb') as f:
+        grand_livre_df, stats_chargement = parser_grand_livre(f.read())
+    etape('chargement_grand_livre', debut, stats_chargement['lignes_conservees'])
+
+    debut = time.perf_counter()
+    with open(fichier_balance, 'rb') as f:
+        _, dict_fournisseurs, _, _ = charger_balance(f.read())
+    etape('chargement_balance', debut, len(dict_fournisseurs))
+
+    debut = time.perf_counter()
+    resultats_df = traiter_rapprochement(grand_livre_df, dict_fournisseurs, journaux_achat, journaux_banque,
+                                         nb_processus=nb_processus)
+    etape('rapprochement', debut, len(resultats_df))
+
+    if avec_export:
+        debut = time.perf_counter()
+        taille_export = len(export_to_excel(resultats_df).getvalue())
+        etape('export_excel', debut, len(resultats_df))
+        etapes[-1]['octets'] = taille_export
+
+    return {'lignes_fichier': stats_chargement['lignes_lues'], 'etapes': etapes}
+
+def commit_courant():
+    """Commit git de l'arbre mesuré (None hors dépôt git)"""
+    try:
+        sortie = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RACINE,
+                                capture_output=True, text=True, timeout=10)
+        return sortie.stdout.strip() or None
+    except Exception:
+        return None
+
+def afficher(taille, mesure):
+    print(f"\n{taille:>9,} lignes visées ({mesure['lignes_fichier']:,} lues)".replace(',', ' '))
+    for e in mesure['etapes']:
+        memoire = f"{e['memoire_max_mo']:>8.1f} Mo" if e['memoire_max_mo'] is not None else "      n/d"
+        print(f"  {e['etape']:<24}{e['duree']:>9.2f} s{e['lignes']:>10} lignes{memoire}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mesures de performance du chargement, rapprochement et export")
+    parser.add_argument('--tailles', type=int, nargs='+', default=TAILLES_DEFAUT, help="Nombres de lignes du Grand Livre")
+    parser.add_argument('--graine', type=int, default=1)
+    parser.add_argument('--processus', type=int, default=1, help="Processus du moteur de rapprochement")
+    parser.add_argument('--sans-export', action='store_true', help="Ne pas mesurer l'export Excel")
+    parser.add_argument('--donnees', default=DOSSIER_DONNEES, help="Dossier des Grands Livres générés")
+    parser.add_argument('--sortie', default=FICHIER_RESULTATS, help="Fichier des résultats (une ligne JSON par exécution)")
+    args = parser.parse_args(argv)
+
+    import numpy as np
+    import pandas as pd
+    enregistrement = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit_courant(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'graine': args.graine,
+        'processus': args.processus,
+        'tailles': {}
+    }
+
+    for taille in args.tailles:
+        debut = time.perf_counter()
+        fichier_gl, fichier_balance = preparer_donnees(taille, args.graine, args.donnees)
+        print(f"Données {taille} lignes prêtes en {time.perf_counter() - debut:.1f} s")
+        # Processus neuf par taille : la mémoire maximale n'est pas héritée de la taille précédente
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            mesure = executor.submit(mesurer_taille, fichier_gl, fichier_balance, args.processus,
+                                     not args.sans_export).result()
+        afficher(taille, mesure)
+        enregistrement['tailles'][str(taille)] = mesure
+
+    with open(args.sortie, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(enregistrement, ensure_ascii=False) + '\n')
+    print(f"\nRésultats ajoutés à {args.sortie}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Générateur de Grands Livres synthétiques pour les mesures de performance.
+
+Les écritures imitent un export ERP réel (colonnes A à I, sans en-tête) : factures
+fournisseurs 4411, paiements lettrés ou non, avoirs, remboursements, écarts de change
+en OD, effets à payer 4415 et lignes d'autres comptes que le chargeur doit écarter.
+Même graine -> même Grand Livre.
+
+Usage : python -m benchmarks.generateur --lignes 100000 --sortie gl.xlsx --balance balance.xlsx
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+import pandas as pd
+from openpyxl import Workbook
+
+DATE_DEBUT = datetime(2024, 1, 1)
+COMPTES_AUTRES = [61110000, 61250000, 34552000, 51410000, 44520000]
+
+PARAMETRES_DEFAUT = {
+    'nb_fournisseurs': 100,
+    'factures_par_fournisseur': 50,
+    'part_lettree': 0.85,         # factures rapprochées par lettrage (le reste : non lettré)
+    'part_avoirs': 0.10,          # factures lettrées avec avoir
+    'part_remboursements': 0.03,  # factures lettrées avec avoir remboursé par virement
+    'part_effets': 0.05,          # factures lettrées payées par effet (4411 -> 4415 -> banque)
+    'part_od_change': 0.08,       # factures lettrées avec écart de change en OD
+    'part_autres_comptes': 0.30,  # lignes d'autres comptes (hors 4411/4415) dans le fichier
+}
+
+def generer_grand_livre(nb_lignes=None, graine=1, journal_achat='ACH', journal_banque='BNQ',
+                        journal_od='OD', journal_effet='EFF', **parametres):
+    """
+    Générer les écritures d'un Grand Livre et la Balance fournisseurs associée.
+    Si nb_lignes est fourni, des fournisseurs sont ajoutés jusqu'à atteindre ce nombre
+    de lignes (nb_fournisseurs est alors ignoré).
+    Retourne (lignes : listes de 9 cellules A..I, balance_df).
+    """
+    p = dict(PARAMETRES_DEFAUT, **parametres)
+    rnd = random.Random(graine)
+    lignes = []
+    fournisseurs = []
+    numero_piece = [100000]
+
+    def piece():
+        numero_piece[0] += 1
+        return numero_piece[0]
+
+    def date(jours):
+        return DATE_DEBUT + timedelta(days=jours)
+
+    def montant(minimum=100, maximum=80000):
+        return round(rnd.uniform(minimum, maximum), 2)
+
+    def ajouter(jours, journal, compte, libelle, mvt, facture, lettrage):
+        lignes.append([date(jours), journal, compte, piece(), libelle, mvt, facture, None, lettrage])
+
+    def fournisseur_termine():
+        if nb_lignes is not None:
+            return len(lignes) >= nb_lignes
+        return len(fournisseurs) >= p['nb_fournisseurs']
+
+    while not fournisseur_termine():
+        indice = len(fournisseurs)
+        compte = 44110000 + indice
+        compte_effet = 44150000 + indice
+        fournisseurs.append((compte, f"Fournisseur {indice:05d}"))
+        nb_lettres = 0
+
+        for _ in range(p['factures_par_fournisseur']):
+            jour = rnd.randint(0, 330)
+            delai = rnd.randint(0, 150)
+            a = montant()
+
+            if rnd.random() >= p['part_lettree']:
+                # Facture non lettrée, payée (en tout ou partie) par un virement non lettré
+                ajouter(jour, journal_achat, compte, 'FACTURE', 0, a, '')
+                if rnd.random() < 0.7:
+                    paye = a if rnd.random() < 0.7 else round(a * rnd.uniform(0.3, 0.9), 2)
+                    ajouter(jour + delai, journal_banque, compte, 'VIREMENT', paye, 0, '')
+                continue
+
+            nb_lettres += 1
+            lettre = f"L{nb_lettres}"
+            tirage = rnd.random()
+            seuil_effet = p['part_effets']
+            seuil_avoir = seuil_effet + p['part_avoirs']
+            seuil_remboursement = seuil_avoir + p['part_remboursements']
+            seuil_od = seuil_remboursement + p['part_od_change']
+
+            ajouter(jour, journal_achat, compte, 'FACTURE', 0, a, lettre)
+            if tirage < seuil_effet:
+                # Effet à payer : la facture est soldée par l'effet, payé à l'échéance sur 4415
+                lettre_effet = f"E{nb_lettres}"
+                ajouter(jour + 15, journal_effet, compte, 'EFFET', a, 0, lettre)
+                ajouter(jour + 15, journal_effet, compte_effet, 'EFFET', 0, a, lettre_effet)
+                ajouter(jour + 15 + delai, journal_banque, compte_effet, 'ECHEANCE EFFET', a, 0, lettre_effet)
+            elif tirage < seuil_avoir:
+                avoir = round(a * rnd.uniform(0.05, 0.5), 2)
+                ajouter(jour + 5, journal_achat, compte, 'AVOIR', avoir, 0, lettre)
+                ajouter(jour + delai, journal_banque, compte, 'VIREMENT', round(a - avoir, 2), 0, lettre)
+            elif tirage < seuil_remboursement:
+                # Facture payée, puis avoir remboursé par le fournisseur
+                avoir = round(a * rnd.uniform(0.05, 0.3), 2)
+                ajouter(jour + delai, journal_banque, compte, 'VIREMENT', a, 0, lettre)
+                ajouter(jour + delai + 10, journal_achat, compte, 'AVOIR', avoir, 0, lettre)
+                ajouter(jour + delai + 30, journal_banque, compte, 'REMBOURSEMENT', 0, avoir, lettre)
+            elif tirage < seuil_od:
+                # Paiement en devise : écart de change soldé par une OD
+                ecart = round(a * rnd.uniform(0.001, 0.02), 2)
+                if rnd.random() < 0.5:
+                    ajouter(jour + delai, journal_banque, compte, 'VIREMENT', round(a + ecart, 2), 0, lettre)
+                    ajouter(jour + delai, journal_od, compte, 'PERTE DE CHANGE', 0, ecart, lettre)
+                else:
+                    ajouter(jour + delai, journal_banque, compte, 'VIREMENT', round(a - ecart, 2), 0, lettre)
+                    ajouter(jour + delai, journal_od, compte, 'GAIN DE CHANGE', ecart, 0, lettre)
+            elif rnd.random() < 0.2:
+                # Paiement en deux fois
+                acompte = round(a * rnd.uniform(0.2, 0.8), 2)
+                ajouter(jour + delai // 2, journal_banque, compte, 'ACOMPTE', acompte, 0, lettre)
+                ajouter(jour + delai, journal_banque, compte, 'SOLDE', round(a - acompte, 2), 0, lettre)
+            else:
+                ajouter(jour + delai, journal_banque, compte, 'VIREMENT', a, 0, lettre)
+
+        # Lignes d'autres comptes, que le chargeur doit ignorer (environ 2,3 lignes 4411/4415
+        # par facture : part_autres_comptes est rapportée à ce volume)
+        part_autres = min(p['part_autres_comptes'], 0.95)
+        nb_autres = int(round(p['factures_par_fournisseur'] * 2.3 * part_autres / (1 - part_autres)))
+        for _ in range(nb_autres):
+            ajouter(rnd.randint(0, 364), rnd.choice([journal_achat, journal_banque, journal_od]),
+                    rnd.choice(COMPTES_AUTRES), 'AUTRE', montant(), montant(), rnd.choice(['', 'X']))
+
+    balance_df = pd.DataFrame(fournisseurs, columns=['Compte', 'Intitulé'])
+    balance_df['Solde'] = 0.0
+    return lignes, balance_df
+
+def ecrire_grand_livre_xlsx(lignes, chemin):
+    """Écrire les lignes au format Grand Livre (feuille unique, sans en-tête)"""
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Grand Livre')
+    for ligne in lignes:
+        worksheet.append(ligne)
+    workbook.save(chemin)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Générer un Grand Livre fournisseurs synthétique")
+    parser.add_argument('--lignes', type=int, default=None, help="Nombre de lignes visé (prioritaire sur --fournisseurs)")
+    parser.add_argument('--fournisseurs', type=int, default=PARAMETRES_DEFAUT['nb_fournisseurs'])
+    parser.add_argument('--factures', type=int, default=PARAMETRES_DEFAUT['factures_par_fournisseur'],
+                        help="Factures par fournisseur")
+    for nom in ('part_lettree', 'part_avoirs', 'part_remboursements', 'part_effets', 'part_od_change',
+                'part_autres_comptes'):
+        parser.add_argument('--' + nom.replace('_', '-'), dest=nom, type=float, default=PARAMETRES_DEFAUT[nom])
+    parser.add_argument('--graine', type=int, default=1)
+    parser.add_argument('--sortie', required=True, help="Fichier Grand Livre (.xlsx)")
+    parser.add_argument('--balance', required=True, help="Fichier Balance fournisseurs (.xlsx)")
+    args = parser.parse_args(argv)
+
+    parametres = {nom: getattr(args, nom) for nom in PARAMETRES_DEFAUT if hasattr(args, nom)}
+    parametres['nb_fournisseurs'] = args.fournisseurs
+    parametres['factures_par_fournisseur'] = args.factures
+    lignes, balance_df = generer_grand_livre(args.lignes, args.graine, **parametres)
+    ecrire_grand_livre_xlsx(lignes, args.sortie)
+    balance_df.to_excel(args.balance, index=False)
+    print(f"{len(lignes)} lignes, {len(balance_df)} fournisseurs -> {args.sortie}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+Cache disque des fichiers uploadés (Grand Livre, Balance), pour plusieurs dossiers clients.
+
+Chaque fichier est rangé sous le nom de son empreinte SHA-256 : un même fichier chargé
+deux fois n'est stocké qu'une fois. Un index (index.json) note pour chaque empreinte les
+dossiers clients qui l'utilisent (avec leur date d'upload), le type de fichier, le nom
+d'origine, le dernier accès et la taille. La taille totale est plafonnée : au-delà, les
+fichiers les moins récemment utilisés sont supprimés.
+
+Le cache est partagé par les sessions du serveur : l'index n'est modifié que sous
+verrou (index.lock) et chaque écriture passe par un fichier temporaire propre à
+l'écrivain, renommé une fois complet.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+NOM_INDEX = "index.json"
+NOM_VERROU = "index.lock"
+TYPES_FICHIERS = ('grand_livre', 'balance')
+
+# Plafond du cache (Mo), modifiable par la variable d'environnement CACHE_TAILLE_MAX_MO
+TAILLE_MAX_DEFAUT_MO = 500
+
+def taille_max_octets():
+    """Plafond du cache en octets (variable d'environnement, sinon valeur par défaut)"""
+    try:
+        taille_mo = float(os.environ.get('CACHE_TAILLE_MAX_MO', TAILLE_MAX_DEFAUT_MO))
+    except ValueError:
+        taille_mo = TAILLE_MAX_DEFAUT_MO
+    return int(taille_mo * 1024 * 1024)
+
+def empreinte_fichier(contenu):
+    """Empreinte SHA-256 (hexadécimale) du contenu d'un fichier"""
+    return hashlib.sha256(contenu).hexdigest()
+
+def chemin_fichier(dossier_cache, empreinte, nom_origine=''):
+    """Fichier du cache : empreinte + extension d'origine (.xlsx / .xls)"""
+    extension = os.path.splitext(nom_origine)[1].lower() or '.xlsx'
+    return os.path.join(dossier_cache, empreinte + extension)
+
+def chemin_temporaire(dossier):
+    """Fichier temporaire vide et de nom unique dans `dossier` (à renommer une fois écrit)"""
+    os.makedirs(dossier, exist_ok=True)
+    descripteur, chemin = tempfile.mkstemp(dir=dossier, suffix=".tmp")
+    os.close(descripteur)
+    return chemin
+
+def remplacer_fichier(chemin, contenu):
+    """Écrire `contenu` (octets) dans un temporaire unique puis le renommer : jamais de fichier tronqué"""
+    temporaire = chemin_temporaire(os.path.dirname(chemin))
+    try:
+        with open(temporaire, 'wb') as f:
+            f.write(contenu)
+        os.replace(temporaire, chemin)
+    except Exception:
+        try:
+            os.remove(temporaire)
+        except OSError:
+            pass
+        raise
+
+@contextmanager
+def verrou_index(dossier_cache):
+    """Verrou exclusif entre sessions (et processus) pendant une lecture-modification-écriture de l'index"""
+    os.makedirs(dossier_cache, exist_ok=True)
+    with open(os.path.join(dossier_cache, NOM_VERROU), 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def lire_index(dossier_cache):
+    """Index du cache {empreinte: entrée} ; vide si absent ou illisible"""
+    try:
+        with open(os.path.join(dossier_cache, NOM_INDEX), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def ecrire_index(dossier_cache, index):
+    """Écrire l'index (à appeler sous verrou_index)"""
+    try:
+        remplacer_fichier(os.path.join(dossier_cache, NOM_INDEX),
+                          json.dumps(index, ensure_ascii=False, indent=2).encode('utf-8'))
+    except Exception:
+        pass
+
+def maintenant():
+    """Horodatage de l'index (à la microseconde : l'ordre des accès est sans ex aequo)"""
+    return datetime.now().isoformat(timespec='microseconds')
+
+def evincer(dossier_cache, index, taille_max, conserver=()):
+    """
+    Supprimer les fichiers les moins récemment utilisés jusqu'à repasser sous
+    `taille_max` (les empreintes de `conserver` ne sont jamais supprimées).
+    Retourne les empreintes supprimées.
+    """
+    taille_totale = sum(entree['taille'] for entree in index.values())
+    evinces = []
+    for empreinte, entree in sorted(index.items(), key=lambda item: item[1]['dernier_acces']):
+        if taille_totale <= taille_max:
+            break
+        if empreinte in conserver:
+            continue
+        try:
+            os.remove(chemin_fichier(dossier_cache, empreinte, entree['nom']))
+        except OSError:
+            pass
+        taille_totale -= entree['taille']
+        evinces.append(empreinte)
+    for empreinte in evinces:
+        del index[empreinte]
+    return evinces
+
+def enregistrer_fichier(dossier_cache, contenu, nom_origine, type_fichier, nom_dossier, taille_max=None,
+                        empreinte=None, retirer_dossier=None):
+    """
+    Ranger un fichier uploadé dans le cache (écrit seulement s'il n'y est pas déjà) et
+    l'ajouter aux dossiers clients qui l'utilisent. Applique ensuite le plafond de taille.
+    `empreinte` : empreinte déjà calculée du contenu (sinon calculée ici).
+    `retirer_dossier` : dossier dont le fichier est détaché (changement de nom du dossier).
+    Retourne (empreinte, empreintes évincées, dossier déjà associé au fichier).
+    """
+    if empreinte is None:
+        empreinte = empreinte_fichier(contenu)
+    chemin = chemin_fichier(dossier_cache, empreinte, nom_origine)
+    with verrou_index(dossier_cache):
+        index = lire_index(dossier_cache)
+        try:
+            if not os.path.exists(chemin):
+                remplacer_fichier(chemin, contenu)
+        except Exception:
+            return empreinte, [], False
+
+        date = maintenant()
+        entree = index.setdefault(empreinte, {'dossiers': {}})
+        dossiers = entree['dossiers']
+        if retirer_dossier is not None and retirer_dossier != nom_dossier:
+            dossiers.pop(retirer_dossier, None)
+        deja_associe = nom_dossier in dossiers
+        dossiers[nom_dossier] = date
+        entree.update({
+            'type': type_fichier,
+            'nom': nom_origine,
+            'taille': len(contenu),
+            'dernier_acces': date
+        })
+        evinces = evincer(dossier_cache, index, taille_max_octets() if taille_max is None else taille_max,
+                          conserver={empreinte})
+        ecrire_index(dossier_cache, index)
+    return empreinte, evinces, deja_associe
+
+def lire_fichier(dossier_cache, empreinte):
+    """Contenu d'un fichier du cache (None si absent) ; son dernier accès est mis à jour"""
+    entree = lire_index(dossier_cache).get(empreinte)
+    if entree is None:
+        return None
+    try:
+        with open(chemin_fichier(dossier_cache, empreinte, entree['nom']), 'rb') as f:
+            contenu = f.read()
+    except Exception:
+        return None
+    marquer_acces(dossier_cache, [empreinte])
+    return contenu
+
+def marquer_acces(dossier_cache, empreintes):
+    """Mettre à jour le dernier accès de fichiers du cache, sans les lire"""
+    with verrou_index(dossier_cache):
+        index = lire_index(dossier_cache)
+        date = maintenant()
+        for empreinte in empreintes:
+            if empreinte in index:
+                index[empreinte]['dernier_acces'] = date
+        ecrire_index(dossier_cache, index)
+
+def dossiers_recents(index):
+    """
+    Dossiers clients du cache, du plus récemment utilisé au plus ancien : pour chacun,
+    le dernier Grand Livre et la dernière Balance uploadés, et la taille occupée.
+    Un fichier utilisé par plusieurs dossiers figure dans chacun d'eux.
+    """
+    associations = sorted(((date_upload, nom_dossier, empreinte, entree)
+                           for empreinte, entree in index.items()
+                           for nom_dossier, date_upload in entree['dossiers'].items()),
+                          key=lambda association: association[0])
+    dossiers = {}
+    for _, nom_dossier, empreinte, entree in associations:
+        dossier = dossiers.setdefault(nom_dossier, {
+            'dossier': nom_dossier, 'grand_livre': None, 'balance': None,
+            'dernier_acces': '', 'taille': 0
+        })
+        if entree['type'] in TYPES_FICHIERS:
+            dossier[entree['type']] = empreinte
+        dossier['dernier_acces'] = max(dossier['dernier_acces'], entree['dernier_acces'])
+        dossier['taille'] += entree['taille']
+    return sorted(dossiers.values(), key=lambda d: d['dernier_acces'], reverse=True)
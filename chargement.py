@@ -0,0 +1,332 @@
+"""
+Lecture et normalisation des fichiers d'entrée (Grand Livre, Balance, journaux).
+Module sans interface : utilisé par l'application Streamlit et par le traitement par lots.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+from profilage import etape
+
+# Journaux par défaut (un code par ligne, comme dans la configuration de l'application)
+CONFIG_JOURNAUX_DEFAUT = {
+    "journaux_achat": "ACHAT\nACH",
+    "journaux_banque": "BANQUE\nBNQ\nCHEQUE"
+}
+
+def journaux_depuis_texte(texte):
+    """Liste des codes journaux saisis un par ligne"""
+    return [j.strip() for j in texte.split('\n') if j.strip()]
+
+# Seuls les comptes fournisseurs (4411) et effets à payer (4415) sont exploités par le rapprochement
+PREFIXES_COMPTES_GRAND_LIVRE = ('4411', '4415')
+NB_COLONNES_GRAND_LIVRE = 9  # Colonnes A à I
+
+def compte_en_texte(valeur):
+    """Convertir une cellule de compte en texte (44110000.0 -> '44110000')"""
+    if isinstance(valeur, float) and valeur.is_integer():
+        valeur = int(valeur)
+    return str(valeur).strip()
+
+def lire_lignes_grand_livre(file_bytes):
+    """
+    Lire les colonnes A à I du Grand Livre en ne conservant que les comptes 4411/4415.
+    Les fichiers .xlsx sont parcourus ligne à ligne (openpyxl en lecture seule) afin que
+    les autres comptes ne soient jamais chargés en mémoire.
+    Retourne (DataFrame brut, nombre de lignes lues).
+    """
+    colonnes = list(range(NB_COLONNES_GRAND_LIVRE))
+
+    # Ancien format .xls (pas une archive zip) : lecture complète puis filtrage
+    if not file_bytes.startswith(b'PK'):
+        df = pd.read_excel(io.BytesIO(file_bytes), header=None)
+        df = df.reindex(columns=colonnes)
+        comptes = df[2].map(compte_en_texte)
+        return df[comptes.str.startswith(PREFIXES_COMPTES_GRAND_LIVRE)], len(df)
+
+    workbook = load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[0]
+        # Les dimensions déclarées par certains ERP sont fausses : lire jusqu'à la dernière ligne
+        worksheet.reset_dimensions()
+        lignes = []
+        nb_lignes_lues = 0
+        for ligne in worksheet.iter_rows(max_col=NB_COLONNES_GRAND_LIVRE, values_only=True):
+            nb_lignes_lues += 1
+            if compte_en_texte(ligne[2]).startswith(PREFIXES_COMPTES_GRAND_LIVRE):
+                lignes.append(ligne)
+    finally:
+        workbook.close()
+
+    return pd.DataFrame(lignes, columns=colonnes), nb_lignes_lues
+
+# Version de la normalisation du Grand Livre : à incrémenter à chaque changement
+# de parser_grand_livre pour invalider les caches Parquet existants
+VERSION_CHARGEUR_GL = 5
+
+def montant_en_centimes(serie):
+    """Montants en dirhams (cellules numériques ou texte) -> entiers int64 en centimes"""
+    montants = pd.to_numeric(serie, errors='coerce').fillna(0)
+    return (montants * 100).round().astype('int64')
+
+def grand_livre_en_dirhams(df):
+    """Copie des lignes du Grand Livre avec les montants en dirhams (affichage)"""
+    df = df.copy()
+    df[['MontantMvt', 'MontantFacture']] = df[['MontantMvt', 'MontantFacture']].astype(float) / 100
+    return df
+
+def texte_nettoye(serie):
+    """Colonne en texte, sur la colonne entière : cellules vides -> '', espaces retirés"""
+    return serie.astype(object).where(serie.notna(), '').astype(str).str.strip()
+
+def numero_en_texte(serie):
+    """Numéros (comptes, pièces) en texte, sans le suffixe '.0' des nombres lus en flottant"""
+    return texte_nettoye(serie).str.removesuffix('.0')
+
+def categorie_nettoyee(serie, nettoyer):
+    """
+    Colonne catégorielle dont seules les valeurs distinctes sont nettoyées (`nettoyer`),
+    puis regroupées si plusieurs deviennent identiques (44110000 et '44110000 ').
+    Catégories triées, comme astype('category').
+    """
+    codes, valeurs = pd.factorize(serie)
+    # Cellules vides : code -1, qui désigne la dernière valeur ajoutée ('')
+    valeurs_nettoyees = pd.Categorical(list(nettoyer(pd.Series(valeurs, dtype=object))) + [''])
+    return pd.Categorical.from_codes(valeurs_nettoyees.codes[codes], valeurs_nettoyees.categories)
+
+# Dates : valeurs examinées pour choisir la conversion, formats texte essayés dans l'ordre
+# (jour avant mois : jamais d'inversion jour / mois sur les exports français)
+TAILLE_ECHANTILLON_DATES = 1000
+FORMATS_DATES_TEXTE = ['%d/%m/%Y', '%d/%m/%y', '%d-%m-%Y', '%d.%m.%Y', '%Y-%m-%d',
+                       '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%Y-%m-%d %H:%M:%S']
+ORIGINE_NUMEROS_EXCEL = '1899-12-30'
+# Dates numériques AAAAMMJJ (certains ERP) plutôt que numéros de série Excel
+BORNES_AAAAMMJJ = (19000101, 29991231)
+
+def dates_depuis_nombres(nombres):
+    """Nombres -> dates : AAAAMMJJ si l'échantillon s'y prête, sinon numéros de série Excel"""
+    echantillon = nombres.dropna().iloc[:TAILLE_ECHANTILLON_DATES]
+    if len(echantillon) and echantillon.between(*BORNES_AAAAMMJJ).all():
+        return pd.to_datetime(nombres.round().astype('Int64').astype(str), format='%Y%m%d', errors='coerce')
+    # Numéros hors des dates Excel (1900 à 9999) : non reconnus
+    nombres = nombres.where(nombres.between(1, 2958465))
+    return pd.to_datetime(nombres, unit='D', origin=ORIGINE_NUMEROS_EXCEL, errors='coerce')
+
+def dates_depuis_textes(textes):
+    """
+    Textes -> dates au format qui reconnaît le plus de valeurs de l'échantillon ; les
+    textes numériques ('45292', '20240115') suivent la voie des nombres. Seuls les
+    textes distincts sont convertis (une date revient sur de nombreuses lignes).
+    """
+    codes, distincts = pd.factorize(textes)
+    distincts = pd.Series(distincts, dtype=object).str.strip()
+    numeriques = distincts.str.fullmatch(r'\d+(?:\.\d+)?').to_numpy(dtype=bool)
+    dates = pd.Series(pd.NaT, index=distincts.index, dtype='datetime64[ns]')
+    if numeriques.any():
+        dates[numeriques] = dates_depuis_nombres(pd.to_numeric(distincts[numeriques]))
+
+    textes_dates = distincts[~numeriques]
+    echantillon = textes_dates[textes_dates != ''].iloc[:TAILLE_ECHANTILLON_DATES]
+    if len(echantillon):
+        format_retenu = None
+        reconnues_max = 0
+        for format_date in FORMATS_DATES_TEXTE:
+            reconnues = pd.to_datetime(echantillon, format=format_date, errors='coerce').notna().sum()
+            if reconnues > reconnues_max:
+                format_retenu, reconnues_max = format_date, reconnues
+        if format_retenu is not None and reconnues_max >= 0.9 * len(echantillon):
+            dates[~numeriques] = pd.to_datetime(textes_dates, format=format_retenu, errors='coerce')
+        else:
+            # Formats hétérogènes : reconnaissance valeur par valeur, jour avant mois
+            dates[~numeriques] = pd.to_datetime(textes_dates, format='mixed', dayfirst=True, errors='coerce')
+
+    # Code -1 (cellule vide) : dernière valeur ajoutée, NaT
+    dates = np.append(dates.to_numpy(dtype='datetime64[ns]'), np.datetime64('NaT', 'ns'))
+    return pd.Series(dates[codes], index=textes.index)
+
+def dates_melangees(valeurs, presentes):
+    """Colonne mélangée : dates natives, nombres et textes convertis chacun par leur voie"""
+    est_texte = presentes & (valeurs.map(type) == str)
+    est_nombre = presentes & ~est_texte & pd.to_numeric(valeurs.where(~est_texte), errors='coerce').notna()
+    dates = pd.to_datetime(valeurs.where(presentes & ~est_texte & ~est_nombre), errors='coerce')
+    if est_texte.any():
+        dates = dates.where(~est_texte, dates_depuis_textes(valeurs.where(est_texte)))
+    if est_nombre.any():
+        nombres = pd.to_numeric(valeurs.where(est_nombre), errors='coerce')
+        dates = dates.where(~est_nombre, dates_depuis_nombres(nombres))
+    return dates
+
+def normaliser_dates(serie):
+    """
+    Colonne de dates quel que soit l'export : dates natives, numéros de série Excel
+    (ou AAAAMMJJ) et textes jj/mm/aaaa. Le type des valeurs choisit la conversion,
+    faite en un appel vectorisé (le format des textes est choisi sur un échantillon) ;
+    dans une colonne mélangée, chaque type suit sa voie.
+    Retourne (dates datetime64, nombre de valeurs non vides non reconnues).
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie, 0
+    valeurs = serie.astype(object)
+    presentes = valeurs.notna()
+    genre = pd.api.types.infer_dtype(valeurs, skipna=True)
+    if genre not in ('datetime', 'datetime64', 'date'):
+        # Cellules texte vides : absentes, pas non reconnues
+        presentes &= valeurs != ''
+        genre = pd.api.types.infer_dtype(valeurs[presentes], skipna=True)
+
+    if genre == 'empty':
+        dates = pd.Series(pd.NaT, index=serie.index, dtype='datetime64[ns]')
+    elif genre in ('datetime', 'datetime64', 'date'):
+        dates = pd.to_datetime(valeurs, errors='coerce')
+    elif genre in ('integer', 'floating', 'mixed-integer-float', 'decimal'):
+        dates = dates_depuis_nombres(pd.to_numeric(valeurs.where(presentes), errors='coerce'))
+    elif genre == 'string':
+        dates = dates_depuis_textes(valeurs.where(presentes))
+    else:
+        dates = dates_melangees(valeurs, presentes)
+
+    return dates.astype('datetime64[ns]'), int((presentes & dates.isna()).sum())
+
+def parser_grand_livre(file_bytes, profil=None):
+    """Lire et normaliser le Grand Livre (sans en-tête)"""
+    with etape(profil, 'lecture_excel') as mesure:
+        df, nb_lignes_lues = lire_lignes_grand_livre(file_bytes)
+        mesure['lignes'] = nb_lignes_lues
+
+    with etape(profil, 'normalisation', len(df)):
+        df, nb_dates_non_reconnues = normaliser_grand_livre(df)
+
+    stats_chargement = {
+        'lignes_lues': nb_lignes_lues,
+        'lignes_conservees': len(df),
+        'dates_non_reconnues': nb_dates_non_reconnues
+    }
+
+    return df, stats_chargement
+
+def normaliser_grand_livre(df):
+    """
+    Colonnes nommées et typées : dates, montants en centimes, identifiants en texte.
+    Journal, Compte et Lettrage, très répétés, sont stockés en catégories (codes entiers
+    + valeurs distinctes) : frame en cache nettement plus léger.
+    Retourne (DataFrame, nombre de dates non reconnues).
+    """
+    colonnes = {
+        0: 'Date',           # A
+        1: 'Journal',        # B
+        2: 'Compte',         # C
+        3: 'NumPiece',       # D
+        4: 'Libelle',        # E
+        5: 'MontantMvt',     # F
+        6: 'MontantFacture', # G
+        8: 'Lettrage'        # I
+    }
+
+    df = df[list(colonnes.keys())].copy()
+    df.columns = list(colonnes.values())
+    df = df.reset_index(drop=True)
+
+    df['Date'], nb_dates_non_reconnues = normaliser_dates(df['Date'])
+
+    # Montants en centimes entiers : sommes et rapprochements exacts dans le moteur
+    df['MontantMvt'] = montant_en_centimes(df['MontantMvt'])
+    df['MontantFacture'] = montant_en_centimes(df['MontantFacture'])
+
+    # Cellules vides : None (lecture openpyxl) ou NaN (lecture pandas)
+    df['NumPiece'] = numero_en_texte(df['NumPiece'])
+    df['Compte'] = categorie_nettoyee(df['Compte'], numero_en_texte)
+    df['Journal'] = categorie_nettoyee(df['Journal'], texte_nettoye)
+    df['Lettrage'] = categorie_nettoyee(df['Lettrage'], texte_nettoye)
+
+    # Libellés en texte (certains ERP exportent des libellés numériques)
+    df['Libelle'] = df['Libelle'].astype(object).where(df['Libelle'].notna(), '').astype(str)
+
+    return df, nb_dates_non_reconnues
+
+def est_numero_compte(valeur):
+    """Cellule qui ressemble à un numéro de compte (nombre, ou texte fait de chiffres)"""
+    if isinstance(valeur, bool):
+        return False
+    if isinstance(valeur, (int, float, np.number)):
+        return not pd.isna(valeur)
+    return isinstance(valeur, str) and valeur.replace('.', '').isdigit()
+
+def noms_colonnes(en_tete):
+    """Noms de colonnes tirés de la ligne d'en-tête, comme read_excel(header=0) : cellules vides
+    'Unnamed: i', doublons suffixés '.1', '.2'..."""
+    noms = []
+    vus = {}
+    for i, valeur in enumerate(en_tete):
+        nom = f"Unnamed: {i}" if pd.isna(valeur) else valeur
+        if nom in vus:
+            vus[nom] += 1
+            nom = f"{nom}.{vus[nom]}"
+        else:
+            vus[nom] = 0
+        noms.append(nom)
+    return noms
+
+def lire_balance(file_bytes):
+    """
+    Lire la Balance fournisseurs en une seule passe (avec ou sans en-tête) : la première
+    ligne est un en-tête sauf si sa première cellule est un numéro de compte.
+    Retourne (DataFrame, has_header)
+    """
+    df = pd.read_excel(io.BytesIO(file_bytes), header=None)
+    if len(df) == 0 or est_numero_compte(df.iat[0, 0]):
+        return df, False
+    df.columns = noms_colonnes(df.iloc[0].tolist())
+    # Types des colonnes déduits sans la ligne d'en-tête
+    df = df.iloc[1:].reset_index(drop=True).infer_objects()
+    return df, True
+
+def colonnes_balance(balance_df, has_header):
+    """Colonnes du numéro de compte et du nom du fournisseur (à défaut, les deux premières)"""
+    col_compte = None
+    col_nom = None
+
+    if has_header:
+        cols = balance_df.columns.tolist()
+        for col in cols:
+            col_str = str(col).lower()
+            if any(x in col_str for x in ['compte', 'n°', 'numero', 'code', 'num']):
+                col_compte = col
+                break
+        for col in cols:
+            col_str = str(col).lower()
+            if any(x in col_str for x in ['nom', 'intitule', 'intitulé', 'libelle', 'libellé', 'raison', 'designation', 'désignation']):
+                col_nom = col
+                break
+
+    if col_compte is None or col_nom is None:
+        if len(balance_df.columns) >= 2:
+            col_compte = balance_df.columns[0]
+            col_nom = balance_df.columns[1]
+    return col_compte, col_nom
+
+def creer_dict_fournisseurs(balance_df, has_header):
+    """
+    Dictionnaire N° de compte -> nom du fournisseur, construit sur les colonnes entières
+    (comptes '44110000.0' ramenés à '44110000', lignes sans compte ou sans nom écartées).
+    Retourne (dict_fournisseurs, col_compte, col_nom)
+    """
+    col_compte, col_nom = colonnes_balance(balance_df, has_header)
+    if col_compte is None or col_nom is None:
+        return {}, col_compte, col_nom
+
+    lignes = balance_df[balance_df[col_compte].notna()]
+    comptes = lignes[col_compte].astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    noms = lignes[col_nom].astype(str).str.strip().where(lignes[col_nom].notna(), '')
+    valides = (comptes != '') & (comptes != 'nan') & (noms != '') & (noms != 'nan')
+    return dict(zip(comptes[valides], noms[valides])), col_compte, col_nom
+
+def charger_balance(file_bytes):
+    """
+    Balance lue une seule fois et dictionnaire des fournisseurs : un seul résultat à
+    mettre en cache. Retourne (balance_df, dict_fournisseurs, col_compte, col_nom)
+    """
+    balance_df, has_header = lire_balance(file_bytes)
+    dict_fournisseurs, col_compte, col_nom = creer_dict_fournisseurs(balance_df, has_header)
+    return balance_df, dict_fournisseurs, col_compte, col_nom
@@ -0,0 +1,146 @@
+"""
+Délais de paiement : délai en jours de chaque facture, retard par rapport au délai
+maximal (60 jours par défaut, jusqu'à 120 jours par accord), tranches de retard et
+synthèse par fournisseur.
+
+Étape exécutée après le rapprochement, sur les lignes de résultat (montants en dirhams).
+Les calculs portent sur des colonnes entières (arithmétique de dates NumPy).
+"""
+import numpy as np
+import pandas as pd
+
+DELAI_MAX_DEFAUT = 60
+
+# Tranches de retard : bornes inférieures (en jours de retard) et libellés
+BORNES_TRANCHES = [1, 31, 61, 91]
+LIBELLES_TRANCHES = ['Dans le délai', 'Retard 1-30 j', 'Retard 31-60 j', 'Retard 61-90 j', 'Retard > 90 j']
+
+# Une facture est ouverte à la clôture si son solde dépasse le centime
+SEUIL_SOLDE_OUVERT = 0.005
+
+COLONNES_DELAIS = ['Échéance', 'Délai (jours)', 'Jours de retard', 'Tranche de retard', 'Montant en retard']
+
+def lignes_factures(resultats_df):
+    """Lignes de facture (montant positif) : ni avoir, ni remboursement, ni paiement seul"""
+    return resultats_df['Montant de la facture'].to_numpy(dtype=float) > 0
+
+def date_cloture_par_defaut(resultats_df):
+    """31 décembre de l'année de la dernière facture (None si aucune facture datée)"""
+    if len(resultats_df) == 0:
+        return None
+    derniere_facture = resultats_df.loc[lignes_factures(resultats_df), 'Date de facture'].max()
+    if pd.isna(derniere_facture):
+        return None
+    return pd.Timestamp(year=derniere_facture.year, month=12, day=31)
+
+def jours(dates):
+    """Dates en jours (datetime64[D]) ; NaT conservé"""
+    return pd.to_datetime(dates).to_numpy().astype('datetime64[D]')
+
+def entiers_avec_manquants(valeurs, presents):
+    """Colonne d'entiers (Int64) vide là où `presents` est faux"""
+    colonne = pd.array(valeurs, dtype='Int64')
+    colonne[~presents] = pd.NA
+    return colonne
+
+def calculer_delais(resultats_df, delai_max=DELAI_MAX_DEFAUT, date_cloture=None):
+    """
+    Ajouter aux lignes de résultat l'échéance, le délai, le retard, la tranche et le
+    montant en retard :
+    - facture payée : délai = date de paiement - date de facture, sur le montant du paiement
+    - facture non payée (solde positif) : délai arrêté à la date de clôture, sur le solde
+    - paiement sans facture, facture soldée sans paiement, avoir, remboursement : pas de délai
+    """
+    df = resultats_df.copy()
+    if len(df) == 0:
+        for col in COLONNES_DELAIS:
+            df[col] = pd.Series(dtype='object')
+        return df
+
+    facture = lignes_factures(df)
+    date_facture = jours(df['Date de facture'])
+    date_paiement = jours(df['Date de paiement'])
+    paye = facture & ~np.isnat(date_paiement)
+    ouvert = facture & ~paye & (df['Solde'].to_numpy() > SEUIL_SOLDE_OUVERT)
+
+    date_fin = date_paiement.copy()
+    if date_cloture is not None:
+        cloture = np.datetime64(pd.Timestamp(date_cloture).date(), 'D')
+        # Factures ouvertes émises au plus tard à la clôture
+        ouvert &= ~np.isnat(date_facture) & (date_facture <= cloture)
+        date_fin[ouvert] = cloture
+    else:
+        ouvert[:] = False
+
+    avec_delai = ~np.isnat(date_facture) & (paye | ouvert)
+    delai = np.zeros(len(df), dtype=np.int64)
+    delai[avec_delai] = (date_fin[avec_delai] - date_facture[avec_delai]).astype(np.int64)
+    retard = np.maximum(delai - delai_max, 0)
+
+    montant = np.where(paye, df['Montant du paiement'].to_numpy(dtype=float), df['Solde'].to_numpy(dtype=float))
+    tranche = np.searchsorted(BORNES_TRANCHES, retard, side='right')
+
+    df['Échéance'] = pd.Series(date_facture + np.timedelta64(delai_max, 'D'), index=df.index).astype('datetime64[ns]')
+    df['Délai (jours)'] = entiers_avec_manquants(delai, avec_delai)
+    df['Jours de retard'] = entiers_avec_manquants(retard, avec_delai)
+    df['Tranche de retard'] = np.where(avec_delai, np.array(LIBELLES_TRANCHES, dtype=object)[tranche], '')
+    df['Montant en retard'] = np.where(avec_delai & (retard > 0), montant, 0.0)
+    return df
+
+def synthese_par_fournisseur(resultats_delais_df):
+    """
+    Agrégats par fournisseur des lignes enrichies par calculer_delais : montants,
+    délai moyen (pondéré par les montants concernés) et maximal, retards par tranche.
+    Les factures sont comptées une fois chacune (une facture réglée en plusieurs
+    paiements occupe plusieurs lignes). Fournisseurs triés par montant en retard décroissant.
+    """
+    cles = ['N° compte fournisseur', 'Nom du fournisseur']
+    colonnes_tranches = LIBELLES_TRANCHES[1:]
+    colonnes = cles + ['Factures', 'Montant des factures', 'Délai moyen (jours)', 'Délai max (jours)',
+                       'Factures en retard', 'Montant en retard', 'Dont non payé'] + colonnes_tranches
+    if len(resultats_delais_df) == 0:
+        return pd.DataFrame(columns=colonnes)
+
+    df = resultats_delais_df
+    avec_delai = df['Délai (jours)'].notna().to_numpy()
+    delai = df['Délai (jours)'].fillna(0).to_numpy(dtype=float)
+    montant_en_retard = df['Montant en retard'].to_numpy(dtype=float)
+    en_retard = montant_en_retard != 0
+    # Identifiant de facture (n° de facture, sinon la ligne) : vide hors lignes de facture
+    facture = lignes_factures(df)
+    numeros = df['N° de facture'].astype(str).to_numpy(dtype=object)
+    sans_numero = numeros == ''
+    numeros[sans_numero] = ['#' + str(i) for i in np.flatnonzero(sans_numero)]
+    numero_facture = np.where(facture, numeros, None)
+    # Poids du délai moyen : montant payé ou restant dû de la ligne
+    poids = np.where(avec_delai, np.abs(np.where(df['Date de paiement'].notna(),
+                                                 df['Montant du paiement'], df['Solde'])), 0.0)
+
+    calcul = pd.DataFrame({
+        'N° compte fournisseur': df['N° compte fournisseur'],
+        'Nom du fournisseur': df['Nom du fournisseur'],
+        'Factures': numero_facture,
+        'Montant des factures': df['Montant de la facture'].to_numpy(dtype=float),
+        'delai_pondere': delai * poids,
+        'poids': poids,
+        'Délai max (jours)': np.where(avec_delai, delai, np.nan),
+        'Factures en retard': np.where(en_retard, numero_facture, None),
+        'Montant en retard': montant_en_retard,
+        'Dont non payé': np.where(df['Date de paiement'].isna(), montant_en_retard, 0.0),
+    })
+    for libelle in colonnes_tranches:
+        calcul[libelle] = np.where(df['Tranche de retard'].to_numpy() == libelle, montant_en_retard, 0.0)
+
+    synthese = calcul.groupby(cles, sort=False).agg({
+        'Factures': 'nunique', 'Montant des factures': 'sum', 'delai_pondere': 'sum', 'poids': 'sum',
+        'Délai max (jours)': 'max', 'Factures en retard': 'nunique', 'Montant en retard': 'sum',
+        'Dont non payé': 'sum', **{libelle: 'sum' for libelle in colonnes_tranches}
+    }).reset_index()
+
+    synthese['Délai moyen (jours)'] = (
+        synthese['delai_pondere'] / synthese['poids'].where(synthese['poids'] > 0)).round(1)
+    synthese['Délai max (jours)'] = synthese['Délai max (jours)'].astype('Int64')
+    synthese[['Factures', 'Factures en retard']] = synthese[['Factures', 'Factures en retard']].astype('int64')
+    synthese = synthese.sort_values(['Montant en retard', 'N° compte fournisseur'],
+                                    ascending=[False, True], kind='mergesort').reset_index(drop=True)
+    return synthese[colonnes]
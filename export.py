@@ -0,0 +1,222 @@
+"""
+Export des résultats du rapprochement.
+
+- Excel : classeur mis en forme (consultation, déclaration)
+- Parquet : types exacts (dates, montants décimaux) pour les entrepôts de données
+- CSV : écrit par blocs, sans mise en forme, pour les échanges entre outils
+
+Chaque format s'écrit directement dans un fichier ou un flux (ecrire_*) ; les
+fonctions export_to_* renvoient un BytesIO (téléchargement depuis l'application).
+"""
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+
+from delais import LIBELLES_TRANCHES
+
+COLONNES_MONTANTS = ['Montant de la facture', 'Avoir', 'Montant facture net',
+                     'Montant du paiement', 'OD', 'Montant du paiement groupé', 'Solde',
+                     'Montant en retard',
+                     # Synthèse par fournisseur
+                     'Montant des factures', 'Dont non payé'] + LIBELLES_TRANCHES[1:] + [
+                     # Écarts de solde par fournisseur
+                     'Solde Grand Livre (G - F)', 'Solde calculé', 'Écart']
+COLONNES_DATES = ['Date de facture', 'Date de paiement', 'Échéance']
+
+# Format avec séparateur de milliers et "-" pour les zéros
+# Ce format affiche "-" pour 0 tout en gardant la valeur numérique
+FORMAT_MONTANT = '#,##0.00;-#,##0.00;"-"'
+FORMAT_DATE = 'DD/MM/YYYY'
+
+# Largeur des colonnes (15 par défaut), en unités brutes du fichier
+LARGEURS_COLONNES = {
+    'Date de facture': 12,
+    'N° de facture': 15,
+    'N° compte fournisseur': 12,
+    'Nom du fournisseur': 25,
+    'Libellé de l\'opération': 30,
+    'Montant de la facture': 15,
+    'Avoir': 12,
+    'Montant facture net': 15,
+    'Date de paiement': 12,
+    'Montant du paiement': 15,
+    'OD': 12,
+    'Montant du paiement groupé': 15,
+    'Lettrage': 10,
+    'Lettrage corrigé': 12,
+    'Solde': 12,
+    'Échéance': 12,
+    'Délai (jours)': 10,
+    'Jours de retard': 10,
+    'Tranche de retard': 15
+}
+
+BORDURE = {'border': 1, 'border_color': '#CCCCCC'}
+STYLE_EN_TETE = {'bold': True, 'font_color': '#FFFFFF', 'font_size': 10, 'bg_color': '#1E3A5F',
+                 'align': 'center', 'valign': 'vcenter', 'text_wrap': True, **BORDURE}
+STYLE_TOTAL = {'bold': True, 'font_size': 10, 'bg_color': '#E8F4FD'}
+
+# Origine des dates Excel (numéros de série)
+ORIGINE_DATES_EXCEL = pd.Timestamp('1899-12-30')
+
+def style_colonne(col_name):
+    """Format de cellule d'une colonne : dates, montants ou texte"""
+    if col_name in COLONNES_DATES:
+        return {'num_format': FORMAT_DATE, 'align': 'center', 'valign': 'vcenter', **BORDURE}
+    if col_name in COLONNES_MONTANTS:
+        return {'num_format': FORMAT_MONTANT, 'align': 'right', 'valign': 'vcenter', **BORDURE}
+    return {'align': 'center', 'valign': 'vcenter', **BORDURE}
+
+def valeurs_colonne(serie):
+    """
+    Valeurs d'une colonne prêtes à écrire, None pour les cellules vides.
+    Dates converties en une fois en numéros de série Excel (affichés par le format date).
+    Retourne (valeurs, méthode d'écriture xlsxwriter).
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        jours = (serie - ORIGINE_DATES_EXCEL) / pd.Timedelta(days=1)
+        return jours.astype(object).where(serie.notna(), None).tolist(), 'write_number'
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        valeurs = serie.astype(float)
+        return valeurs.astype(object).where(np.isfinite(valeurs), None).tolist(), 'write_number'
+    return serie.astype(object).where(serie.notna(), None).tolist(), 'write'
+
+def total_montant(serie):
+    """Total d'une colonne de montants : somme en centimes entiers, divisée une seule fois"""
+    centimes = np.rint(serie.astype(float).fillna(0).to_numpy() * 100).astype(np.int64)
+    return int(centimes.sum()) / 100
+
+def ecrire_feuille(workbook, nom, df, colonne_total, volets):
+    """
+    Feuille d'un tableau : en-tête, ligne TOTAL (montants additionnés, libellé dans
+    `colonne_total`) puis une ligne par enregistrement, volets figés en `volets`
+    (ligne, colonne). Un format par colonne, créé une seule fois.
+    """
+    worksheet = workbook.add_worksheet(nom)
+    colonnes = list(df.columns)
+
+    format_en_tete = workbook.add_format(STYLE_EN_TETE)
+    formats_colonnes = [workbook.add_format(style_colonne(col)) for col in colonnes]
+    formats_total = [workbook.add_format({**style_colonne(col), **STYLE_TOTAL}) for col in colonnes]
+
+    for i, col_name in enumerate(colonnes):
+        # xlsxwriter ajoute la marge de cellule (5 pixels sur 7 par caractère) à la largeur demandée
+        worksheet.set_column(i, i, LARGEURS_COLONNES.get(col_name, 15) - 5 / 7)
+    worksheet.freeze_panes(*volets)
+
+    # Hauteur de la ligne d'en-tête
+    worksheet.set_row(0, 40)
+    for i, col_name in enumerate(colonnes):
+        worksheet.write_string(0, i, str(col_name), format_en_tete)
+
+    # Ligne de total
+    for i, col_name in enumerate(colonnes):
+        if col_name in COLONNES_MONTANTS:
+            worksheet.write_number(1, i, total_montant(df[col_name]), formats_total[i])
+        elif col_name == colonne_total:
+            worksheet.write_string(1, i, 'TOTAL', formats_total[i])
+        else:
+            worksheet.write_blank(1, i, None, formats_total[i])
+
+    # Lignes : une méthode d'écriture et un format par colonne
+    valeurs, methodes = zip(*(valeurs_colonne(df[col]) for col in colonnes)) if colonnes else ((), ())
+    ecritures = [getattr(worksheet, methode) for methode in methodes]
+    write_blank = worksheet.write_blank
+    cellules = list(zip(range(len(colonnes)), ecritures, formats_colonnes))
+    for row, ligne in enumerate(zip(*valeurs), start=2):
+        for (col, ecrire, format_cellule), valeur in zip(cellules, ligne):
+            if valeur is None or valeur == '':
+                write_blank(row, col, None, format_cellule)
+            else:
+                ecrire(row, col, valeur, format_cellule)
+
+def ecrire_excel(df, destination, synthese_df=None, ecarts_df=None):
+    """
+    Classeur Excel des résultats (feuille Rapprochement, volets figés en E3), suivi de
+    la synthèse par fournisseur et des écarts de solde par fournisseur s'ils sont
+    fournis. Les lignes sont écrites en flux (xlsxwriter en mémoire constante).
+    """
+    workbook = xlsxwriter.Workbook(destination, {'constant_memory': True})
+    # Figer les volets en cellule E3 (lignes 1-2 et colonnes A-D figées)
+    ecrire_feuille(workbook, 'Rapprochement', df, 'Date de facture', (2, 4))
+    if synthese_df is not None:
+        ecrire_feuille(workbook, 'Synthèse fournisseurs', synthese_df, 'N° compte fournisseur', (2, 2))
+    if ecarts_df is not None:
+        ecrire_feuille(workbook, 'Écarts de solde', ecarts_df, 'N° compte fournisseur', (2, 2))
+    workbook.close()
+
+# Montants en décimal exact (centimes) : pas d'arrondi binaire chez les consommateurs
+TYPE_MONTANT_PARQUET = pa.decimal128(18, 2)
+
+def table_parquet(df):
+    """Table Arrow des résultats : dates en date32, montants en décimal (18, 2), textes en chaînes"""
+    colonnes = {}
+    for col_name in df.columns:
+        serie = df[col_name]
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            colonnes[col_name] = pa.array(serie, from_pandas=True).cast(pa.date32())
+        elif col_name in COLONNES_MONTANTS:
+            # Les lignes au prorata portent des fractions de centime : arrondi explicite au
+            # centime avant la conversion (sinon refusée, ou arrondie en silence selon pyarrow)
+            colonnes[col_name] = pa.array(serie.astype(float).round(2), from_pandas=True).cast(TYPE_MONTANT_PARQUET)
+        else:
+            colonnes[col_name] = pa.array(serie, from_pandas=True)
+    return pa.table(colonnes)
+
+def ecrire_parquet(df, destination):
+    pq.write_table(table_parquet(df), destination)
+
+# Lignes par bloc : la conversion en texte ne porte jamais sur tout le résultat à la fois
+TAILLE_BLOC_CSV = 50000
+
+def ecrire_csv(df, destination, taille_bloc=TAILLE_BLOC_CSV):
+    """
+    CSV UTF-8 écrit par blocs (séparateur ';', dates AAAA-MM-JJ, montants à 2 décimales
+    avec un point). `destination` : chemin ou flux binaire.
+    """
+    fichier = open(destination, 'wb') if isinstance(destination, (str, os.PathLike)) else destination
+    try:
+        for debut in range(0, max(len(df), 1), taille_bloc):
+            bloc = df.iloc[debut:debut + taille_bloc]
+            texte = bloc.to_csv(sep=';', index=False, header=debut == 0,
+                                date_format='%Y-%m-%d', float_format='%.2f')
+            fichier.write(texte.encode('utf-8'))
+    finally:
+        if fichier is not destination:
+            fichier.close()
+
+# Format -> (écriture dans un fichier ou un flux, extension, type MIME)
+FORMATS_EXPORT = {
+    'excel': (ecrire_excel, '.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'parquet': (ecrire_parquet, '.parquet', 'application/vnd.apache.parquet'),
+    'csv': (ecrire_csv, '.csv', 'text/csv'),
+}
+
+def exporter(df, format_export, synthese_df=None, ecarts_df=None):
+    """
+    Export en mémoire dans le format demandé (clé de FORMATS_EXPORT). La synthèse et
+    les écarts de solde par fournisseur ne sont joints qu'au classeur Excel (feuilles
+    dédiées).
+    """
+    ecrire, _, _ = FORMATS_EXPORT[format_export]
+    output = io.BytesIO()
+    if format_export == 'excel':
+        ecrire(df, output, synthese_df, ecarts_df)
+    else:
+        ecrire(df, output)
+    output.seek(0)
+    return output
+
+def export_to_excel(df, synthese_df=None, ecarts_df=None):
+    return exporter(df, 'excel', synthese_df, ecarts_df)
+
+def export_to_parquet(df):
+    return exporter(df, 'parquet')
+
+def export_to_csv(df):
+    return exporter(df, 'csv')
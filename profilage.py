@@ -0,0 +1,154 @@
+"""
+Mesure des étapes du traitement : durée, nombre de lignes et mémoire de chaque étape.
+
+Un profil est un simple dictionnaire transmis (argument `profil`) aux fonctions du
+chargement, du moteur et de l'export ; avec profil=None, les mesures ne coûtent rien.
+La mémoire est lue sur le pic du processus (ru_maxrss), sans surcoût ; en mode
+`memoire_detaillee`, tracemalloc donne en plus le pic d'allocation propre à chaque
+étape (nettement plus lent : à réserver au diagnostic).
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def memoire_max_mo():
+    """Pic de mémoire résidente du processus depuis son démarrage (Mo), None si non disponible"""
+    if resource is None:
+        return None
+    pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss est en octets sous macOS, en kilo-octets ailleurs
+    return round(pic / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def nouveau_profil(memoire_detaillee=False, **contexte):
+    """Créer un profil vide ; `contexte` (dossier, mode...) est repris dans l'enregistrement JSON"""
+    if memoire_detaillee and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'contexte': contexte,
+        'memoire_detaillee': memoire_detaillee,
+        'etapes': [],
+        '_pile': []
+    }
+
+def ouvrir_etape(profil, nom, lignes=None):
+    """
+    Début d'une étape nommée ; retourne la mesure à passer à fermer_etape.
+    Les étapes ouvertes dans une autre étape sont enregistrées avec leur niveau.
+    """
+    if profil is None:
+        return {}
+    mesure = {'etape': nom, 'niveau': len(profil['_pile']), 'lignes': lignes}
+    profil['etapes'].append(mesure)
+    if profil['memoire_detaillee'] and tracemalloc.is_tracing():
+        # Le pic en cours est reporté sur l'étape englobante avant remise à zéro
+        if profil['_pile']:
+            parent = profil['_pile'][-1]
+            parent['_pic'] = max(parent.get('_pic', 0), tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    profil['_pile'].append(mesure)
+    mesure['_memoire_debut'] = memoire_max_mo()
+    mesure['_debut'] = time.perf_counter()
+    return mesure
+
+def fermer_etape(profil, mesure, lignes=None):
+    """Fin de l'étape : durée, nombre de lignes (si fourni) et mémoire"""
+    if profil is None:
+        return
+    mesure['duree'] = round(time.perf_counter() - mesure.pop('_debut'), 4)
+    if lignes is not None:
+        mesure['lignes'] = lignes
+    memoire_debut = mesure.pop('_memoire_debut')
+    memoire_fin = memoire_max_mo()
+    mesure['memoire_max_mo'] = memoire_fin
+    mesure['hausse_memoire_max_mo'] = round(memoire_fin - memoire_debut, 1) if memoire_fin is not None else None
+    if profil['_pile'] and profil['_pile'][-1] is mesure:
+        profil['_pile'].pop()
+    if profil['memoire_detaillee'] and tracemalloc.is_tracing():
+        pic = max(mesure.pop('_pic', 0), tracemalloc.get_traced_memory()[1])
+        mesure['pic_alloue_mo'] = round(pic / (1024 * 1024), 1)
+        if profil['_pile']:
+            parent = profil['_pile'][-1]
+            parent['_pic'] = max(parent.get('_pic', 0), pic)
+
+@contextmanager
+def etape(profil, nom, lignes=None):
+    """
+    Mesurer un bloc : `with etape(profil, 'export') as mesure: ...`. Le nombre de
+    lignes peut être renseigné en cours de bloc : mesure['lignes'] = n.
+    """
+    mesure = ouvrir_etape(profil, nom, lignes)
+    try:
+        yield mesure
+    finally:
+        fermer_etape(profil, mesure)
+
+def cumuler_etapes(listes_etapes):
+    """
+    Additionner, étape par étape, les mesures de plusieurs exécutions (lots du mode
+    parallèle) : durées et lignes sommées, mémoire maximale conservée.
+    """
+    cumul = {}
+    for etapes in listes_etapes:
+        for mesure in etapes:
+            cle = (mesure['niveau'], mesure['etape'])
+            total = cumul.setdefault(cle, {'etape': mesure['etape'], 'niveau': mesure['niveau'],
+                                           'duree': 0, 'lignes': 0, 'lots': 0})
+            total['duree'] = round(total['duree'] + mesure.get('duree', 0), 4)
+            total['lignes'] += mesure.get('lignes') or 0
+            total['lots'] += 1
+            for cle_memoire in ('memoire_max_mo', 'hausse_memoire_max_mo', 'pic_alloue_mo'):
+                if mesure.get(cle_memoire) is not None:
+                    total[cle_memoire] = max(total.get(cle_memoire, 0), mesure[cle_memoire])
+    return list(cumul.values())
+
+def ajouter_etapes(profil, etapes):
+    """Reprendre, sous l'étape en cours, des étapes mesurées ailleurs (autre processus)"""
+    if profil is None:
+        return
+    niveau = len(profil['_pile'])
+    for mesure in etapes:
+        profil['etapes'].append(dict(mesure, niveau=mesure['niveau'] + niveau))
+
+def terminer_profil(profil):
+    """Enregistrement JSON du profil (sans état interne), durée totale des étapes de premier niveau"""
+    if profil['memoire_detaillee'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    etapes = [{cle: valeur for cle, valeur in mesure.items() if not cle.startswith('_')}
+              for mesure in profil['etapes']]
+    return {
+        'date': profil['date'],
+        **profil['contexte'],
+        'duree_totale': round(sum(e.get('duree', 0) for e in etapes if e['niveau'] == 0), 4),
+        'memoire_max_mo': memoire_max_mo(),
+        'etapes': etapes
+    }
+
+def etapes_en_tableau(enregistrement):
+    """Étapes d'un enregistrement sous forme de lignes (affichage), indentées selon leur niveau"""
+    return [{
+        'Étape': '\u00a0' * 3 * e['niveau'] + e['etape'],
+        'Durée (s)': e.get('duree'),
+        'Lignes': e.get('lignes'),
+        'Mémoire max (Mo)': e.get('memoire_max_mo'),
+        'Hausse mémoire max (Mo)': e.get('hausse_memoire_max_mo'),
+        **({'Pic alloué (Mo)': e.get('pic_alloue_mo')} if 'pic_alloue_mo' in e else {})
+    } for e in enregistrement['etapes']]
+
+def ecrire_enregistrement(enregistrement, chemin):
+    """Ajouter l'enregistrement (une ligne JSON) au journal des performances"""
+    try:
+        os.makedirs(os.path.dirname(chemin) or '.', exist_ok=True)
+        with open(chemin, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(enregistrement, ensure_ascii=False, default=str) + '\n')
+    except Exception:
+        pass
@@ -0,0 +1,1817 @@
+"""
+Moteur de rapprochement factures / paiements fournisseurs (comptes 4411).
+Module sans interface : importable par les processus de calcul parallèle.
+
+Les montants du Grand Livre (MontantMvt, MontantFacture) sont des entiers en
+centimes : sommes et comparaisons sont exactes ; les lignes de résultat sont
+converties en dirhams une seule fois, en sortie du rapprochement.
+"""
+import bisect
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from profilage import ajouter_etapes, cumuler_etapes, etape, fermer_etape, nouveau_profil, ouvrir_etape
+
+# Nombre de lots de fournisseurs confiés à chaque processus en mode parallèle
+LOTS_PAR_PROCESSUS = 4
+
+# Version des règles de rapprochement : à incrémenter à chaque changement du moteur
+# pour invalider les résultats conservés par le mode incrémental
+VERSION_MOTEUR = 3
+
+# Écart d'arrondi toléré (en centimes) : un solde d'un centime est considéré comme nul
+TOLERANCE_CENTIMES = 1
+
+# Colonnes montants des lignes de résultat (centimes dans le moteur, dirhams en sortie)
+COLONNES_MONTANTS_RESULTAT = ['Montant de la facture', 'Avoir', 'Montant facture net',
+                              'Montant du paiement', 'OD', 'Montant du paiement groupé', 'Solde']
+
+# Colonnes d'une ligne préparée qui déterminent son rapprochement
+COLONNES_EMPREINTE = ['Date', 'Journal', 'NumPiece', 'Libelle', 'MontantMvt', 'MontantFacture',
+                      'Lettrage', 'LettrageCorrige', 'TypeLigne']
+
+def generer_nouvelle_lettre(lettres_utilisees):
+    """Génère une nouvelle lettre de lettrage non utilisée"""
+    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    # Essayer lettres simples
+    for lettre in alphabet:
+        if lettre not in lettres_utilisees:
+            return lettre
+    # Essayer combinaisons AA, AB, etc.
+    for l1 in alphabet:
+        for l2 in alphabet:
+            combo = l1 + l2
+            if combo not in lettres_utilisees:
+                return combo
+    # Essayer AAA, AAB, etc.
+    for l1 in alphabet:
+        for l2 in alphabet:
+            for l3 in alphabet:
+                combo = l1 + l2 + l3
+                if combo not in lettres_utilisees:
+                    return combo
+    return "ZZZ"
+
+def corriger_erreurs_lettrage(grand_livre_df, journaux_achat, journaux_banque):
+    """
+    Fonction désactivée - le lettrage du grand livre est utilisé tel quel.
+    La correction automatique créait des lettrages artificiels qui cassaient
+    l'affectation correcte des avoirs aux factures.
+    """
+    return {}
+
+# Types de ligne du Grand Livre (colonne catégorielle TypeLigne), par ordre de priorité
+TYPES_LIGNE = ['facture', 'avoir', 'paiement', 'remboursement',
+               'od_lettree', 'od_non_lettree', 'effet_4415', 'autre']
+
+def classer_lignes(grand_livre_df, journaux_achat, journaux_banque):
+    """
+    Pré-passe vectorisée : étiqueter chaque ligne avec son type (TypeLigne) et les
+    indicateurs is_4411 / is_lettre. Les chaînes (Compte, Journal, Lettrage) ne sont
+    parcourues qu'une fois ; les sélections du rapprochement deviennent de simples
+    comparaisons booléennes.
+
+    Une ligne 4411 d'achat portant à la fois un débit et un crédit est classée
+    'facture' : les sélections qui doivent aussi la voir comme avoir (ou un
+    remboursement comme paiement) combinent le type avec le signe du montant.
+    """
+    is_4411 = grand_livre_df['Compte'].astype(str).str.startswith('4411').to_numpy()
+    is_4415 = grand_livre_df['Compte'].astype(str).str.startswith('4415').to_numpy()
+    lettrage = grand_livre_df['LettrageCorrige']
+    is_lettre = (lettrage.notna() & (lettrage.astype(str).str.strip() != '')).to_numpy()
+    is_achat = grand_livre_df['Journal'].isin(journaux_achat).to_numpy()
+    is_banque = grand_livre_df['Journal'].isin(journaux_banque).to_numpy()
+    is_od = ~is_achat & ~is_banque
+    montant_mvt = grand_livre_df['MontantMvt'].to_numpy()
+    montant_facture = grand_livre_df['MontantFacture'].to_numpy()
+
+    conditions = [
+        is_4411 & is_achat & (montant_facture != 0),   # facture
+        is_4411 & is_achat & (montant_mvt > 0),        # avoir
+        is_4411 & is_banque & (montant_mvt != 0),      # paiement
+        is_4411 & is_banque & (montant_facture > 0),   # remboursement
+        is_4411 & is_od & is_lettre,                   # od_lettree
+        is_4411 & is_od,                               # od_non_lettree
+        is_4415,                                       # effet_4415
+    ]
+    type_ligne = np.select(conditions, TYPES_LIGNE[:-1], default='autre')
+
+    grand_livre_df['TypeLigne'] = pd.Categorical(type_ligne, categories=TYPES_LIGNE)
+    grand_livre_df['is_4411'] = is_4411
+    grand_livre_df['is_lettre'] = is_lettre
+    return grand_livre_df
+
+def detecter_paiements_effets(grand_livre_df):
+    """
+    Effets à payer (comptes 4415) : retrouver la vraie date de paiement des factures.
+    Flux: Facture 4411 -> Effet créé (4411 soldé, 4415 crédité) -> Paiement réel (4415 débité)
+
+    Deux jointures par clé, en coût linéaire :
+    - (compte 4415, lettrage) : premier paiement réel de l'effet (MontantMvt > 0)
+    - (date, montant) : premier mouvement 4411 du jour de création de l'effet, qui solde la facture
+    Retourne {(compte_4411, lettrage_4411): {'date_paiement', 'montant', 'date_effet'}}
+    """
+    lignes_4415 = grand_livre_df[grand_livre_df['TypeLigne'] == 'effet_4415']
+    effets = lignes_4415[(lignes_4415['MontantFacture'] > 0) & lignes_4415['is_lettre']]
+    if len(effets) == 0:
+        return {}
+
+    # Index (compte, lettrage) -> date du premier paiement réel sur 4415
+    paiements_4415 = lignes_4415[(lignes_4415['MontantMvt'] > 0) & lignes_4415['is_lettre']]
+    paiements_4415 = paiements_4415.drop_duplicates(['Compte', 'LettrageCorrige'])
+    paiements_4415 = paiements_4415[['Compte', 'LettrageCorrige', 'Date']].rename(
+        columns={'Date': 'date_paiement'})
+    paiements_4415['paiement_trouve'] = True
+
+    # Index (date, montant) -> premier mouvement 4411 correspondant
+    lignes_4411 = grand_livre_df[
+        grand_livre_df['is_4411'] &
+        (grand_livre_df['MontantMvt'] > 0) &
+        grand_livre_df['Date'].notna()
+    ]
+    mvts_4411 = lignes_4411.drop_duplicates(['Date', 'MontantMvt'])
+    mvts_4411 = mvts_4411[['Date', 'MontantMvt', 'Compte', 'LettrageCorrige', 'is_lettre']].rename(
+        columns={'MontantMvt': 'MontantFacture', 'Compte': 'compte_4411', 'LettrageCorrige': 'lettrage_4411'})
+
+    # Jointures à gauche : l'ordre des effets du Grand Livre est conservé
+    effets = effets[['Compte', 'LettrageCorrige', 'Date', 'MontantFacture']]
+    effets = effets.merge(paiements_4415, on=['Compte', 'LettrageCorrige'], how='left')
+    effets = effets[effets['paiement_trouve'].notna()]
+    effets = effets.merge(mvts_4411, on=['Date', 'MontantFacture'], how='left')
+    # Le mouvement 4411 doit exister et être lettré pour rattacher l'effet à un groupe
+    effets = effets[effets['is_lettre'].notna()]
+    effets = effets[effets['is_lettre'].astype(bool)]
+
+    dict_paiements_effet = {}
+    for compte_4411, lettrage_4411, date_paiement, montant_effet, date_creation in zip(
+            effets['compte_4411'], effets['lettrage_4411'], effets['date_paiement'],
+            effets['MontantFacture'], effets['Date']):
+        key = (compte_4411, lettrage_4411)
+        if key not in dict_paiements_effet:
+            dict_paiements_effet[key] = {
+                'date_paiement': date_paiement,
+                'montant': montant_effet,
+                'date_effet': date_creation
+            }
+        else:
+            # Si plusieurs effets pour le même groupe, on cumule
+            dict_paiements_effet[key]['montant'] += montant_effet
+
+    return dict_paiements_effet
+
+def preparer_grand_livre(grand_livre_df, journaux_achat, journaux_banque, profil=None):
+    """
+    Préparation sur l'ensemble du Grand Livre : lettrage corrigé, classification
+    des lignes et détection des effets 4415 (qui relient des comptes différents).
+    Retourne (grand_livre_df préparé, dict_paiements_effet).
+    """
+    mesure = ouvrir_etape(profil, 'correction_lettrage', len(grand_livre_df))
+    # Corriger les erreurs de lettrage
+    corrections_lettrage = corriger_erreurs_lettrage(grand_livre_df, journaux_achat, journaux_banque)
+
+    # Ajouter une colonne de lettrage corrigé au grand livre
+    def get_lettrage_corrige(row):
+        key = (row['Compte'], row['NumPiece'], row['Date'], row['MontantFacture'])
+        if key in corrections_lettrage:
+            return corrections_lettrage[key]
+        key2 = (row['Compte'], row['NumPiece'], row['Date'], row['MontantMvt'])
+        if key2 in corrections_lettrage:
+            return corrections_lettrage[key2]
+        return row['Lettrage']
+
+    grand_livre_df = grand_livre_df.copy()
+    if corrections_lettrage:
+        grand_livre_df['LettrageCorrige'] = grand_livre_df.apply(get_lettrage_corrige, axis=1)
+    else:
+        grand_livre_df['LettrageCorrige'] = grand_livre_df['Lettrage']
+
+    fermer_etape(profil, mesure)
+
+    # Classification unique des lignes (type, compte 4411, lettrage)
+    with etape(profil, 'classification', len(grand_livre_df)):
+        grand_livre_df = classer_lignes(grand_livre_df, journaux_achat, journaux_banque)
+
+    # === DÉTECTION DES EFFETS À PAYER (comptes 4415) ===
+    # Clé: (compte_4411, lettrage_4411) -> {date_paiement, montant, date_effet}
+    with etape(profil, 'effets_4415') as mesure:
+        dict_paiements_effet = detecter_paiements_effets(grand_livre_df)
+        mesure['lignes'] = len(dict_paiements_effet)
+
+    return grand_livre_df, dict_paiements_effet
+
+def grouper_par_lettrage(comptes, lettrages, montants, dates=None):
+    """
+    Regroupement en un seul passage des lignes par (compte, lettrage) : un tri stable
+    range chaque groupe en une tranche contiguë, dans l'ordre de première apparition
+    (puis par date, dates manquantes en dernier, si `dates` est fourni).
+    Les séries ont pour index la position des lignes dans le Grand Livre.
+    Retourne (ordre, groupes) : `ordre` = positions triées, `groupes` =
+    {(compte, lettrage): (debut, fin, total des montants)} ; ordre[debut:fin] est la tranche.
+    """
+    if len(comptes) == 0:
+        return np.empty(0, dtype=np.int64), {}
+
+    codes = pd.DataFrame({'Compte': comptes, 'Lettrage': lettrages}).groupby(
+        ['Compte', 'Lettrage'], sort=False).ngroup().to_numpy()
+    if dates is None:
+        tri = np.argsort(codes, kind='stable')
+    else:
+        tri = np.lexsort((dates.fillna(pd.Timestamp.max).to_numpy(), codes))
+
+    codes_tries = codes[tri]
+    fins = np.cumsum(np.bincount(codes_tries))
+    debuts = fins - np.bincount(codes_tries)
+    # Montants entiers (centimes) : les totaux par tranche sont exacts
+    totaux = np.add.reduceat(montants.to_numpy()[tri], debuts)
+
+    comptes_tries = comptes.to_numpy()[tri]
+    lettrages_tries = lettrages.to_numpy()[tri]
+    groupes = {
+        (comptes_tries[debut], lettrages_tries[debut]): (debut, fin, total)
+        for debut, fin, total in zip(debuts.tolist(), fins.tolist(), totaux.tolist())
+    }
+    return comptes.index.to_numpy()[tri], groupes
+
+def racine(suivants, i):
+    """Premier élément encore disponible à partir de i (chaînage avec compression de chemin)"""
+    while suivants[i] != i:
+        suivants[i] = suivants[suivants[i]]
+        i = suivants[i]
+    return i
+
+def index_par_montant(montants):
+    """
+    Index des paiements d'un groupe pour le rapprochement au montant le plus proche :
+    montants distincts triés, et pour chacun les positions des paiements (ordre
+    d'origine). Les montants épuisés sont sautés par chaînage, vers la droite
+    (`suivants`) comme vers la gauche (`precedents`, décalé d'un cran : 0 = aucun).
+    """
+    valeurs = sorted(set(montants))
+    rang = {valeur: i for i, valeur in enumerate(valeurs)}
+    files = [[] for _ in valeurs]
+    for position, montant in enumerate(montants):
+        files[rang[montant]].append(position)
+    return {
+        'valeurs': valeurs,
+        'files': files,
+        'tetes': [0] * len(valeurs),
+        'suivants': list(range(len(valeurs) + 1)),
+        'precedents': list(range(len(valeurs) + 1))
+    }
+
+def prendre_plus_proche(index, montant):
+    """
+    Retirer de l'index le paiement disponible dont le montant est le plus proche de
+    `montant` (à écart égal, le premier dans l'ordre d'origine) et retourner sa
+    position ; None si tous les paiements sont pris. Recherche dichotomique : O(log n).
+    """
+    valeurs, files, tetes = index['valeurs'], index['files'], index['tetes']
+    j = bisect.bisect_left(valeurs, montant)
+    droite = racine(index['suivants'], j)
+    gauche = racine(index['precedents'], j) - 1
+
+    candidats = []
+    if droite < len(valeurs):
+        candidats.append((valeurs[droite] - montant, files[droite][tetes[droite]], droite))
+    if gauche >= 0:
+        candidats.append((montant - valeurs[gauche], files[gauche][tetes[gauche]], gauche))
+    if not candidats:
+        return None
+
+    _, position, k = min(candidats)
+    tetes[k] += 1
+    if tetes[k] == len(files[k]):
+        # Montant épuisé : les recherches suivantes passent au montant voisin
+        index['suivants'][k] = k + 1
+        index['precedents'][k + 1] = k
+    return position
+
+def rapprocher_fournisseurs(grand_livre_df, dict_fournisseurs, dict_paiements_effet, profil=None):
+    """
+    Rapprochement factures / paiements sur un Grand Livre préparé.
+    Chaque fournisseur est indépendant : la fonction accepte aussi bien tout le
+    Grand Livre qu'un lot de comptes (exécution parallèle).
+    Retourne les lignes de résultat brutes (non triées).
+    """
+    mesure = ouvrir_etape(profil, 'constitution_groupes', len(grand_livre_df))
+    # Magasin de colonnes : les structures de rapprochement ne conservent que la position
+    # (entier) de chaque ligne et lisent ses champs dans ces listes, au lieu de copier une
+    # pd.Series par facture / avoir / paiement
+    grand_livre_df = grand_livre_df.reset_index(drop=True)
+    cles_compte = grand_livre_df['Compte'].astype(str).str.strip()
+    cles_lettrage = grand_livre_df['LettrageCorrige'].astype(str).str.strip()
+    dates = grand_livre_df['Date'].tolist()
+    comptes = cles_compte.tolist()
+    numeros_piece = grand_livre_df['NumPiece'].tolist()
+    libelles = grand_livre_df['Libelle'].tolist()
+    montants_mvt = grand_livre_df['MontantMvt'].tolist()
+    montants_facture = grand_livre_df['MontantFacture'].tolist()
+    lettrages = grand_livre_df['Lettrage'].astype(str).str.strip().tolist()
+
+    type_ligne = grand_livre_df['TypeLigne']
+    est_lettre = grand_livre_df['is_lettre'].to_numpy()
+
+    def positions(masque):
+        return np.flatnonzero(masque).tolist()
+
+    def grouper(masque, montants, par_date=False):
+        return grouper_par_lettrage(cles_compte[masque], cles_lettrage[masque], montants[masque],
+                                    grand_livre_df['Date'][masque] if par_date else None)
+
+    def tranche(ordre, groupes, key):
+        if key not in groupes:
+            return ordre[:0]
+        debut, fin, _ = groupes[key]
+        return ordre[debut:fin]
+
+    def total_groupe(groupes, key):
+        return groupes[key][2] if key in groupes else 0
+
+    def cle_date(position):
+        date = dates[position]
+        return date if pd.notna(date) else pd.Timestamp.max
+
+    montants_mvt_abs = grand_livre_df['MontantMvt'].abs()
+    montants_facture_abs = grand_livre_df['MontantFacture'].abs()
+
+    # Identifier les factures, groupées par (compte, lettrage) et triées par date dans chaque
+    # groupe (le groupe au lettrage vide regroupe les factures non lettrées du compte)
+    masque_factures = (type_ligne == 'facture').to_numpy()
+    ordre_factures, groupes_factures = grouper(masque_factures, montants_facture_abs, par_date=True)
+
+    # Identifier les avoirs (avec détails pour affectation chronologique)
+    masque_avoirs = (
+        type_ligne.isin(['facture', 'avoir']) &
+        (grand_livre_df['MontantMvt'] > 0)
+    ).to_numpy()
+
+    # Avoirs lettrés par (compte, lettrage) ; les avoirs sans lettrage sont traités séparément
+    ordre_avoirs, groupes_avoirs = grouper(masque_avoirs & est_lettre, grand_livre_df['MontantMvt'])
+    avoirs_non_lettres = positions(masque_avoirs & ~est_lettre)
+
+    # Identifier les paiements (lettrés : par groupe, montant en valeur absolue)
+    masque_paiements = (type_ligne == 'paiement').to_numpy()
+    ordre_paiements, groupes_paiements = grouper(masque_paiements & est_lettre, montants_mvt_abs)
+
+    # Identifier les remboursements fournisseurs (journal banque avec MontantFacture > 0)
+    # Ces remboursements représentent un retour d'argent au fournisseur (avoir encaissé)
+    # Un remboursement lettré est un "paiement négatif" - le fournisseur nous rend de l'argent
+    masque_remboursements = (
+        type_ligne.isin(['paiement', 'remboursement']) &
+        (grand_livre_df['MontantFacture'] > 0)
+    ).to_numpy()
+    ordre_remboursements, groupes_remboursements = grouper(
+        masque_remboursements & est_lettre, grand_livre_df['MontantFacture'])
+
+    # Identifier les remboursements fournisseurs non lettrés
+    # Critères : Journal banque + Compte 4411 + MontantFacture > 0 + Lettrage vide
+    remboursements_non_lettres = positions(masque_remboursements & ~est_lettre)
+
+    def paiements_du_groupe(key):
+        """Paiements lettrés du groupe, suivis du paiement par effet 4415 éventuel."""
+        paiements_groupe = [{
+            'date': dates[pos],
+            'montant': abs(montants_mvt[pos]),
+            'type': 'paiement',
+            'position': pos
+        } for pos in tranche(ordre_paiements, groupes_paiements, key)]
+        # Le paiement par effet a une date de paiement réelle différente de la date de l'effet
+        effet_info = dict_paiements_effet.get(key)
+        if effet_info is not None:
+            paiements_groupe.append({
+                'date': effet_info['date_paiement'],  # Date du paiement réel sur 4415
+                'montant': effet_info['montant'],
+                'type': 'paiement_effet',
+                'position': None  # Pas de ligne paiement, c'est un effet
+            })
+        return paiements_groupe
+
+    # Identifier les OD lettrées - Journal différent de achat/banque + Lettrage présent
+    # On distingue deux types selon le CONTEXTE du groupe :
+    # 1. Écarts de change : MontantMvt > 0 → toujours réparti sur les factures
+    # 2. OD avec MontantFacture > 0 et MontantMvt = 0 :
+    #    - Si le groupe a des PAIEMENTS → c'est une perte/gain de change → répartir
+    #    - Si le groupe N'A PAS de paiements → c'est un reclassement → ligne séparée
+    masque_od_lettrees = (type_ligne == 'od_lettree').to_numpy() & est_lettre
+
+    # Type 1 : MontantMvt > 0 (écarts de change classiques)
+    _, groupes_od_mvt = grouper(
+        masque_od_lettrees & (grand_livre_df['MontantMvt'] > 0).to_numpy(), montants_mvt_abs)
+    
+    # Type 2 : MontantFacture > 0 et MontantMvt = 0 (à classifier selon contexte)
+    ordre_od_facture, groupes_od_facture = grouper(
+        masque_od_lettrees &
+        (grand_livre_df['MontantFacture'] > 0).to_numpy() &
+        (grand_livre_df['MontantMvt'] == 0).to_numpy(),
+        montants_facture_abs
+    )
+
+    # Stocker les écarts de change (MontantMvt > 0) pour répartition
+    # SAUF les mouvements vers 4415 (effets) qui sont traités comme des paiements
+    dict_od_brut = {
+        key: montant_od
+        for key, (_, _, montant_od) in groupes_od_mvt.items()
+        if key not in dict_paiements_effet
+    }
+
+    # Pour les OD avec MontantFacture > 0 : classifier selon le contexte du groupe
+    # - Si groupe a des FACTURES ET des paiements → répartir sur factures
+    # - Sinon (pas de factures ou pas de paiements) → reclassement
+    od_reclassements_par_groupe = {}
+    for key, groupe_od in groupes_od_facture.items():
+        # Vérifier si ce groupe a des paiements bancaires ET des factures
+        groupe_a_paiements = key in groupes_paiements or key in dict_paiements_effet
+        groupe_a_factures = key in groupes_factures
+
+        if groupe_a_paiements and groupe_a_factures:
+            # Le groupe a des factures ET des paiements → l'OD est une perte/gain de change à répartir
+            dict_od_brut[key] = dict_od_brut.get(key, 0) + groupe_od[2]
+        else:
+            # Le groupe n'a PAS de factures ou PAS de paiements → c'est un reclassement
+            od_reclassements_par_groupe[key] = groupe_od
+
+    fermer_etape(profil, mesure)
+    # Groupes lettrés, avec leurs cas particuliers (effets, avoirs, remboursements, OD)
+    mesure = ouvrir_etape(profil, 'groupes_lettres', len(groupes_factures))
+
+    # Créer le tableau de résultats
+    resultats = []
+
+    # Structure pour stocker les factures avec solde restant (pour affectation des paiements non lettrés)
+    factures_solde_restant = []  # Liste de dicts avec infos facture + solde restant
+
+    # Suivre les groupes déjà traités par affectation chronologique
+    groupes_traites = set()
+
+    # Traiter les groupes avec lettrage (affectation chronologique)
+    for key, (debut, fin, total_factures) in groupes_factures.items():
+        compte_fournisseur, lettrage_corrige = key
+
+        if not lettrage_corrige:
+            continue  # Les non-lettrés seront traités séparément
+
+        # Tranches du groupe (positions de lignes) et totaux précalculés par le regroupement
+        factures_groupe = ordre_factures[debut:fin].tolist()
+        avoirs_groupe = tranche(ordre_avoirs, groupes_avoirs, key).tolist()
+        paiements_groupe = paiements_du_groupe(key)
+        remboursements_groupe = tranche(ordre_remboursements, groupes_remboursements, key).tolist()
+        od_brut = dict_od_brut.get(key, 0)
+
+        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
+
+        # Totaux pour déterminer gain/perte
+        total_avoirs = total_groupe(groupes_avoirs, key)
+        total_paiements_montant = total_groupe(groupes_paiements, key)
+        if key in dict_paiements_effet:
+            total_paiements_montant += dict_paiements_effet[key]['montant']
+        # Soustraire les remboursements du total des paiements
+        total_remboursements = total_groupe(groupes_remboursements, key)
+        total_paiements_net = total_paiements_montant - total_remboursements
+
+        # CORRECTION: Si une seule facture avec plusieurs paiements et OD, forcer le traitement proratisé
+        if len(factures_groupe) == 1 and len(paiements_groupe) > 1 and od_brut > 0:
+            # Forcer le passage par la logique de plusieurs paiements
+            pos_facture = factures_groupe[0]
+            lettrage_original = lettrages[pos_facture]
+            lettrage_corrige_affiche = lettrage_corrige if lettrage_corrige != lettrage_original else ''
+            montant_original = abs(montants_facture[pos_facture])
+            
+            total_paiements_facture = sum(p['montant'] for p in paiements_groupe)
+            
+            # Déterminer si c'est une perte de change (paiements > factures)
+            is_perte_change_local = total_paiements_facture > montant_original
+            
+            for paiement in paiements_groupe:
+                montant_paiement = paiement['montant']
+                ratio = montant_paiement / total_paiements_facture if total_paiements_facture > 0 else 0
+                
+                # Proratiser la facture et l'OD
+                montant_facture_prorata = montant_original * ratio
+                od_prorata = od_brut * ratio if is_perte_change_local else -od_brut * ratio
+                solde_paiement = montant_facture_prorata - montant_paiement + od_prorata
+                
+                resultats.append({
+                    'Date de facture': dates[pos_facture],
+                    'N° de facture': numeros_piece[pos_facture],
+                    'N° compte fournisseur': compte_fournisseur,
+                    'Nom du fournisseur': nom_fournisseur,
+                    'Libellé de l\'opération': libelles[pos_facture],
+                    'Montant de la facture': montant_facture_prorata,
+                    'Avoir': 0,
+                    'Montant facture net': montant_facture_prorata,
+                    'Date de paiement': paiement['date'],
+                    'Montant du paiement': montant_paiement,
+                    'OD': od_prorata,
+                    'Montant du paiement groupé': 0,
+                    'Lettrage': lettrage_original,
+                    'Lettrage corrigé': lettrage_corrige_affiche,
+                    'Solde': solde_paiement
+                })
+            
+            groupes_traites.add(key)
+            continue
+
+        # Déterminer si c'est une perte de change (paiements > factures) ou un gain
+        # Perte de change : on a payé PLUS que la facture → OD positif
+        # Gain / Passage en gain : on a payé MOINS que la facture → OD négatif
+        # Montants en centimes : la comparaison est exacte, sans tolérance d'arrondi
+        is_perte_change = total_paiements_net > (total_factures - total_avoirs)
+
+        if od_brut > 0:
+            if is_perte_change:
+                montant_od_signe = od_brut  # Positif pour perte de change
+            else:
+                montant_od_signe = -od_brut  # Négatif pour gain
+        else:
+            montant_od_signe = 0
+
+        # Combiner avoirs, paiements et remboursements et trier chronologiquement
+        operations = []
+        for pos_avoir in avoirs_groupe:
+            operations.append({
+                'date': dates[pos_avoir],
+                'montant': montants_mvt[pos_avoir],
+                'type': 'avoir',
+                'montant_restant': montants_mvt[pos_avoir]
+            })
+        for paiement in paiements_groupe:
+            operations.append({
+                'date': paiement['date'],
+                'montant': paiement['montant'],
+                'type': 'paiement',
+                'montant_restant': paiement['montant'],
+                'position': paiement['position']
+            })
+        # Ajouter les remboursements comme paiements négatifs
+        for pos_remb in remboursements_groupe:
+            operations.append({
+                'date': dates[pos_remb],
+                'montant': -montants_facture[pos_remb],  # Négatif car c'est un remboursement
+                'type': 'remboursement',
+                'montant_restant': -montants_facture[pos_remb],
+                'position': pos_remb
+            })
+
+        # Trier par date (plus ancien d'abord)
+        operations = sorted(
+            operations,
+            key=lambda x: x['date'] if pd.notna(x['date']) else pd.Timestamp.max
+        )
+
+        # Calculer le total des paiements pour "Montant du paiement groupé"
+        # Inclure les remboursements (qui ont des montants négatifs)
+        total_paiements = sum(op['montant'] for op in operations if op['type'] in ('paiement', 'remboursement'))
+
+        # Préparer les factures avec leur solde restant
+        factures_avec_solde = []
+        for pos in factures_groupe:
+            factures_avec_solde.append({
+                'position': pos,
+                'montant_original': abs(montants_facture[pos]),
+                'solde_restant': abs(montants_facture[pos]),
+                'avoir_affecte': 0,
+                'paiements_affectes': []
+            })
+
+        # Affectation chronologique des opérations aux factures
+        # Les remboursements sont traités séparément après
+        remboursements_a_traiter = []
+        for op in operations:
+            if op['type'] == 'remboursement':
+                # Les remboursements sont traités séparément
+                remboursements_a_traiter.append(op)
+                continue
+                
+            montant_op_restant = op['montant_restant']
+
+            for fac_info in factures_avec_solde:
+                if montant_op_restant <= 0:
+                    break
+                if fac_info['solde_restant'] <= 0:
+                    continue
+
+                montant_a_affecter = min(montant_op_restant, fac_info['solde_restant'])
+
+                if op['type'] == 'avoir':
+                    fac_info['avoir_affecte'] += montant_a_affecter
+                else:
+                    fac_info['paiements_affectes'].append({
+                        'montant': montant_a_affecter,
+                        'date': op['date'],
+                        'total_paiement': op['montant']
+                    })
+
+                fac_info['solde_restant'] -= montant_a_affecter
+                montant_op_restant -= montant_a_affecter
+        
+        # Traiter les remboursements : ils correspondent aux avoirs
+        # Chaque remboursement annule un avoir du même groupe
+        for remb in remboursements_a_traiter:
+            montant_remb = abs(remb['montant'])  # Montant positif pour comparaison
+            # Ajouter le remboursement comme paiement négatif sur la première facture avec avoir
+            for fac_info in factures_avec_solde:
+                if fac_info['avoir_affecte'] > 0:
+                    fac_info['paiements_affectes'].append({
+                        'montant': -montant_remb,  # Négatif car remboursement
+                        'date': remb['date'],
+                        'total_paiement': -montant_remb,
+                        'type': 'remboursement'
+                    })
+                    break
+
+        # Cas spécial : Plusieurs factures + 1 paiement unique + OD (pénalité/perte de change OU gain de change)
+        # Le paiement couvre toutes les factures avec un écart (OD)
+        # Factures 1 à N-1 : paiement = montant facture, OD = 0, Solde = 0
+        # Dernière facture : paiement = reste du paiement, OD = total OD (+ ou -), Solde = 0
+        if (len(factures_groupe) > 1 and len(paiements_groupe) == 1
+            and total_avoirs == 0 and od_brut > 0):
+
+            # Trier les factures par date
+            factures_triees = sorted(factures_avec_solde,
+                key=lambda x: cle_date(x['position']))
+
+            paiement_info = paiements_groupe[0]
+            date_paiement = paiement_info['date']
+            paiement_total = paiement_info['montant']
+            paiement_restant = paiement_total
+
+            for idx, fac_info in enumerate(factures_triees):
+                pos_facture = fac_info['position']
+                lettrage_original = lettrages[pos_facture]
+                lettrage_corrige_affiche = lettrage_corrige if lettrage_corrige != lettrage_original else ''
+                montant_facture = fac_info['montant_original']
+
+                is_derniere_facture = (idx == len(factures_triees) - 1)
+
+                if is_derniere_facture:
+                    # Dernière facture : reçoit le reste du paiement et tout l'OD
+                    montant_paiement_affiche = paiement_restant
+                    # OD positif si perte de change, négatif si gain de change
+                    od_affiche = od_brut if is_perte_change else -od_brut
+                else:
+                    # Factures intermédiaires : paiement = montant facture, OD = 0, Solde = 0
+                    montant_paiement_affiche = montant_facture
+                    od_affiche = 0
+                    paiement_restant -= montant_facture
+
+                solde = montant_facture - montant_paiement_affiche + od_affiche
+
+                resultats.append({
+                    'Date de facture': dates[pos_facture],
+                    'N° de facture': numeros_piece[pos_facture],
+                    'N° compte fournisseur': compte_fournisseur,
+                    'Nom du fournisseur': nom_fournisseur,
+                    'Libellé de l\'opération': libelles[pos_facture],
+                    'Montant de la facture': montant_facture,
+                    'Avoir': 0,
+                    'Montant facture net': montant_facture,
+                    'Date de paiement': date_paiement,
+                    'Montant du paiement': montant_paiement_affiche,
+                    'OD': od_affiche,
+                    'Montant du paiement groupé': paiement_total,
+                    'Lettrage': lettrage_original,
+                    'Lettrage corrigé': lettrage_corrige_affiche,
+                    'Solde': solde
+                })
+
+            groupes_traites.add(key)
+            continue  # Passer au groupe suivant, ne pas exécuter la boucle normale
+
+        # Cas spécial : Plusieurs factures + plusieurs paiements + OD (écart de régularisation)
+        # Rapprochement 1-1 entre factures et paiements, l'OD sur la première facture avec écart
+        if (len(factures_groupe) > 1 and len(paiements_groupe) > 1
+            and total_avoirs == 0 and od_brut > 0):
+
+            # Trier les factures par date
+            factures_triees = sorted(factures_avec_solde,
+                key=lambda x: cle_date(x['position']))
+
+            # Paiements disponibles indexés par montant (recherche du plus proche en O(log n))
+            paiements_disponibles = index_par_montant([p['montant'] for p in paiements_groupe])
+
+            od_deja_affecte = False
+
+            for idx, fac_info in enumerate(factures_triees):
+                pos_facture = fac_info['position']
+                lettrage_original = lettrages[pos_facture]
+                lettrage_corrige_affiche = lettrage_corrige if lettrage_corrige != lettrage_original else ''
+                montant_facture = fac_info['montant_original']
+
+                # Chercher le paiement correspondant (exact ou le plus proche)
+                meilleur_idx = prendre_plus_proche(paiements_disponibles, montant_facture)
+
+                if meilleur_idx is not None:
+                    meilleur_paiement = paiements_groupe[meilleur_idx]
+                    montant_paiement = meilleur_paiement['montant']
+                    date_paiement = meilleur_paiement['date']
+
+                    # L'OD est affecté à la première facture qui a un écart
+                    if not od_deja_affecte and montant_facture != montant_paiement:
+                        # OD positif si perte de change, négatif si gain de change
+                        od_affiche = od_brut if is_perte_change else -od_brut
+                        od_deja_affecte = True
+                    else:
+                        od_affiche = 0
+
+                    solde = montant_facture - montant_paiement + od_affiche
+                else:
+                    # Pas de paiement trouvé
+                    montant_paiement = 0
+                    date_paiement = None
+                    od_affiche = 0
+                    solde = montant_facture
+
+                resultats.append({
+                    'Date de facture': dates[pos_facture],
+                    'N° de facture': numeros_piece[pos_facture],
+                    'N° compte fournisseur': compte_fournisseur,
+                    'Nom du fournisseur': nom_fournisseur,
+                    'Libellé de l\'opération': libelles[pos_facture],
+                    'Montant de la facture': montant_facture,
+                    'Avoir': 0,
+                    'Montant facture net': montant_facture,
+                    'Date de paiement': date_paiement,
+                    'Montant du paiement': montant_paiement,
+                    'OD': od_affiche,
+                    'Montant du paiement groupé': total_paiements,
+                    'Lettrage': lettrage_original,
+                    'Lettrage corrigé': lettrage_corrige_affiche,
+                    'Solde': solde
+                })
+
+            groupes_traites.add(key)
+            continue  # Passer au groupe suivant
+
+        # Cas spécial : Plusieurs factures + PAS de paiement + OD (annulation par OD/effet)
+        # L'OD annule les factures - répartir l'OD au prorata sur chaque facture
+        if (len(factures_groupe) > 1 and len(paiements_groupe) == 0
+            and total_avoirs == 0 and od_brut > 0):
+
+            # Trier les factures par date
+            factures_triees = sorted(factures_avec_solde,
+                key=lambda x: cle_date(x['position']))
+
+            for fac_info in factures_triees:
+                pos_facture = fac_info['position']
+                lettrage_original = lettrages[pos_facture]
+                lettrage_corrige_affiche = lettrage_corrige if lettrage_corrige != lettrage_original else ''
+                montant_facture = fac_info['montant_original']
+
+                # Calculer l'OD au prorata : OD_i = OD_total × (Montant_facture_i / Total_factures)
+                ratio = montant_facture / total_factures if total_factures > 0 else 0
+                od_prorata = od_brut * ratio
+
+                # L'OD est négative (annule la facture) donc solde = montant - od_prorata = 0
+                solde = montant_facture - od_prorata
+
+                resultats.append({
+                    'Date de facture': dates[pos_facture],
+                    'N° de facture': numeros_piece[pos_facture],
+                    'N° compte fournisseur': compte_fournisseur,
+                    'Nom du fournisseur': nom_fournisseur,
+                    'Libellé de l\'opération': libelles[pos_facture],
+                    'Montant de la facture': montant_facture,
+                    'Avoir': 0,
+                    'Montant facture net': montant_facture,
+                    'Date de paiement': None,
+                    'Montant du paiement': 0,
+                    'OD': -od_prorata,  # Négatif car annulation
+                    'Montant du paiement groupé': 0,
+                    'Lettrage': lettrage_original,
+                    'Lettrage corrigé': lettrage_corrige_affiche,
+                    'Solde': solde
+                })
+
+            groupes_traites.add(key)
+            continue  # Passer au groupe suivant
+
+        # Générer les lignes de résultat pour chaque facture
+        for fac_info in factures_avec_solde:
+            pos_facture = fac_info['position']
+            lettrage_original = lettrages[pos_facture]
+            lettrage_corrige_affiche = lettrage_corrige if lettrage_corrige != lettrage_original else ''
+
+            avoir_total = fac_info['avoir_affecte']
+            paiements_affectes = fac_info['paiements_affectes']
+            montant_original = fac_info['montant_original']
+
+            # Si la facture a des avoirs et des paiements
+            if avoir_total > 0 and len(paiements_affectes) > 0:
+                # Ligne pour l'avoir
+                montant_facture_avoir = avoir_total
+                montant_facture_net_avoir = 0  # Avoir couvre cette portion
+                solde_avoir = montant_facture_net_avoir - 0 + montant_od_signe
+
+                resultats.append({
+                    'Date de facture': dates[pos_facture],
+                    'N° de facture': numeros_piece[pos_facture],
+                    'N° compte fournisseur': compte_fournisseur,
+                    'Nom du fournisseur': nom_fournisseur,
+                    'Libellé de l\'opération': libelles[pos_facture],
+                    'Montant de la facture': montant_facture_avoir,
+                    'Avoir': avoir_total,
+                    'Montant facture net': montant_facture_net_avoir,
+                    'Date de paiement': None,
+                    'Montant du paiement': 0,
+                    'OD': montant_od_signe,
+                    'Montant du paiement groupé': 0,
+                    'Lettrage': lettrage_original,
+                    'Lettrage corrigé': lettrage_corrige_affiche,
+                    'Solde': solde_avoir
+                })
+
+                # Lignes pour chaque paiement
+                for paiement_aff in paiements_affectes:
+                    montant_paiement = paiement_aff['montant']
+                    montant_facture_affiche = montant_paiement
+                    montant_facture_net_affiche = montant_facture_affiche
+                    solde_paiement = montant_facture_net_affiche - montant_paiement + montant_od_signe
+
+                    resultats.append({
+                        'Date de facture': dates[pos_facture],
+                        'N° de facture': numeros_piece[pos_facture],
+                        'N° compte fournisseur': compte_fournisseur,
+                        'Nom du fournisseur': nom_fournisseur,
+                        'Libellé de l\'opération': libelles[pos_facture],
+                        'Montant de la facture': montant_facture_affiche,
+                        'Avoir': 0,
+                        'Montant facture net': montant_facture_net_affiche,
+                        'Date de paiement': paiement_aff['date'],
+                        'Montant du paiement': montant_paiement,
+                        'OD': montant_od_signe,
+                        'Montant du paiement groupé': total_paiements if len(factures_groupe) > 1 else 0,
+                        'Lettrage': lettrage_original,
+                        'Lettrage corrigé': lettrage_corrige_affiche,
+                        'Solde': solde_paiement
+                    })
+
+            # Si la facture n'a que des avoirs
+            elif avoir_total > 0 and len(paiements_affectes) == 0:
+                montant_facture_net = montant_original - avoir_total
+                solde = montant_facture_net + montant_od_signe
+
+                resultats.append({
+                    'Date de facture': dates[pos_facture],
+                    'N° de facture': numeros_piece[pos_facture],
+                    'N° compte fournisseur': compte_fournisseur,
+                    'Nom du fournisseur': nom_fournisseur,
+                    'Libellé de l\'opération': libelles[pos_facture],
+                    'Montant de la facture': montant_original,
+                    'Avoir': avoir_total,
+                    'Montant facture net': montant_facture_net,
+                    'Date de paiement': None,
+                    'Montant du paiement': 0,
+                    'OD': montant_od_signe,
+                    'Montant du paiement groupé': 0,
+                    'Lettrage': lettrage_original,
+                    'Lettrage corrigé': lettrage_corrige_affiche,
+                    'Solde': solde
+                })
+
+            # Si la facture n'a que des paiements (pas d'avoir)
+            elif avoir_total == 0 and len(paiements_affectes) > 0:
+                # Cas spécial : Écart de change avec plusieurs paiements (perte de change)
+                # On applique le prorata : MF_i = Facture × (Paiement_i / Total Paiements)
+                # OD_i = OD × (Paiement_i / Total Paiements)
+                if is_perte_change and len(paiements_affectes) > 1 and od_brut > 0:
+                    # Prorata pour écart de change
+                    total_paiements_facture = sum(p['montant'] for p in paiements_affectes)
+                    for paiement_aff in paiements_affectes:
+                        montant_paiement = paiement_aff['montant']
+                        ratio = montant_paiement / total_paiements_facture if total_paiements_facture > 0 else 0
+                        # Montant facture prorata
+                        montant_facture_prorata = montant_original * ratio
+                        # OD prorata (positif car perte de change)
+                        od_prorata = od_brut * ratio
+                        # Solde = MF - Paiement + OD = 0
+                        solde_paiement = montant_facture_prorata - montant_paiement + od_prorata
+
+                        resultats.append({
+                            'Date de facture': dates[pos_facture],
+                            'N° de facture': numeros_piece[pos_facture],
+                            'N° compte fournisseur': compte_fournisseur,
+                            'Nom du fournisseur': nom_fournisseur,
+                            'Libellé de l\'opération': libelles[pos_facture],
+                            'Montant de la facture': montant_facture_prorata,
+                            'Avoir': 0,
+                            'Montant facture net': montant_facture_prorata,
+                            'Date de paiement': paiement_aff['date'],
+                            'Montant du paiement': montant_paiement,
+                            'OD': od_prorata,
+                            'Montant du paiement groupé': 0,  # Pas de paiement groupé (plusieurs paiements pour 1 facture)
+                            'Lettrage': lettrage_original,
+                            'Lettrage corrigé': lettrage_corrige_affiche,
+                            'Solde': solde_paiement
+                        })
+                # Plusieurs paiements sans écart de change spécial
+                elif len(paiements_affectes) > 1:
+                    # CORRECTION: Proratiser la facture quand plusieurs paiements
+                    total_paiements_facture = sum(p['montant'] for p in paiements_affectes)
+                    
+                    for paiement_aff in paiements_affectes:
+                        montant_paiement = paiement_aff['montant']
+                        
+                        # Proratiser la facture selon le ratio du paiement
+                        ratio = montant_paiement / total_paiements_facture if total_paiements_facture > 0 else 0
+                        montant_facture_affiche = montant_original * ratio
+                        montant_facture_net_affiche = montant_facture_affiche
+                        
+                        # Proratiser l'OD aussi
+                        od_affiche = montant_od_signe * ratio if montant_od_signe != 0 else 0
+                        solde_paiement = montant_facture_net_affiche - montant_paiement + od_affiche
+
+                        resultats.append({
+                            'Date de facture': dates[pos_facture],
+                            'N° de facture': numeros_piece[pos_facture],
+                            'N° compte fournisseur': compte_fournisseur,
+                            'Nom du fournisseur': nom_fournisseur,
+                            'Libellé de l\'opération': libelles[pos_facture],
+                            'Montant de la facture': montant_facture_affiche,
+                            'Avoir': 0,
+                            'Montant facture net': montant_facture_net_affiche,
+                            'Date de paiement': paiement_aff['date'],
+                            'Montant du paiement': montant_paiement,
+                            'OD': od_affiche,
+                            'Montant du paiement groupé': 0,  # CORRECTION: 0 car plusieurs paiements pour 1 facture
+                            'Lettrage': lettrage_original,
+                            'Lettrage corrigé': lettrage_corrige_affiche,
+                            'Solde': solde_paiement
+                        })
+                else:
+                    # Un seul paiement (potentiellement partiel)
+                    paiement_aff = paiements_affectes[0]
+                    montant_paiement = paiement_aff['montant']
+
+                    # S'il y a un OD (gain OU perte de change)
+                    if od_brut > 0:
+                        montant_paiement = paiement_aff.get('total_paiement', paiement_aff['montant'])
+                        montant_facture_affiche = montant_original
+                        solde = montant_original - montant_paiement + montant_od_signe
+                    else:
+                        # Paiement partiel ou exact sans OD
+                        montant_facture_affiche = montant_paiement
+                        solde = 0
+
+                    resultats.append({
+                        'Date de facture': dates[pos_facture],
+                        'N° de facture': numeros_piece[pos_facture],
+                        'N° compte fournisseur': compte_fournisseur,
+                        'Nom du fournisseur': nom_fournisseur,
+                        'Libellé de l\'opération': libelles[pos_facture],
+                        'Montant de la facture': montant_facture_affiche,
+                        'Avoir': 0,
+                        'Montant facture net': montant_facture_affiche,
+                        'Date de paiement': paiement_aff['date'],
+                        'Montant du paiement': montant_paiement,
+                        'OD': montant_od_signe if od_brut > 0 else 0,
+                        'Montant du paiement groupé': total_paiements if len(factures_groupe) > 1 else 0,
+                        'Lettrage': lettrage_original,
+                        'Lettrage corrigé': lettrage_corrige_affiche,
+                        'Solde': solde
+                    })
+
+            # Si la facture n'a ni avoir ni paiement
+            else:
+                solde = montant_original + montant_od_signe
+
+                resultats.append({
+                    'Date de facture': dates[pos_facture],
+                    'N° de facture': numeros_piece[pos_facture],
+                    'N° compte fournisseur': compte_fournisseur,
+                    'Nom du fournisseur': nom_fournisseur,
+                    'Libellé de l\'opération': libelles[pos_facture],
+                    'Montant de la facture': montant_original,
+                    'Avoir': 0,
+                    'Montant facture net': montant_original,
+                    'Date de paiement': None,
+                    'Montant du paiement': 0,
+                    'OD': montant_od_signe,
+                    'Montant du paiement groupé': 0,
+                    'Lettrage': lettrage_original,
+                    'Lettrage corrigé': lettrage_corrige_affiche,
+                    'Solde': solde
+                })
+
+            # Stocker les factures avec solde restant pour affectation des paiements non lettrés
+            # IMPORTANT: Vérifier le solde RÉEL après OD pour ne pas affecter les paiements
+            # à des factures déjà soldées par leur groupe lettré
+            if fac_info['solde_restant'] > TOLERANCE_CENTIMES:
+                # Calculer le solde réel en tenant compte de l'OD
+                solde_reel = fac_info['solde_restant'] + montant_od_signe
+                
+                # N'ajouter QUE si le solde réel > 0 (la facture a vraiment besoin d'un paiement)
+                if solde_reel > TOLERANCE_CENTIMES:
+                    factures_solde_restant.append({
+                        'position': pos_facture,
+                        'compte': compte_fournisseur,
+                        'nom_fournisseur': nom_fournisseur,
+                        'solde_restant': solde_reel,  # Solde APRÈS OD
+                        'lettrage_original': lettrage_original,
+                        'lettrage_corrige_affiche': lettrage_corrige_affiche,
+                        'od_signe': 0  # OD déjà comptabilisé dans solde_restant
+                    })
+
+        # Traiter les avoirs non affectés (quand la facture était déjà payée)
+        # Ces avoirs doivent être sortis avec leur remboursement correspondant
+        total_avoirs_affectes = sum(fac_info['avoir_affecte'] for fac_info in factures_avec_solde)
+        if total_avoirs < total_avoirs_affectes + TOLERANCE_CENTIMES:
+            # Tous les avoirs ont été affectés, rien à faire
+            pass
+        else:
+            # Il reste des avoirs non affectés
+            avoirs_non_affectes = total_avoirs - total_avoirs_affectes
+            
+            # Récupérer les remboursements de ce groupe
+            remboursements_ce_groupe = remboursements_groupe
+            total_remboursements_groupe = total_remboursements
+            
+            # Pour chaque avoir non affecté, créer une ligne
+            for pos_avoir in avoirs_groupe:
+                # Vérifier si cet avoir a été partiellement ou non affecté
+                montant_avoir = montants_mvt[pos_avoir]
+                
+                # Calculer la portion non affectée (simplifié: on traite proportionnellement)
+                if total_avoirs > 0:
+                    ratio_non_affecte = avoirs_non_affectes / total_avoirs
+                    montant_avoir_non_affecte = montant_avoir * ratio_non_affecte
+                else:
+                    montant_avoir_non_affecte = 0
+                
+                if montant_avoir_non_affecte > TOLERANCE_CENTIMES:
+                    # Calculer le remboursement correspondant
+                    if total_avoirs > 0:
+                        ratio_remb = montant_avoir / total_avoirs
+                        montant_remboursement = total_remboursements_groupe * ratio_remb
+                    else:
+                        montant_remboursement = 0
+                    
+                    # Créer la ligne pour l'avoir non affecté
+                    resultats.append({
+                        'Date de facture': dates[pos_avoir],
+                        'N° de facture': numeros_piece[pos_avoir],
+                        'N° compte fournisseur': compte_fournisseur,
+                        'Nom du fournisseur': nom_fournisseur,
+                        'Libellé de l\'opération': libelles[pos_avoir],
+                        'Montant de la facture': 0,
+                        'Avoir': montant_avoir_non_affecte,
+                        'Montant facture net': -montant_avoir_non_affecte,
+                        'Date de paiement': dates[remboursements_ce_groupe[0]] if remboursements_ce_groupe else None,
+                        'Montant du paiement': -montant_remboursement if montant_remboursement > 0 else 0,
+                        'OD': 0,
+                        'Montant du paiement groupé': 0,
+                        'Lettrage': lettrage_corrige,
+                        'Lettrage corrigé': '',
+                        'Solde': -montant_avoir_non_affecte + montant_remboursement
+                    })
+
+        groupes_traites.add(key)
+
+    fermer_etape(profil, mesure)
+    mesure = ouvrir_etape(profil, 'reclassements_od_avoirs', len(od_reclassements_par_groupe) + len(groupes_avoirs))
+
+    # Ajouter les reclassements OD lettrés
+    # Ces OD ont MontantFacture > 0 et MontantMvt = 0 (ex: reclassement solde débiteur)
+    # Deux cas :
+    # 1. Si le groupe a des factures → ligne séparée avec OD
+    # 2. Si le groupe N'A PAS de factures mais a des paiements → combiner OD + paiement
+    for key, (debut, fin, _) in od_reclassements_par_groupe.items():
+        compte_fournisseur, lettrage = key
+        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
+        
+        # Vérifier si ce groupe a des factures
+        groupe_a_factures = key in groupes_factures
+        
+        # Récupérer les paiements de ce groupe
+        paiements_groupe = paiements_du_groupe(key)
+        
+        for pos_od in ordre_od_facture[debut:fin].tolist():
+            montant_od_recl = montants_facture[pos_od]
+            
+            if groupe_a_factures:
+                # Cas 1 : groupe avec factures → ligne séparée
+                resultats.append({
+                    'Date de facture': dates[pos_od],
+                    'N° de facture': numeros_piece[pos_od],
+                    'N° compte fournisseur': compte_fournisseur,
+                    'Nom du fournisseur': nom_fournisseur,
+                    'Libellé de l\'opération': libelles[pos_od],
+                    'Montant de la facture': 0,
+                    'Avoir': 0,
+                    'Montant facture net': 0,
+                    'Date de paiement': None,
+                    'Montant du paiement': 0,
+                    'OD': montant_od_recl,
+                    'Montant du paiement groupé': 0,
+                    'Lettrage': lettrages[pos_od],
+                    'Lettrage corrigé': '',
+                    'Solde': montant_od_recl  # Reclassement augmente la dette
+                })
+            elif len(paiements_groupe) > 0:
+                # Cas 2 : groupe SANS factures mais avec paiements → combiner OD + paiement
+                # L'OD crée une dette qui est ensuite payée
+                for paiement in paiements_groupe:
+                    # Calculer la portion de l'OD correspondant à ce paiement (prorata si plusieurs)
+                    total_paiements = sum(p['montant'] for p in paiements_groupe)
+                    ratio = paiement['montant'] / total_paiements if total_paiements > 0 else 1
+                    od_portion = montant_od_recl * ratio
+                    
+                    resultats.append({
+                        'Date de facture': dates[pos_od],
+                        'N° de facture': numeros_piece[pos_od],
+                        'N° compte fournisseur': compte_fournisseur,
+                        'Nom du fournisseur': nom_fournisseur,
+                        'Libellé de l\'opération': libelles[pos_od],
+                        'Montant de la facture': 0,
+                        'Avoir': 0,
+                        'Montant facture net': 0,
+                        'Date de paiement': paiement['date'],
+                        'Montant du paiement': paiement['montant'],
+                        'OD': od_portion,
+                        'Montant du paiement groupé': total_paiements if len(paiements_groupe) > 1 else 0,
+                        'Lettrage': lettrages[pos_od],
+                        'Lettrage corrigé': '',
+                        'Solde': 0  # MF(0) - Paiement + OD = 0 car Paiement = OD
+                    })
+            else:
+                # Cas 3 : groupe SANS factures ET SANS paiements → ligne séparée
+                resultats.append({
+                    'Date de facture': dates[pos_od],
+                    'N° de facture': numeros_piece[pos_od],
+                    'N° compte fournisseur': compte_fournisseur,
+                    'Nom du fournisseur': nom_fournisseur,
+                    'Libellé de l\'opération': libelles[pos_od],
+                    'Montant de la facture': 0,
+                    'Avoir': 0,
+                    'Montant facture net': 0,
+                    'Date de paiement': None,
+                    'Montant du paiement': 0,
+                    'OD': montant_od_recl,
+                    'Montant du paiement groupé': 0,
+                    'Lettrage': lettrages[pos_od],
+                    'Lettrage corrigé': '',
+                    'Solde': montant_od_recl
+                })
+
+    # Ajouter les avoirs lettrés dans des groupes SANS factures
+    # Ces avoirs sont dans des groupes avec remboursements ou OD, mais sans factures
+    # Cas typiques :
+    # 1. Avoir + Remboursement (le fournisseur nous rembourse l'avoir)
+    # 2. Avoir + OD (compensation entre avoir et OD)
+    for key, (debut, fin, total_avoirs_groupe) in groupes_avoirs.items():
+        compte_fournisseur, lettrage = key
+        
+        # Vérifier si ce groupe a des factures (déjà traité)
+        if key in groupes_factures:
+            continue  # Déjà traité avec les factures
+        
+        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
+        
+        # Récupérer les remboursements de ce groupe et leur total
+        remboursements_groupe = tranche(ordre_remboursements, groupes_remboursements, key).tolist()
+        total_remboursements = total_groupe(groupes_remboursements, key)
+        
+        for pos_avoir in ordre_avoirs[debut:fin].tolist():
+            montant_avoir = montants_mvt[pos_avoir]
+            
+            if len(remboursements_groupe) > 0:
+                # Cas 1 : Avoir + Remboursement
+                # Le remboursement "paie" l'avoir (solde = 0)
+                # Trouver le remboursement correspondant (prorata si plusieurs)
+                ratio = montant_avoir / total_avoirs_groupe if total_avoirs_groupe > 0 else 1
+                montant_remboursement = total_remboursements * ratio
+                
+                resultats.append({
+                    'Date de facture': dates[pos_avoir],
+                    'N° de facture': numeros_piece[pos_avoir],
+                    'N° compte fournisseur': compte_fournisseur,
+                    'Nom du fournisseur': nom_fournisseur,
+                    'Libellé de l\'opération': libelles[pos_avoir],
+                    'Montant de la facture': 0,
+                    'Avoir': montant_avoir,
+                    'Montant facture net': -montant_avoir,
+                    'Date de paiement': dates[remboursements_groupe[0]] if remboursements_groupe else None,
+                    'Montant du paiement': -montant_remboursement,  # Négatif car remboursement
+                    'OD': 0,
+                    'Montant du paiement groupé': 0,
+                    'Lettrage': lettrage,
+                    'Lettrage corrigé': '',
+                    'Solde': 0 if abs(montant_avoir - montant_remboursement) < TOLERANCE_CENTIMES else -montant_avoir + montant_remboursement
+                })
+            else:
+                # Cas 2 : Avoir sans remboursement dans le groupe
+                # Vérifier s'il y a une OD qui compense
+                od_groupe = dict_od_brut.get(key, 0)
+                od_recl_total = total_groupe(od_reclassements_par_groupe, key)
+                
+                # NOTE: Les OD de od_reclassements_par_groupe sont déjà traitées séparément
+                # On ne les ajoute PAS ici pour éviter le double comptage
+                # On ajoute uniquement od_groupe (écarts de change MontantMvt > 0)
+                if od_groupe > 0 or od_recl_total > 0:
+                    # Avoir compensé par OD - l'OD reclassement est traitée séparément
+                    # Le Solde ici ne doit PAS inclure l'OD (déjà comptée ailleurs)
+                    resultats.append({
+                        'Date de facture': dates[pos_avoir],
+                        'N° de facture': numeros_piece[pos_avoir],
+                        'N° compte fournisseur': compte_fournisseur,
+                        'Nom du fournisseur': nom_fournisseur,
+                        'Libellé de l\'opération': libelles[pos_avoir],
+                        'Montant de la facture': 0,
+                        'Avoir': montant_avoir,
+                        'Montant facture net': -montant_avoir,
+                        'Date de paiement': None,
+                        'Montant du paiement': 0,
+                        'OD': 0,  # OD reclassement déjà comptée, on met 0 ici
+                        'Montant du paiement groupé': 0,
+                        'Lettrage': lettrage,
+                        'Lettrage corrigé': '',
+                        'Solde': -montant_avoir  # Solde = 0 - Avoir - 0 + 0 = -Avoir
+                    })
+                else:
+                    # Avoir seul (non compensé) - ne devrait pas arriver normalement
+                    resultats.append({
+                        'Date de facture': dates[pos_avoir],
+                        'N° de facture': numeros_piece[pos_avoir],
+                        'N° compte fournisseur': compte_fournisseur,
+                        'Nom du fournisseur': nom_fournisseur,
+                        'Libellé de l\'opération': libelles[pos_avoir],
+                        'Montant de la facture': 0,
+                        'Avoir': montant_avoir,
+                        'Montant facture net': -montant_avoir,
+                        'Date de paiement': None,
+                        'Montant du paiement': 0,
+                        'OD': 0,
+                        'Montant du paiement groupé': 0,
+                        'Lettrage': lettrage,
+                        'Lettrage corrigé': '',
+                        'Solde': -montant_avoir
+                    })
+
+    fermer_etape(profil, mesure)
+    mesure = ouvrir_etape(profil, 'affectation_non_lettres')
+
+    # Ajouter les factures non lettrées à la liste des factures avec solde
+    for pos in positions(masque_factures & ~est_lettre):
+        compte = comptes[pos]
+        nom_fournisseur = dict_fournisseurs.get(compte, "Fournisseur inconnu")
+        factures_solde_restant.append({
+            'position': pos,
+            'compte': compte,
+            'nom_fournisseur': nom_fournisseur,
+            'solde_restant': abs(montants_facture[pos]),
+            'lettrage_original': lettrages[pos],
+            'lettrage_corrige_affiche': '',
+            'od_signe': 0
+        })
+
+    # Trier toutes les factures avec solde par compte puis par date (les plus anciennes d'abord)
+    factures_solde_restant = sorted(
+        factures_solde_restant,
+        key=lambda x: (x['compte'], cle_date(x['position']))
+    )
+
+    # Identifier les paiements non lettrés (tous les mouvements != 0)
+    masque_paiements_non_lettres = masque_paiements & ~est_lettre
+
+    # Trier les paiements non lettrés par date (tri stable : même ordre par lot ou sur tout le Grand Livre)
+    paiements_non_lettres = grand_livre_df['Date'][masque_paiements_non_lettres].sort_values(kind='mergesort').index.tolist()
+
+    # Suivre les affectations ET les montants restants des paiements
+    affectations_paiements = {}  # clé = index dans factures_solde_restant
+    paiements_restants = {}  # clé = (compte, numpiece, date, montant) → montant restant
+
+    # File d'attente des factures par fournisseur (positions dans factures_solde_restant, déjà
+    # triées par date) et curseur sur la première facture non soldée : chaque paiement ne
+    # parcourt que les factures encore ouvertes de son propre fournisseur
+    files_factures_par_compte = {}
+    for idx, fac_info in enumerate(factures_solde_restant):
+        files_factures_par_compte.setdefault(fac_info['compte'], []).append(idx)
+    curseurs_par_compte = dict.fromkeys(files_factures_par_compte, 0)
+
+    # Affecter les paiements non lettrés aux factures avec solde (même fournisseur, plus anciennes d'abord)
+    for pos_paiement in paiements_non_lettres:
+        compte_paiement = comptes[pos_paiement]
+        montant_paiement_initial = abs(montants_mvt[pos_paiement])
+        montant_paiement_restant = montant_paiement_initial
+        paiement_key = (compte_paiement, numeros_piece[pos_paiement], dates[pos_paiement], montants_mvt[pos_paiement])
+
+        file_factures = files_factures_par_compte.get(compte_paiement, [])
+        curseur = curseurs_par_compte.get(compte_paiement, 0)
+
+        while curseur < len(file_factures) and montant_paiement_restant > 0:
+            idx = file_factures[curseur]
+            fac_info = factures_solde_restant[idx]
+            if fac_info['solde_restant'] <= 0:
+                # Facture soldée : elle ne sera plus jamais candidate
+                curseur += 1
+                continue
+
+            montant_a_affecter = min(montant_paiement_restant, fac_info['solde_restant'])
+
+            if idx not in affectations_paiements:
+                affectations_paiements[idx] = []
+            affectations_paiements[idx].append({
+                'position': pos_paiement,
+                'montant_affecte': montant_a_affecter
+            })
+
+            fac_info['solde_restant'] -= montant_a_affecter
+            montant_paiement_restant -= montant_a_affecter
+
+        curseurs_par_compte[compte_paiement] = curseur
+
+        # Stocker le montant restant UNIQUEMENT si le paiement a été PARTIELLEMENT affecté
+        # (pas complètement non affecté)
+        if montant_paiement_restant > TOLERANCE_CENTIMES and montant_paiement_restant < montant_paiement_initial:
+            paiements_restants[paiement_key] = {
+                'position': pos_paiement,
+                'montant_restant': montant_paiement_restant
+            }
+
+    # Générer les lignes de résultat pour les factures avec solde
+    for idx, fac_info in enumerate(factures_solde_restant):
+        pos_facture = fac_info['position']
+        compte_fournisseur = fac_info['compte']
+        nom_fournisseur = fac_info['nom_fournisseur']
+        lettrage_original = fac_info['lettrage_original']
+        lettrage_corrige_affiche = fac_info['lettrage_corrige_affiche']
+        od_signe = fac_info['od_signe']
+
+        if idx in affectations_paiements:
+            # La facture a reçu des paiements non lettrés
+            for aff in affectations_paiements[idx]:
+                pos_paiement = aff['position']
+                montant_paiement = aff['montant_affecte']
+
+                resultats.append({
+                    'Date de facture': dates[pos_facture],
+                    'N° de facture': numeros_piece[pos_facture],
+                    'N° compte fournisseur': compte_fournisseur,
+                    'Nom du fournisseur': nom_fournisseur,
+                    'Libellé de l\'opération': libelles[pos_facture],
+                    'Montant de la facture': montant_paiement,
+                    'Avoir': 0,
+                    'Montant facture net': montant_paiement,
+                    'Date de paiement': dates[pos_paiement],
+                    'Montant du paiement': montant_paiement,
+                    'OD': 0,
+                    'Montant du paiement groupé': 0,
+                    'Lettrage': lettrage_original,
+                    'Lettrage corrigé': lettrage_corrige_affiche,
+                    'Solde': 0
+                })
+
+        # Ajouter une ligne pour le solde restant si > 0
+        if fac_info['solde_restant'] > TOLERANCE_CENTIMES:
+            resultats.append({
+                'Date de facture': dates[pos_facture],
+                'N° de facture': numeros_piece[pos_facture],
+                'N° compte fournisseur': compte_fournisseur,
+                'Nom du fournisseur': nom_fournisseur,
+                'Libellé de l\'opération': libelles[pos_facture],
+                'Montant de la facture': fac_info['solde_restant'],
+                'Avoir': 0,
+                'Montant facture net': fac_info['solde_restant'],
+                'Date de paiement': None,
+                'Montant du paiement': 0,
+                'OD': od_signe,
+                'Montant du paiement groupé': 0,
+                'Lettrage': lettrage_original,
+                'Lettrage corrigé': lettrage_corrige_affiche,
+                'Solde': fac_info['solde_restant'] + od_signe
+            })
+
+    # Ajouter les paiements sans lettrage qui n'ont pas été affectés OU partiellement affectés
+    paiements_sans_lettrage = positions(masque_paiements_non_lettres)
+
+    paiements_deja_affectes = set()
+    for idx, affectations in affectations_paiements.items():
+        for aff in affectations:
+            pos = aff['position']
+            paiements_deja_affectes.add((comptes[pos], numeros_piece[pos], dates[pos], montants_mvt[pos]))
+
+    # 1. Ajouter les paiements qui n'ont PAS DU TOUT été affectés
+    for pos_paiement in paiements_sans_lettrage:
+        compte_fournisseur = comptes[pos_paiement]
+        paiement_key = (compte_fournisseur, numeros_piece[pos_paiement], dates[pos_paiement], montants_mvt[pos_paiement])
+
+        # Si le paiement a été affecté (totalement ou partiellement), on ne l'ajoute pas ici
+        if paiement_key in paiements_deja_affectes:
+            continue
+
+        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
+        montant_mvt = montants_mvt[pos_paiement]
+        montant_paiement = abs(montant_mvt)
+
+        # Solde = -MontantMvt (car paiement diminue la dette)
+        # Si MontantMvt > 0 (avoir/remboursement), solde = -positif = négatif
+        # Si MontantMvt < 0 (paiement), solde = -négatif = positif (erreur car on a payé sans facture)
+        solde_paiement = -montant_mvt
+
+        resultats.append({
+            'Date de facture': None,
+            'N° de facture': '',
+            'N° compte fournisseur': compte_fournisseur,
+            'Nom du fournisseur': nom_fournisseur,
+            'Libellé de l\'opération': libelles[pos_paiement],
+            'Montant de la facture': 0,
+            'Avoir': 0,
+            'Montant facture net': 0,
+            'Date de paiement': dates[pos_paiement],
+            'Montant du paiement': montant_paiement,
+            'OD': 0,
+            'Montant du paiement groupé': 0,
+            'Lettrage': '',
+            'Lettrage corrigé': '',
+            'Solde': solde_paiement
+        })
+
+    # 2. Ajouter les RELIQUATS des paiements partiellement affectés
+    for paiement_key, paiement_info in paiements_restants.items():
+        pos_paiement = paiement_info['position']
+        montant_restant = paiement_info['montant_restant']
+        compte_fournisseur = comptes[pos_paiement]
+        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
+
+        # Solde = -montant_restant (crédit car on a trop payé)
+        solde_reliquat = -montant_restant
+
+        resultats.append({
+            'Date de facture': None,
+            'N° de facture': '',
+            'N° compte fournisseur': compte_fournisseur,
+            'Nom du fournisseur': nom_fournisseur,
+            'Libellé de l\'opération': libelles[pos_paiement] + ' (reliquat)',
+            'Montant de la facture': 0,
+            'Avoir': 0,
+            'Montant facture net': 0,
+            'Date de paiement': dates[pos_paiement],
+            'Montant du paiement': montant_restant,
+            'OD': 0,
+            'Montant du paiement groupé': 0,
+            'Lettrage': '',
+            'Lettrage corrigé': '',
+            'Solde': solde_reliquat
+        })
+
+    fermer_etape(profil, mesure, len(paiements_non_lettres))
+    mesure = ouvrir_etape(profil, 'lignes_non_lettrees')
+
+    # Ajouter les OD non lettrés (journaux autres que achat/banque, sans lettrage)
+    od_non_lettres = positions((
+        (type_ligne == 'od_non_lettree') &
+        ((grand_livre_df['MontantFacture'] != 0) | (grand_livre_df['MontantMvt'] != 0))
+    ).to_numpy())
+
+    for pos_od in od_non_lettres:
+        compte_fournisseur = comptes[pos_od]
+        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
+        
+        # OD = MontantFacture - MontantMvt (ColG - ColF)
+        montant_od = montants_facture[pos_od] - montants_mvt[pos_od]
+
+        resultats.append({
+            'Date de facture': dates[pos_od],
+            'N° de facture': numeros_piece[pos_od],
+            'N° compte fournisseur': compte_fournisseur,
+            'Nom du fournisseur': nom_fournisseur,
+            'Libellé de l\'opération': libelles[pos_od],
+            'Montant de la facture': 0,
+            'Avoir': 0,
+            'Montant facture net': 0,
+            'Date de paiement': None,
+            'Montant du paiement': 0,
+            'OD': montant_od,
+            'Montant du paiement groupé': 0,
+            'Lettrage': '',
+            'Lettrage corrigé': '',
+            'Solde': montant_od
+        })
+
+    # Ajouter les avoirs non lettrés (sans lettrage)
+    for pos_avoir in avoirs_non_lettres:
+        compte_fournisseur = comptes[pos_avoir]
+        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
+        montant_avoir = montants_mvt[pos_avoir]
+        
+        resultats.append({
+            'Date de facture': None,
+            'N° de facture': numeros_piece[pos_avoir],
+            'N° compte fournisseur': compte_fournisseur,
+            'Nom du fournisseur': nom_fournisseur,
+            'Libellé de l\'opération': libelles[pos_avoir],
+            'Montant de la facture': 0,
+            'Avoir': montant_avoir,
+            'Montant facture net': -montant_avoir,
+            'Date de paiement': dates[pos_avoir],
+            'Montant du paiement': 0,
+            'OD': 0,
+            'Montant du paiement groupé': 0,
+            'Lettrage': '',
+            'Lettrage corrigé': '',
+            'Solde': -montant_avoir
+        })
+
+    # Ajouter les remboursements fournisseurs non lettrés
+    for pos_remb in remboursements_non_lettres:
+        compte_fournisseur = comptes[pos_remb]
+        nom_fournisseur = dict_fournisseurs.get(compte_fournisseur, "Fournisseur inconnu")
+        montant_remboursement = montants_facture[pos_remb]
+        
+        resultats.append({
+            'Date de facture': None,
+            'N° de facture': numeros_piece[pos_remb],
+            'N° compte fournisseur': compte_fournisseur,
+            'Nom du fournisseur': nom_fournisseur,
+            'Libellé de l\'opération': libelles[pos_remb],
+            'Montant de la facture': 0,
+            'Avoir': 0,
+            'Montant facture net': 0,
+            'Date de paiement': dates[pos_remb],
+            'Montant du paiement': -montant_remboursement,  # Négatif car nous remboursons
+            'OD': 0,
+            'Montant du paiement groupé': 0,
+            'Lettrage': '',
+            'Lettrage corrigé': '',
+            'Solde': montant_remboursement  # Positif car dette envers le fournisseur
+        })
+
+    fermer_etape(profil, mesure, len(od_non_lettres) + len(avoirs_non_lettres) + len(remboursements_non_lettres))
+
+    with etape(profil, 'construction_resultats', len(resultats)):
+        return resultats_en_dirhams(pd.DataFrame(resultats))
+
+def resultats_en_dirhams(df_resultats):
+    """Convertir les colonnes montants des lignes de résultat de centimes en dirhams"""
+    if len(df_resultats) > 0:
+        df_resultats[COLONNES_MONTANTS_RESULTAT] = df_resultats[COLONNES_MONTANTS_RESULTAT].astype(float) / 100
+    return df_resultats
+
+def finaliser_resultats(df_resultats):
+    """Typer et trier les lignes de résultat (par fournisseur puis date de facture)"""
+    for col in ['Date de facture', 'Date de paiement']:
+        if col in df_resultats.columns:
+            df_resultats[col] = pd.to_datetime(df_resultats[col], errors='coerce')
+
+    if len(df_resultats) > 0:
+        df_resultats = df_resultats.sort_values(
+            by=['N° compte fournisseur', 'Date de facture'],
+            ascending=[True, True],
+            na_position='last'
+        ).reset_index(drop=True)
+
+        df_resultats['N° de facture'] = df_resultats['N° de facture'].astype(str)
+        df_resultats['N° compte fournisseur'] = df_resultats['N° compte fournisseur'].astype(str)
+        df_resultats['Nom du fournisseur'] = df_resultats['Nom du fournisseur'].astype(str)
+        df_resultats['Libellé de l\'opération'] = df_resultats['Libellé de l\'opération'].astype(str)
+        df_resultats['Lettrage'] = df_resultats['Lettrage'].astype(str)
+        df_resultats['Lettrage corrigé'] = df_resultats['Lettrage corrigé'].astype(str)
+
+    return df_resultats
+
+def verifier_solde(grand_livre_df, df_resultats):
+    """
+    Contrôle du rapprochement : le solde des lignes de résultat doit égaler le solde
+    des comptes 4411 du Grand Livre (colonne G - colonne F). Montants en dirhams.
+    """
+    lignes_4411 = grand_livre_df[grand_livre_df['Compte'].astype(str).str.startswith('4411')]
+    # Montants du Grand Livre en centimes : totaux exacts, convertis en dirhams
+    total_g = int(lignes_4411['MontantFacture'].sum())
+    total_f = int(lignes_4411['MontantMvt'].sum())
+    solde_attendu = (total_g - total_f) / 100
+    solde_calcule = float(df_resultats['Solde'].sum()) if len(df_resultats) > 0 else 0.0
+    ecart = abs(solde_calcule - solde_attendu)
+    return {
+        'total_g': total_g / 100,
+        'total_f': total_f / 100,
+        'solde_attendu': solde_attendu,
+        'solde_calcule': solde_calcule,
+        'ecart': ecart,
+        'conforme': ecart < 0.01
+    }
+
+def ecarts_par_fournisseur(grand_livre_df, df_resultats, dict_fournisseurs=None):
+    """
+    Contrôle du solde fournisseur par fournisseur : solde des lignes 4411 du Grand Livre
+    (colonne G - colonne F) et solde des lignes de résultat, par N° de compte. Les
+    fournisseurs présents d'un seul côté ont un solde nul de l'autre. Montants en dirhams,
+    comparés en centimes ; fournisseurs triés par écart absolu décroissant.
+    """
+    colonnes = ['N° compte fournisseur', 'Nom du fournisseur', 'Solde Grand Livre (G - F)',
+                'Solde calculé', 'Écart']
+    lignes_4411 = grand_livre_df[grand_livre_df['Compte'].astype(str).str.startswith('4411')]
+    solde_gl = ((lignes_4411['MontantFacture'] - lignes_4411['MontantMvt']).astype('int64')
+                .groupby(lignes_4411['Compte'].astype(str)).sum())
+    if len(df_resultats) > 0:
+        solde_resultats = ((df_resultats['Solde'].to_numpy(dtype=float) * 100).round().astype('int64'))
+        solde_resultats = pd.Series(solde_resultats, index=df_resultats.index).groupby(
+            df_resultats['N° compte fournisseur'].astype(str)).sum()
+        noms = df_resultats.groupby('N° compte fournisseur', sort=False)['Nom du fournisseur'].first()
+    else:
+        solde_resultats = pd.Series(dtype='int64')
+        noms = pd.Series(dtype=object)
+
+    ecarts = pd.DataFrame({'attendu': solde_gl, 'calcule': solde_resultats}).fillna(0).astype('int64')
+    if len(ecarts) == 0:
+        return pd.DataFrame(columns=colonnes)
+    ecarts['ecart'] = ecarts['calcule'] - ecarts['attendu']
+    ecarts = ecarts.rename_axis('N° compte fournisseur').reset_index()
+    ecarts['ecart_absolu'] = ecarts['ecart'].abs()
+    ecarts = ecarts.sort_values(['ecart_absolu', 'N° compte fournisseur'], ascending=[False, True],
+                                kind='mergesort').reset_index(drop=True)
+
+    noms_connus = noms.to_dict()
+    if dict_fournisseurs:
+        noms_connus = {**dict_fournisseurs, **noms_connus}
+    return pd.DataFrame({
+        'N° compte fournisseur': ecarts['N° compte fournisseur'],
+        'Nom du fournisseur': ecarts['N° compte fournisseur'].map(noms_connus).fillna(''),
+        'Solde Grand Livre (G - F)': ecarts['attendu'] / 100,
+        'Solde calculé': ecarts['calcule'] / 100,
+        'Écart': ecarts['ecart'] / 100
+    })[colonnes]
+
+def partitionner_par_fournisseur(grand_livre_df, dict_paiements_effet, nb_lots):
+    """
+    Découper les lignes 4411 en lots de comptes fournisseurs complets, de tailles
+    comparables (en nombre de lignes). Retourne [(lignes du lot, effets du lot)].
+    """
+    lignes_4411 = grand_livre_df[grand_livre_df['is_4411']]
+    if len(lignes_4411) == 0:
+        return []
+
+    # Comptes triés, numéro de lot selon la position cumulée des lignes
+    nb_lignes_par_compte = lignes_4411.groupby('Compte', sort=True, observed=True).size()
+    debut_compte = nb_lignes_par_compte.cumsum() - nb_lignes_par_compte
+    lot_par_compte = (debut_compte * nb_lots) // len(lignes_4411)
+
+    lots = []
+    for _, lignes_lot in lignes_4411.groupby(lignes_4411['Compte'].map(lot_par_compte), sort=True, observed=True):
+        comptes_lot = set(lignes_lot['Compte'].unique())
+        effets_lot = {key: effet for key, effet in dict_paiements_effet.items() if key[0] in comptes_lot}
+        lots.append((lignes_lot, effets_lot))
+    return lots
+
+def rapprocher_lot(lignes_lot, dict_fournisseurs, effets_lot, avec_profil):
+    """Rapprochement d'un lot (processus du pool). Retourne (lignes de résultat, étapes mesurées)"""
+    profil = nouveau_profil() if avec_profil else None
+    df_resultats = rapprocher_fournisseurs(lignes_lot, dict_fournisseurs, effets_lot, profil)
+    return df_resultats, profil['etapes'] if profil is not None else []
+
+def contexte_processus(methode_demarrage=None):
+    """
+    Contexte multiprocessing du pool. Par défaut fork quand il est disponible (batch,
+    benchmarks : processus à un seul fil ; en "spawn", chaque processus réexécuterait le
+    module __main__). Un processus multi-fil, comme le serveur Streamlit, demande
+    'forkserver' : un fork y hériterait des verrous tenus par les autres fils. Le serveur
+    de processus importe alors ce module une fois, les processus en sont des copies.
+    """
+    methodes = multiprocessing.get_all_start_methods()
+    if methode_demarrage is None:
+        methode_demarrage = 'fork' if 'fork' in methodes else 'spawn'
+    elif methode_demarrage not in methodes:
+        methode_demarrage = 'spawn'
+    contexte = multiprocessing.get_context(methode_demarrage)
+    if methode_demarrage == 'forkserver':
+        contexte.set_forkserver_preload([__name__])
+    return contexte
+
+def rapprocher_en_parallele(grand_livre_df, dict_fournisseurs, dict_paiements_effet, nb_processus, profil=None,
+                            methode_demarrage=None):
+    """
+    Rapprocher les lots de fournisseurs sur un pool de processus (démarrés selon
+    `methode_demarrage`, voir contexte_processus).
+    Les étapes mesurées dans les lots sont cumulées (durées additionnées sur les processus).
+    """
+    # Plusieurs lots par processus pour lisser les écarts de taille entre fournisseurs
+    lots = partitionner_par_fournisseur(grand_livre_df, dict_paiements_effet, nb_processus * LOTS_PAR_PROCESSUS)
+    if len(lots) <= 1:
+        return rapprocher_fournisseurs(grand_livre_df, dict_fournisseurs, dict_paiements_effet, profil)
+
+    with ProcessPoolExecutor(max_workers=min(nb_processus, len(lots)),
+                             mp_context=contexte_processus(methode_demarrage)) as executor:
+        futures = [
+            executor.submit(rapprocher_lot, lignes_lot, dict_fournisseurs, effets_lot, profil is not None)
+            for lignes_lot, effets_lot in lots
+        ]
+        resultats_lots = [future.result() for future in futures]
+
+    ajouter_etapes(profil, cumuler_etapes(etapes for _, etapes in resultats_lots))
+    return pd.concat([df for df, _ in resultats_lots], ignore_index=True)
+
+def rapprocher(grand_livre_df, dict_fournisseurs, dict_paiements_effet, nb_processus=1, profil=None,
+               methode_demarrage=None):
+    """Rapprochement d'un Grand Livre préparé, séquentiel ou parallèle"""
+    if nb_processus > 1:
+        return rapprocher_en_parallele(grand_livre_df, dict_fournisseurs, dict_paiements_effet, nb_processus, profil,
+                                       methode_demarrage)
+    return rapprocher_fournisseurs(grand_livre_df, dict_fournisseurs, dict_paiements_effet, profil)
+
+def traiter_rapprochement(grand_livre_df, dict_fournisseurs, journaux_achat, journaux_banque, nb_processus=1,
+                          profil=None, methode_demarrage=None):
+    with etape(profil, 'preparation', len(grand_livre_df)):
+        grand_livre_df, dict_paiements_effet = preparer_grand_livre(
+            grand_livre_df, journaux_achat, journaux_banque, profil)
+    with etape(profil, 'rapprochement') as mesure:
+        df_resultats = rapprocher(grand_livre_df, dict_fournisseurs, dict_paiements_effet, nb_processus, profil,
+                                  methode_demarrage)
+        mesure['lignes'] = len(df_resultats)
+    with etape(profil, 'finalisation', len(df_resultats)):
+        return finaliser_resultats(df_resultats)
+
+def calculer_empreintes_comptes(grand_livre_df, dict_fournisseurs, dict_paiements_effet):
+    """
+    Empreinte de chaque compte fournisseur 4411 : ses lignes préparées (dans l'ordre
+    du Grand Livre), ses effets 4415 et son nom. Deux comptes de même empreinte
+    produisent exactement les mêmes lignes de résultat.
+    """
+    lignes_4411 = grand_livre_df[grand_livre_df['is_4411']]
+    hash_lignes = pd.util.hash_pandas_object(lignes_4411[COLONNES_EMPREINTE], index=False).to_numpy()
+
+    effets_par_compte = {}
+    for (compte, lettrage), effet in dict_paiements_effet.items():
+        effets_par_compte.setdefault(compte, []).append(
+            (lettrage, str(effet['date_paiement']), effet['montant'], str(effet['date_effet'])))
+
+    empreintes = {}
+    for compte, positions in lignes_4411.groupby('Compte', sort=False, observed=True).indices.items():
+        empreinte = hashlib.sha256(hash_lignes[positions].tobytes())
+        empreinte.update(repr(sorted(effets_par_compte.get(compte, []))).encode('utf-8'))
+        empreinte.update(str(dict_fournisseurs.get(compte, '')).encode('utf-8'))
+        empreintes[compte] = empreinte.hexdigest()
+    return empreintes
+
+def traiter_rapprochement_incremental(grand_livre_df, dict_fournisseurs, journaux_achat, journaux_banque,
+                                      etat_precedent=None, nb_processus=1, profil=None, methode_demarrage=None):
+    """
+    Rapprochement incrémental : seuls les comptes fournisseurs dont les lignes, les
+    effets ou le nom ont changé depuis etat_precedent sont recalculés ; les lignes
+    de résultat des autres comptes sont reprises telles quelles.
+
+    L'unité de recalcul est le compte (et non le groupe de lettrage) : l'affectation
+    des paiements non lettrés dépend des soldes laissés par tous les groupes du compte.
+
+    Retourne (df_resultats, etat, stats) ; etat est à conserver pour le prochain appel.
+    """
+    with etape(profil, 'preparation', len(grand_livre_df)):
+        grand_livre_df, dict_paiements_effet = preparer_grand_livre(
+            grand_livre_df, journaux_achat, journaux_banque, profil)
+    with etape(profil, 'empreintes_comptes') as mesure:
+        empreintes = calculer_empreintes_comptes(grand_livre_df, dict_fournisseurs, dict_paiements_effet)
+        mesure['lignes'] = len(empreintes)
+
+    parametres = {
+        'version': VERSION_MOTEUR,
+        'journaux_achat': list(journaux_achat),
+        'journaux_banque': list(journaux_banque)
+    }
+
+    if etat_precedent is not None and etat_precedent.get('parametres') == parametres:
+        empreintes_precedentes = etat_precedent['empreintes']
+        comptes_a_recalculer = {
+            compte for compte, empreinte in empreintes.items()
+            if empreintes_precedentes.get(compte) != empreinte
+        }
+        resultats_precedents = etat_precedent['resultats']
+        comptes_repris = set(empreintes) - comptes_a_recalculer
+        resultats_repris = resultats_precedents[
+            resultats_precedents['N° compte fournisseur'].isin(comptes_repris)
+        ]
+    else:
+        comptes_a_recalculer = set(empreintes)
+        resultats_repris = None
+
+    lignes_a_recalculer = grand_livre_df[
+        grand_livre_df['is_4411'] & grand_livre_df['Compte'].isin(comptes_a_recalculer)
+    ]
+    effets_a_recalculer = {
+        key: effet for key, effet in dict_paiements_effet.items() if key[0] in comptes_a_recalculer
+    }
+    with etape(profil, 'rapprochement') as mesure:
+        df_resultats = rapprocher(lignes_a_recalculer, dict_fournisseurs, effets_a_recalculer, nb_processus, profil,
+                                  methode_demarrage)
+        mesure['lignes'] = len(df_resultats)
+
+    with etape(profil, 'finalisation') as mesure:
+        if resultats_repris is not None and len(resultats_repris) > 0:
+            if len(df_resultats) > 0:
+                df_resultats = pd.concat([resultats_repris, df_resultats], ignore_index=True)
+            else:
+                df_resultats = resultats_repris.copy()
+        df_resultats = finaliser_resultats(df_resultats)
+        mesure['lignes'] = len(df_resultats)
+
+    etat = {
+        'parametres': parametres,
+        'empreintes': empreintes,
+        'resultats': df_resultats
+    }
+    stats = {
+        'comptes_total': len(empreintes),
+        'comptes_recalcules': len(comptes_a_recalculer),
+        'lignes_recalculees': len(lignes_a_recalculer)
+    }
+    return df_resultats, etat, stats
@@ -0,0 +1,49 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from cache_fichiers import dossiers_recents, enregistrer_fichier, lire_fichier, lire_index
+
+def test_meme_fichier_dans_deux_dossiers(tmp_path):
+    cache = str(tmp_path)
+    empreinte, _, _ = enregistrer_fichier(cache, b'grand livre', 'gl.xlsx', 'grand_livre', 'Client A')
+    enregistrer_fichier(cache, b'balance', 'bal.xlsx', 'balance', 'Client A')
+    _, _, deja_associe = enregistrer_fichier(cache, b'grand livre', 'gl.xlsx', 'grand_livre', 'Client B')
+
+    dossiers = {dossier['dossier']: dossier for dossier in dossiers_recents(lire_index(cache))}
+    assert not deja_associe
+    assert dossiers['Client A']['grand_livre'] == empreinte
+    assert dossiers['Client B']['grand_livre'] == empreinte
+    assert dossiers['Client B']['balance'] is None
+    assert lire_fichier(cache, empreinte) == b'grand livre'
+
+def test_changement_de_nom_du_dossier(tmp_path):
+    cache = str(tmp_path)
+    empreinte, _, _ = enregistrer_fichier(cache, b'grand livre', 'gl.xlsx', 'grand_livre', 'gl')
+    enregistrer_fichier(cache, b'grand livre', 'gl.xlsx', 'grand_livre', 'Client A',
+                        empreinte=empreinte, retirer_dossier='gl')
+
+    assert [dossier['dossier'] for dossier in dossiers_recents(lire_index(cache))] == ['Client A']
+
+def test_enregistrements_concurrents(tmp_path):
+    cache = str(tmp_path)
+    contenus = [f'fichier {i}'.encode() * 1000 for i in range(40)]
+    with ThreadPoolExecutor(max_workers=8) as executeur:
+        empreintes = list(executeur.map(
+            lambda i: enregistrer_fichier(cache, contenus[i], 'gl.xlsx', 'grand_livre', f'Client {i % 5}')[0],
+            range(len(contenus))))
+
+    index = lire_index(cache)
+    assert set(index) == set(empreintes)
+    assert not [nom for nom in os.listdir(cache) if nom.endswith('.tmp')]
+    for empreinte, contenu in zip(empreintes, contenus):
+        assert lire_fichier(cache, empreinte) == contenu
+
+def test_eviction_des_moins_recemment_utilises(tmp_path):
+    cache = str(tmp_path)
+    ancien, _, _ = enregistrer_fichier(cache, b'a' * 600, 'gl.xlsx', 'grand_livre', 'A', taille_max=1000)
+    recent, _, _ = enregistrer_fichier(cache, b'b' * 300, 'bal.xlsx', 'balance', 'A', taille_max=1000)
+    lire_fichier(cache, ancien)
+    nouveau, evinces, _ = enregistrer_fichier(cache, b'c' * 300, 'gl.xlsx', 'grand_livre', 'B', taille_max=1000)
+
+    assert evinces == [recent]
+    assert set(lire_index(cache)) == {ancien, nouveau}
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+from chargement import (categorie_nettoyee, grand_livre_en_dirhams, normaliser_dates, normaliser_grand_livre,
+                        numero_en_texte)
+
+def test_numeros_de_serie_excel_en_texte():
+    dates, non_reconnues = normaliser_dates(pd.Series(['45292', '45293.0', '', None], dtype=object))
+
+    assert dates.tolist()[:2] == [pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-02')]
+    assert dates[2:].isna().all()
+    assert non_reconnues == 0
+
+def test_textes_et_numeros_de_serie_melanges():
+    dates, non_reconnues = normaliser_dates(pd.Series(['15/01/2024', '45292', 45293, 'xx'], dtype=object))
+
+    assert dates.tolist()[:3] == [pd.Timestamp('2024-01-15'), pd.Timestamp('2024-01-01'),
+                                  pd.Timestamp('2024-01-02')]
+    assert non_reconnues == 1
+
+def test_apercu_du_grand_livre_en_dirhams():
+    brut = pd.DataFrame([[pd.Timestamp('2024-01-15'), 'ACH', '44110001', 'F1', 'Facture', 0, 74630.31, None, 'A'],
+                         [pd.Timestamp('2024-02-15'), 'BNQ', '44110001', 'P1', 'Paiement', '74630.31', 0, None, 'A']])
+    grand_livre_df, _ = normaliser_grand_livre(brut)
+
+    assert grand_livre_df['MontantFacture'].tolist() == [7463031, 0]
+    apercu = grand_livre_en_dirhams(grand_livre_df)
+    assert apercu['MontantFacture'].tolist() == [74630.31, 0.0]
+    assert apercu['MontantMvt'].tolist() == [0.0, 74630.31]
+    assert grand_livre_df['MontantFacture'].tolist() == [7463031, 0]
+
+def test_comptes_en_categories_nettoyees():
+    comptes = pd.Series([44110000, '44110000 ', 44110001.0, None, np.nan, '44110001'], dtype=object)
+    categories = categorie_nettoyee(comptes, numero_en_texte)
+
+    # Même compte lu en nombre et en texte : une seule catégorie ; cellules vides -> ''
+    assert list(categories) == numero_en_texte(comptes).tolist()
+    assert list(categories.categories) == ['', '44110000', '44110001']
+
+def test_colonnes_du_grand_livre_en_categories():
+    brut = pd.DataFrame([[pd.Timestamp('2024-01-15'), ' ACH', 44110001, 'F1', 'Facture', 0, 100, None, 'A'],
+                         [pd.Timestamp('2024-02-15'), 'BNQ', '44110001', 'P1', 'Paiement', 100, 0, None, None]])
+    grand_livre_df, _ = normaliser_grand_livre(brut)
+
+    for colonne in ('Journal', 'Compte', 'Lettrage'):
+        assert isinstance(grand_livre_df[colonne].dtype, pd.CategoricalDtype)
+    assert grand_livre_df['Journal'].tolist() == ['ACH', 'BNQ']
+    assert grand_livre_df['Compte'].tolist() == ['44110001', '44110001']
+    assert grand_livre_df['Lettrage'].tolist() == ['A', '']
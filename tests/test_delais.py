@@ -0,0 +1,49 @@
+import pandas as pd
+
+from delais import calculer_delais, date_cloture_par_defaut, synthese_par_fournisseur
+
+def ligne(numero, date_facture, montant_facture, date_paiement, montant_paiement, solde, avoir=0.0):
+    return {
+        'Date de facture': pd.Timestamp(date_facture) if date_facture else pd.NaT,
+        'N° de facture': numero,
+        'N° compte fournisseur': '44110001',
+        'Nom du fournisseur': 'Fournisseur 1',
+        'Montant de la facture': montant_facture,
+        'Avoir': avoir,
+        'Date de paiement': pd.Timestamp(date_paiement) if date_paiement else pd.NaT,
+        'Montant du paiement': montant_paiement,
+        'Solde': solde,
+    }
+
+def resultats_avec_avoir_et_remboursement():
+    return pd.DataFrame([
+        # Facture réglée en deux paiements, le second en retard
+        ligne('F1', '2024-01-10', 300.0, '2024-02-10', 300.0, 0.0),
+        ligne('F1', '2024-01-10', 500.0, '2024-05-10', 500.0, 0.0),
+        # Avoir remboursé 153 jours après sa date, daté après la dernière facture
+        ligne('AV1', '2025-01-05', 0.0, '2025-06-07', -200.0, 0.0, avoir=200.0),
+        # Remboursement sans facture
+        ligne('', None, 0.0, '2024-03-01', -50.0, 50.0),
+    ])
+
+def test_avoir_et_remboursement_sans_delai():
+    resultats = calculer_delais(resultats_avec_avoir_et_remboursement(), 60, pd.Timestamp('2024-12-31'))
+
+    assert resultats['Délai (jours)'].tolist()[:2] == [31, 121]
+    assert resultats['Montant en retard'].tolist() == [0.0, 500.0, 0.0, 0.0]
+    for i in (2, 3):
+        assert pd.isna(resultats['Délai (jours)'].iloc[i])
+        assert pd.isna(resultats['Jours de retard'].iloc[i])
+        assert resultats['Tranche de retard'].iloc[i] == ''
+
+def test_synthese_compte_les_factures_une_fois():
+    synthese = synthese_par_fournisseur(
+        calculer_delais(resultats_avec_avoir_et_remboursement(), 60, pd.Timestamp('2024-12-31')))
+
+    assert len(synthese) == 1
+    assert synthese.loc[0, 'Factures'] == 1
+    assert synthese.loc[0, 'Factures en retard'] == 1
+    assert synthese.loc[0, 'Montant en retard'] == 500.0
+
+def test_date_cloture_sur_les_factures_seules():
+    assert date_cloture_par_defaut(resultats_avec_avoir_et_remboursement()) == pd.Timestamp('2024-12-31')
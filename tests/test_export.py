@@ -0,0 +1,23 @@
+from decimal import Decimal
+
+import openpyxl
+import pandas as pd
+
+from export import exporter, table_parquet
+
+def test_total_excel_au_centime():
+    df = pd.DataFrame({
+        'Date de facture': pd.to_datetime(['2024-01-01'] * 3),
+        'Montant de la facture': [0.1, 0.2, 46944454.19],
+    })
+    assert df['Montant de la facture'].sum() != 46944454.49
+
+    feuille = openpyxl.load_workbook(exporter(df, 'excel')).active
+    assert feuille['A2'].value == 'TOTAL'
+    assert feuille['B2'].value == 46944454.49
+
+def test_montants_parquet_arrondis_au_centime():
+    # Ligne au prorata : fraction de centime
+    df = pd.DataFrame({'OD': [-53.891751865156124, 12.5, None]})
+
+    assert table_parquet(df).column('OD').to_pylist() == [Decimal('-53.89'), Decimal('12.50'), None]
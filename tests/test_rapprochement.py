@@ -0,0 +1,187 @@
+import os
+import random
+
+import numpy as np
+import pandas as pd
+
+from chargement import normaliser_grand_livre
+from rapprochement import (grouper_par_lettrage, index_par_montant, partitionner_par_fournisseur, preparer_grand_livre,
+                           prendre_plus_proche, traiter_rapprochement, traiter_rapprochement_incremental)
+
+JOURNAUX_ACHAT = ['ACH']
+JOURNAUX_BANQUE = ['BNQ']
+DONNEES = os.path.join(os.path.dirname(__file__), 'donnees')
+MONTANTS = ['Montant de la facture', 'Avoir', 'Montant facture net', 'Montant du paiement', 'OD',
+            'Montant du paiement groupé', 'Solde']
+
+def ecriture(date, journal, montant_mvt, montant_facture, lettrage, piece, compte='44110001'):
+    """Ligne brute du Grand Livre (colonnes A à I de l'export)"""
+    return [pd.Timestamp(date), journal, compte, piece, journal, montant_mvt, montant_facture, None, lettrage]
+
+def rapprocher(ecritures, dict_fournisseurs=None):
+    grand_livre_df, _ = normaliser_grand_livre(pd.DataFrame(ecritures))
+    return traiter_rapprochement(grand_livre_df, dict_fournisseurs or {'44110001': 'Fournisseur 1'},
+                                 JOURNAUX_ACHAT, JOURNAUX_BANQUE)
+
+def grand_livre_genere(sans_lignes=()):
+    """Grand Livre généré (8 fournisseurs : avoirs, OD, effets, remboursements, non lettrés)"""
+    brut = pd.read_csv(os.path.join(DONNEES, 'grand_livre.csv'), header=None, parse_dates=[0])
+    return normaliser_grand_livre(brut.drop(list(sans_lignes)))[0]
+
+def fournisseurs_generes():
+    return {str(44110000 + i): f"Fournisseur {i}" for i in range(8)}
+
+def en_texte(serie):
+    return serie.astype(object).where(serie.notna(), '').astype(str)
+
+def assert_resultats_identiques(resultats, reference):
+    assert list(resultats.columns) == list(reference.columns)
+    assert len(resultats) == len(reference)
+    for colonne in reference.columns:
+        if colonne in MONTANTS:
+            assert np.allclose(resultats[colonne].astype(float), reference[colonne].astype(float), atol=0.005), colonne
+        elif colonne.startswith('Date'):
+            assert en_texte(resultats[colonne].dt.strftime('%Y-%m-%d')).tolist() == en_texte(reference[colonne]).tolist(), colonne
+        else:
+            assert en_texte(resultats[colonne]).tolist() == en_texte(reference[colonne]).tolist(), colonne
+
+def test_resultats_identiques_au_moteur_d_origine():
+    # Référence : sortie du moteur avant les réécritures (montants en flottants), même Grand Livre
+    reference = pd.read_csv(os.path.join(DONNEES, 'rapprochement_reference.csv'), dtype=str)
+    resultats = traiter_rapprochement(grand_livre_genere(), fournisseurs_generes(), JOURNAUX_ACHAT, JOURNAUX_BANQUE)
+
+    assert_resultats_identiques(resultats, reference)
+
+def test_reclassements_od_sans_facture_associes_a_tous_les_paiements():
+    resultats = rapprocher([
+        ecriture('2024-03-01', 'OD', 0, 100, 'A', 'OD1'),
+        ecriture('2024-03-02', 'OD', 0, 50, 'A', 'OD2'),
+        ecriture('2024-03-10', 'BNQ', 60, 0, 'A', 'P1'),
+        ecriture('2024-03-20', 'BNQ', 90, 0, 'A', 'P2'),
+    ])
+
+    # Chaque OD du groupe est combinée avec chacun des paiements
+    assert resultats['N° de facture'].tolist() == ['OD1', 'OD1', 'OD2', 'OD2']
+    assert resultats['Montant du paiement'].tolist() == [60.0, 90.0, 60.0, 90.0]
+    assert resultats['Montant du paiement groupé'].tolist() == [150.0] * 4
+    assert (resultats['Solde'] == 0).all()
+
+def test_date_de_paiement_des_effets_4415():
+    ecritures = [
+        ecriture('2024-01-10', 'ACH', 0, 100, 'A', 'F1'),
+        ecriture('2024-02-01', 'EFF', 100, 0, 'A', 'E1'),
+        ecriture('2024-02-01', 'EFF', 0, 100, 'E', 'E1', compte='44150001'),
+        ecriture('2024-04-30', 'BNQ', 100, 0, 'E', 'P1', compte='44150001'),
+        # Effet pas encore payé : pas de date de paiement
+        ecriture('2024-01-20', 'ACH', 0, 70, 'B', 'F2'),
+        ecriture('2024-02-05', 'EFF', 70, 0, 'B', 'E2'),
+        ecriture('2024-02-05', 'EFF', 0, 70, 'G', 'E2', compte='44150001'),
+    ]
+    grand_livre_df, _ = normaliser_grand_livre(pd.DataFrame(ecritures))
+    _, dict_paiements_effet = preparer_grand_livre(grand_livre_df, JOURNAUX_ACHAT, JOURNAUX_BANQUE)
+
+    assert dict_paiements_effet == {('44110001', 'A'): {
+        'date_paiement': pd.Timestamp('2024-04-30'), 'montant': 10000, 'date_effet': pd.Timestamp('2024-02-01')}}
+    resultats = rapprocher(ecritures)
+    assert resultats['Date de paiement'].iloc[0] == pd.Timestamp('2024-04-30')
+    assert resultats['Montant du paiement'].tolist() == [100.0, 0.0]
+    assert pd.isna(resultats['Date de paiement'].iloc[1])
+
+def test_paiements_non_lettres_affectes_aux_factures_les_plus_anciennes():
+    resultats = rapprocher([
+        ecriture('2024-02-10', 'ACH', 0, 50, '', 'F2'),
+        ecriture('2024-01-10', 'ACH', 0, 100, '', 'F1'),
+        ecriture('2024-01-05', 'ACH', 0, 80, '', 'F3', compte='44110002'),
+        ecriture('2024-03-01', 'BNQ', 120, 0, '', 'P1'),
+        ecriture('2024-03-15', 'BNQ', 40, 0, '', 'P2'),
+    ], {'44110001': 'Fournisseur 1', '44110002': 'Fournisseur 2'})
+
+    # P1 solde F1 puis entame F2, P2 termine F2 ; l'excédent de P2 reste sans facture.
+    # La facture F3, plus ancienne mais d'un autre fournisseur, n'est pas touchée.
+    assert resultats['N° de facture'].tolist() == ['F1', 'F2', 'F2', '', 'F3']
+    assert resultats['Date de paiement'].tolist()[:4] == [pd.Timestamp(date) for date in
+                                                          ['2024-03-01', '2024-03-01', '2024-03-15', '2024-03-15']]
+    assert resultats['Montant du paiement'].tolist() == [100.0, 20.0, 30.0, 10.0, 0.0]
+    assert resultats['Solde'].tolist() == [0.0, 0.0, 0.0, -10.0, 80.0]
+
+def test_lots_de_comptes_complets():
+    grand_livre_df, dict_paiements_effet = preparer_grand_livre(grand_livre_genere(), JOURNAUX_ACHAT, JOURNAUX_BANQUE)
+    lots = partitionner_par_fournisseur(grand_livre_df, dict_paiements_effet, 3)
+
+    comptes_par_lot = [set(lignes_lot['Compte']) for lignes_lot, _ in lots]
+    assert len(lots) == 3
+    assert sum(len(comptes) for comptes in comptes_par_lot) == len(set().union(*comptes_par_lot)) == 8
+    assert sum(len(lignes_lot) for lignes_lot, _ in lots) == grand_livre_df['is_4411'].sum()
+    for (_, effets_lot), comptes in zip(lots, comptes_par_lot):
+        assert all(compte in comptes for compte, _ in effets_lot)
+    assert sum(len(effets_lot) for _, effets_lot in lots) == len(dict_paiements_effet)
+
+def test_rapprochement_parallele_identique_au_sequentiel():
+    sequentiel = traiter_rapprochement(grand_livre_genere(), fournisseurs_generes(), JOURNAUX_ACHAT, JOURNAUX_BANQUE)
+    for methode_demarrage in ('fork', 'forkserver'):
+        parallele = traiter_rapprochement(grand_livre_genere(), fournisseurs_generes(), JOURNAUX_ACHAT,
+                                          JOURNAUX_BANQUE, nb_processus=2, methode_demarrage=methode_demarrage)
+        pd.testing.assert_frame_equal(parallele, sequentiel)
+
+def test_rapprochement_incremental_identique_au_complet():
+    complet = traiter_rapprochement(grand_livre_genere(), fournisseurs_generes(), JOURNAUX_ACHAT, JOURNAUX_BANQUE)
+    brut = pd.read_csv(os.path.join(DONNEES, 'grand_livre.csv'), header=None)
+    # Période précédente : sans les deux dernières lignes d'un fournisseur
+    ajoutees = brut.index[brut[2] == 44110003][-2:]
+
+    _, etat, stats = traiter_rapprochement_incremental(grand_livre_genere(ajoutees), fournisseurs_generes(),
+                                                       JOURNAUX_ACHAT, JOURNAUX_BANQUE)
+    assert stats['comptes_recalcules'] == 8
+    resultats, etat, stats = traiter_rapprochement_incremental(grand_livre_genere(), fournisseurs_generes(),
+                                                               JOURNAUX_ACHAT, JOURNAUX_BANQUE, etat)
+    assert stats['comptes_recalcules'] == 1
+    assert stats['lignes_recalculees'] == (brut[2] == 44110003).sum()
+    pd.testing.assert_frame_equal(resultats, complet)
+
+    # Grand Livre inchangé : rien à recalculer ; paramètres changés : tout est recalculé
+    resultats, _, stats = traiter_rapprochement_incremental(grand_livre_genere(), fournisseurs_generes(),
+                                                            JOURNAUX_ACHAT, JOURNAUX_BANQUE, etat)
+    assert stats['comptes_recalcules'] == 0
+    pd.testing.assert_frame_equal(resultats, complet)
+    _, _, stats = traiter_rapprochement_incremental(grand_livre_genere(), fournisseurs_generes(),
+                                                    JOURNAUX_ACHAT, JOURNAUX_BANQUE + ['BQ2'], etat)
+    assert stats['comptes_recalcules'] == 8
+
+def test_groupes_de_lettrage_en_tranches_contigues():
+    positions = [10, 11, 12, 13, 14]
+    comptes = pd.Series(['44110001', '44110002', '44110001', '44110001', '44110002'], index=positions)
+    lettrages = pd.Series(['A', 'A', 'B', 'A', 'A'], index=positions)
+    montants = pd.Series([100, 200, 300, 400, 500], index=positions)
+    dates = pd.Series(pd.to_datetime(['2024-03-01', None, '2024-01-01', '2024-02-01', '2024-01-15']), index=positions)
+
+    # Groupes dans l'ordre de première apparition, lignes dans l'ordre du Grand Livre
+    ordre, groupes = grouper_par_lettrage(comptes, lettrages, montants)
+    assert ordre.tolist() == [10, 13, 11, 14, 12]
+    assert groupes == {('44110001', 'A'): (0, 2, 500), ('44110002', 'A'): (2, 4, 700), ('44110001', 'B'): (4, 5, 300)}
+
+    # Par date dans chaque groupe, dates manquantes en dernier
+    ordre, groupes_par_date = grouper_par_lettrage(comptes, lettrages, montants, dates)
+    assert ordre.tolist() == [13, 10, 14, 11, 12]
+    assert groupes_par_date == groupes
+
+    ordre, groupes = grouper_par_lettrage(comptes[:0], lettrages[:0], montants[:0])
+    assert len(ordre) == 0 and groupes == {}
+
+def test_paiement_au_montant_le_plus_proche():
+    index = index_par_montant([500, 300, 700, 300])
+
+    # À écart égal : le premier paiement dans l'ordre d'origine
+    assert [prendre_plus_proche(index, montant) for montant in (400, 400, 400, 650, 0)] == [0, 1, 3, 2, None]
+
+def test_paiement_au_montant_le_plus_proche_comme_une_recherche_complete():
+    aleatoire = random.Random(0)
+    for _ in range(50):
+        montants = [aleatoire.randint(1, 20) * 100 for _ in range(aleatoire.randint(1, 15))]
+        index = index_par_montant(montants)
+        disponibles = list(range(len(montants)))
+        for _ in range(len(montants) + 1):
+            montant = aleatoire.randint(0, 42) * 50
+            attendu = min(disponibles, key=lambda i: (abs(montants[i] - montant), i), default=None)
+            assert prendre_plus_proche(index, montant) == attendu
+            if attendu is not None:
+                disponibles.remove(attendu)